@@ -0,0 +1,105 @@
+"""
+Measures what the chunk memo and the .tiles archives of map-converter save.
+
+Encodes the chunks of maps with more and more noise, with and without a
+ChunkMemo, and checks that both give the same chunks. Then writes each map
+as a .npy grid and as a .tiles archive with every available codec, and
+times reading the archive back band by band.
+
+Usage: python benchmarks/bench_chunk_memo.py [--size 2048] [--repeat 5]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "map-converter"))
+import corpora  # noqa: E402
+import json2yaml  # noqa: E402
+import map_archive  # noqa: E402
+from chunk_memo import ChunkMemo  # noqa: E402
+from tile_loader import iter_bands, narrow_tile_map  # noqa: E402
+
+# Share of tiles replaced by a random tile: none, like corpora, all of them
+NOISE_LEVELS = (0.0, 0.05, 1.0)
+
+
+def time_chunks(tile_map, make_memo, repeat):
+    """Best time of `repeat` encodings, each with a new memo. Returns (chunks, memo, seconds)."""
+    best = None
+    for _ in range(repeat):
+        memo = make_memo()
+        start = time.perf_counter()
+        chunks = json2yaml.encode_chunks(tile_map, memo=memo)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return chunks, memo, best
+
+
+def available_codecs():
+    codecs = ["zlib"]
+    if map_archive.default_codec() == "zstd":
+        codecs.append("zstd")
+    return codecs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", type=int, default=2048)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=13)
+    args = parser.parse_args()
+
+    grids = {
+        noise: narrow_tile_map(corpora.tile_grid(args.size, args.seed, noise))
+        for noise in NOISE_LEVELS
+    }
+
+    print(f"{args.size}x{args.size} tiles, chunk encoding")
+    print(f"{'noise':>6} {'plain (s)':>10} {'memo (s)':>9} {'speedup':>8} {'reused':>8}")
+    for noise, tile_map in grids.items():
+        plain, _, plain_time = time_chunks(tile_map, lambda: None, args.repeat)
+        memoized, memo, memo_time = time_chunks(tile_map, ChunkMemo, args.repeat)
+        if memoized != plain:
+            sys.exit(f"The memo changed the chunks of the map with {noise:.0%} noise")
+        total = memo.hits + memo.misses
+        print(
+            f"{noise:>6.0%} {plain_time:>10.3f} {memo_time:>9.3f} "
+            f"{plain_time / memo_time:>7.2f}x {memo.hits / total:>7.1%}"
+        )
+
+    print()
+    print("Tile grid files")
+    print(
+        f"{'noise':>6} {'codec':>6} {'.npy':>10} {'.tiles':>10} {'ratio':>7} "
+        f"{'write (s)':>10} {'read (s)':>9}"
+    )
+    with tempfile.TemporaryDirectory(prefix="civ14-archive-") as tmp:
+        for noise, tile_map in grids.items():
+            npy_path = os.path.join(tmp, "grid.npy")
+            np.save(npy_path, tile_map)
+            npy_bytes = os.path.getsize(npy_path)
+            for codec in available_codecs():
+                path = os.path.join(tmp, f"grid.{codec}.tiles")
+                stats = map_archive.write_archive(path, tile_map, codec)
+                archive = map_archive.TileArchive(path)
+                start = time.perf_counter()
+                for first, band in iter_bands(archive, archive.band_rows):
+                    if not np.array_equal(band, tile_map[first : first + band.shape[0]]):
+                        sys.exit(f"The {codec} archive does not read back its grid")
+                read_time = time.perf_counter() - start
+                print(
+                    f"{noise:>6.0%} {codec:>6} {npy_bytes / 1e6:>8.2f}MB "
+                    f"{stats['archive_bytes'] / 1e6:>8.2f}MB "
+                    f"{npy_bytes / stats['archive_bytes']:>6.1f}x "
+                    f"{stats['seconds']:>10.3f} {read_time:>9.3f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
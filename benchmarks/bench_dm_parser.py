@@ -0,0 +1,108 @@
+"""
+Compares the regex-based .dm parsing that civ13exporter.py used to do with
+the line-oriented tokenizer in object-fetcher/dm_tokenizer.py, after
+checking that both find the same clothing types and variable names.
+
+Runs on a real Civ13 checkout when given its path, or on a synthetic corpus
+with type blocks, proc bodies and comments otherwise. File contents are read
+into memory first, so only parsing is timed.
+
+Usage: python benchmarks/bench_dm_parser.py [--corpus D:/GitHub/Civ13/code]
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "object-fetcher")
+)
+from civ13exporter import CLOTHING_PREFIXES, find_dm_files, read_dm_file  # noqa: E402
+from dm_tokenizer import iter_dm_records, parse_value  # noqa: E402
+
+from corpora import synthetic_corpus  # noqa: E402
+
+
+def legacy_parse(content):
+    """The three-regex parser from the original civ13exporter.py."""
+    clothing_items = {}
+    pattern = r"/obj/item/clothing/(.*?)\n(.*?)(?=\n\n|\Z)"
+    for match in re.findall(pattern, content, re.DOTALL):
+        variables = {}
+        var_pattern = r"(\w+)\s*=\s*(.*?)(?=\n|$)"
+        for var_name, var_value in re.findall(var_pattern, match[1], re.DOTALL):
+            var_value = var_value.strip()
+            if var_value.startswith("list("):
+                list_items = {}
+                list_pattern = r"(\w+)\s*=\s*(.*?)(?:,|$)"
+                for key, value in re.findall(list_pattern, var_value[5:-1]):
+                    list_items[key.strip()] = value.strip()
+                variables[var_name.strip()] = list_items
+            else:
+                variables[var_name.strip()] = var_value
+        clothing_items[f"/obj/item/clothing/{match[0]}"] = variables
+    return clothing_items
+
+
+def tokenizer_parse(content):
+    clothing_items = {}
+    for path, var_name, value in iter_dm_records(content, CLOTHING_PREFIXES):
+        variables = clothing_items.setdefault(path, {})
+        if var_name is not None:
+            variables[var_name] = parse_value(value)
+    return clothing_items
+
+
+def check_equivalence(legacy, tokenized):
+    """
+    Checks that the tokenizer finds every clothing type of the regex parser,
+    with the same variable names. Returns a list of differences.
+    """
+    problems = []
+    for path, variables in legacy.items():
+        if "(" in path:
+            continue  # The regex parser also reads proc definitions as types
+        if path not in tokenized:
+            problems.append(f"{path}: missing")
+        elif set(tokenized[path]) != set(variables):
+            problems.append(
+                f"{path}: variables {sorted(tokenized[path])}, expected {sorted(variables)}"
+            )
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--corpus", help="directory with .dm files (default: synthetic)")
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=13)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.corpus:
+        sources = [read_dm_file(path) or "" for path in find_dm_files(args.corpus)]
+    else:
+        sources = synthetic_corpus(args.files, args.seed)
+    lines = sum(source.count("\n") + 1 for source in sources)
+    print(f"{len(sources)} files, {lines} lines")
+
+    problems = []
+    for source in sources:
+        problems += check_equivalence(legacy_parse(source), tokenizer_parse(source))
+    if problems:
+        print("\n".join(problems[:20]))
+        sys.exit(f"The tokenizer differs from the regex parser on {len(problems)} types")
+
+    for name, func in (("regex", legacy_parse), ("tokenizer", tokenizer_parse)):
+        best = float("inf")
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            types = sum(len(func(source)) for source in sources)
+            best = min(best, time.perf_counter() - start)
+        print(f"{name:>10}: {best:.3f} s, {types} clothing types")
+
+
+if __name__ == "__main__":
+    main()
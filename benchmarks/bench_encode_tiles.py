@@ -0,0 +1,81 @@
+"""
+Compares the per-tile struct encoder against the vectorized chunk encoder
+in map-converter/json2yaml.py.
+
+Usage: python benchmarks/bench_encode_tiles.py [--sizes 256 1000 4096]
+"""
+
+import argparse
+import base64
+import os
+import struct
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "map-converter")
+)
+import json2yaml  # noqa: E402
+
+
+def legacy_encode_tiles(tile_map):
+    """The original one-tile-at-a-time encoder, kept as the reference."""
+    tile_bytes = bytearray()
+    for y in range(tile_map.shape[0]):
+        for x in range(tile_map.shape[1]):
+            tile_bytes.extend(struct.pack("<I", tile_map[y, x]))
+            tile_bytes.append(0)
+            tile_bytes.append(0)
+    return base64.b64encode(tile_bytes).decode("utf-8")
+
+
+def legacy_encode_chunks(tile_map, chunk_size=16):
+    """The original chunk loop from generate_main_entities."""
+    h, w = tile_map.shape
+    chunks = {}
+    for cy in range(0, h, chunk_size):
+        for cx in range(0, w, chunk_size):
+            chunk_tiles = tile_map[cy : cy + chunk_size, cx : cx + chunk_size]
+            if chunk_tiles.shape[0] < chunk_size or chunk_tiles.shape[1] < chunk_size:
+                full_chunk = np.zeros((chunk_size, chunk_size), dtype=np.int32)
+                full_chunk[: chunk_tiles.shape[0], : chunk_tiles.shape[1]] = chunk_tiles
+                chunk_tiles = full_chunk
+            chunks[f"{cx//chunk_size},{cy//chunk_size}"] = legacy_encode_tiles(
+                chunk_tiles
+            )
+    return chunks
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[256, 1000, 4096])
+    parser.add_argument("--seed", type=int, default=13)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    print(f"{'size':>6} {'legacy (s)':>12} {'vectorized (s)':>15} {'speedup':>9}")
+    for size in args.sizes:
+        tile_map = rng.choice(list(json2yaml.TILEMAP), size=(size, size)).astype(
+            np.int32
+        )
+        legacy, legacy_time = timed(legacy_encode_chunks, tile_map)
+        vectorized, vectorized_time = timed(json2yaml.encode_chunks, tile_map)
+        for key, tiles in legacy.items():
+            if vectorized[key]["tiles"] != tiles:
+                sys.exit(f"Mismatch in chunk {key} for size {size}")
+        print(
+            f"{size:>6} {legacy_time:>12.3f} {vectorized_time:>15.3f} "
+            f"{legacy_time / vectorized_time:>8.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Converts a map larger than the memory it is allowed to use.
+
+Writes a SIZExSIZE uint8 .npy grid (an ocean with floor islands), then runs
+json2yaml.py on it with its address space limited the way `ulimit -v` does:
+to what a small conversion needs plus --headroom MB, which is less than the
+grid itself. Before that, it checks that loading the grid whole fails under
+the same limit, so the conversion can only pass by reading it band by band.
+
+Linux only (the limit is RLIMIT_AS, the peaks come from /proc).
+
+Usage: python benchmarks/bench_large_map.py [--size 12288] [--headroom 64]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MAP_CONVERTER = os.path.join(HERE, "..", "map-converter")
+# Ocean (deep water, id 0) with islands of these floor tiles
+ISLAND_TILES = (2, 3, 4, 6, 10)
+CONVERT_OPTIONS = ["--no-tile-entities", "--sparse-atmosphere", "--output", os.devnull]
+
+# Runs json2yaml (or loads the grid whole with "--load") and prints the peaks
+CHILD = """
+import sys
+sys.path.insert(0, {path!r})
+if sys.argv[1] == "--load":
+    import numpy as np
+    np.load(sys.argv[2]).astype(np.int32)
+else:
+    import json2yaml
+    json2yaml.main(sys.argv[1:])
+with open("/proc/self/status") as f:
+    for line in f:
+        if line.startswith(("VmPeak", "VmHWM")):
+            print(line.strip())
+"""
+
+
+def write_grid(path, size, seed):
+    """Writes the grid band by band, without holding it in memory."""
+    rng = np.random.default_rng(seed)
+    grid = np.lib.format.open_memmap(path, mode="w+", dtype=np.uint8, shape=(size, size))
+    band = 1024
+    for y in range(0, size, band):
+        rows = grid[y : y + band]
+        rows[:] = 0
+        for _ in range(max(1, size // 512)):
+            top, left = rng.integers(0, rows.shape[0]), rng.integers(0, size)
+            h, w = rng.integers(16, 256, 2)
+            rows[top : top + h, left : left + w] = rng.choice(ISLAND_TILES)
+    grid.flush()
+    del grid
+
+
+def run_child(args, limit=None):
+    """Runs CHILD with the address space limit. Returns (returncode, peaks, output, seconds)."""
+
+    def set_limit():
+        import resource
+
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+    env = dict(os.environ, OPENBLAS_NUM_THREADS="1", OMP_NUM_THREADS="1", MKL_NUM_THREADS="1")
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-c", CHILD.format(path=os.path.abspath(MAP_CONVERTER)), *args],
+        env=env,
+        preexec_fn=set_limit if limit else None,
+        capture_output=True,
+        text=True,
+    )
+    seconds = time.perf_counter() - start
+    peaks = {}
+    for line in result.stdout.splitlines():
+        name, _, value = line.partition(":")
+        if name in ("VmPeak", "VmHWM"):
+            peaks[name] = int(value.split()[0]) * 1024
+    return result.returncode, peaks, result.stdout + result.stderr, seconds
+
+
+def megabytes(value):
+    return f"{value / (1024 * 1024):.0f} MB"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", type=int, default=12288, help="map edge in tiles")
+    parser.add_argument(
+        "--headroom",
+        type=int,
+        default=64,
+        help="MB of address space allowed over a small conversion (default: 64)",
+    )
+    parser.add_argument("--seed", type=int, default=13)
+    args = parser.parse_args()
+    if not sys.platform.startswith("linux"):
+        sys.exit("This check needs Linux (RLIMIT_AS and /proc)")
+
+    with tempfile.TemporaryDirectory(prefix="civ14-large-map-") as tmp:
+        small = os.path.join(tmp, "small.npy")
+        large = os.path.join(tmp, "large.npy")
+        write_grid(small, 256, args.seed)
+        write_grid(large, args.size, args.seed)
+        grid_bytes = os.path.getsize(large)
+
+        code, peaks, output, _ = run_child([small, *CONVERT_OPTIONS])
+        if code != 0:
+            sys.exit(f"The small conversion failed:\n{output}")
+        limit = peaks["VmPeak"] + args.headroom * 1024 * 1024
+        print(
+            f"{args.size}x{args.size} grid: {megabytes(grid_bytes)}; "
+            f"limit: {megabytes(limit)} (ulimit -v {limit // 1024}), "
+            f"{args.headroom} MB over a small conversion"
+        )
+
+        code, _, _, _ = run_child(["--load", large], limit)
+        if code == 0:
+            sys.exit("Loading the whole grid fit in the limit; use a larger --size")
+        print("Loading the whole grid under the limit fails, as expected")
+
+        code, peaks, output, seconds = run_child([large, *CONVERT_OPTIONS], limit)
+        if code != 0:
+            print(output)
+            sys.exit("The conversion failed under the limit")
+        print(
+            f"Converted under the limit in {seconds:.1f} s: peak address space "
+            f"{megabytes(peaks['VmPeak'])}, peak RSS {megabytes(peaks['VmHWM'])}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Checks and times the streaming map writer of map-converter against PyYAML.
+
+Builds the map document of a PNG (map-converter/test.png by default) the
+way png2yaml.py does, with the keys.json tile entities, once with the dense
+atmosphere and once with --sparse-atmosphere. Each document is written with
+write_map_yaml and, fully materialized, with yaml.dump and the shared
+ss14_yaml Dumper. The two texts must be identical and the written map must
+load back into the same data, or the script exits before timing anything.
+
+Usage: python benchmarks/bench_map_writer.py [--png map-converter/test.png] [--repeat 3]
+"""
+
+import argparse
+import io
+import os
+import sys
+import time
+
+import yaml
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "map-converter"))
+import json2yaml  # noqa: E402
+import png2yaml  # noqa: E402
+from map_writer import StreamedMapping, StreamedSequence, ss14_yaml, write_map_yaml  # noqa: E402
+
+
+def materialize(value):
+    """A copy of a map document with every streamed value expanded."""
+    if isinstance(value, StreamedMapping):
+        return {key: materialize(item) for key, item in value}
+    if isinstance(value, dict):
+        return {key: materialize(item) for key, item in value.items()}
+    if isinstance(value, (list, StreamedSequence)):
+        return [materialize(item) for item in value]
+    return value
+
+
+def write_streamed(data):
+    stream = io.StringIO()
+    write_map_yaml(stream, data)
+    return stream.getvalue()
+
+
+def dump_plain(data):
+    return yaml.dump(data, Dumper=ss14_yaml.Dumper, sort_keys=False)
+
+
+def check_round_trip(name, data):
+    """Exits if write_map_yaml does not match yaml.dump, or its output does not load back."""
+    plain = materialize(data)
+    written = write_streamed(data)
+    expected = dump_plain(plain)
+    if written != expected:
+        for number, (got, want) in enumerate(
+            zip(written.splitlines(), expected.splitlines()), 1
+        ):
+            if got != want:
+                sys.exit(f"{name}: line {number} differs:\n  writer: {got}\n  PyYAML: {want}")
+        sys.exit(f"{name}: {len(written)} characters written, PyYAML writes {len(expected)}")
+    if ss14_yaml.load(written) != plain:
+        sys.exit(f"{name}: the written map does not load back into the same data")
+    return plain, written
+
+
+def best_time(function, argument, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(argument)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--png", default=os.path.join(HERE, "..", "map-converter", "test.png")
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    tile_map, unknown = png2yaml.png_to_tile_map(args.png)
+    tile_entities = json2yaml.load_tile_entities()
+    print(f"{args.png}: {tile_map.shape[1]}x{tile_map.shape[0]} tiles, {unknown} unknown pixels")
+    print(f"{'atmosphere':<11} {'MB':>6} {'writer (s)':>11} {'PyYAML (s)':>11} {'speedup':>8}")
+    for name, sparse in (("dense", False), ("sparse", True)):
+        data = json2yaml.build_map_data(
+            tile_map, sparse_atmosphere=sparse, tile_entities=tile_entities
+        )
+        plain, written = check_round_trip(name, data)
+        writer_time = best_time(write_streamed, data, args.repeat)
+        pyyaml_time = best_time(dump_plain, plain, args.repeat)
+        print(
+            f"{name:<11} {len(written) / 1e6:>6.2f} {writer_time:>11.3f} "
+            f"{pyyaml_time:>11.3f} {pyyaml_time / writer_time:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Compares the json.load/json.dump merge that exporter_matcher.py used to do
+with its streaming merge, in time and peak Python memory (tracemalloc).
+
+Runs on a synthetic OpenDream dump with a "Types" list and some other large
+top-level entries, or on real files when --items and --clothing are given.
+
+Usage: python benchmarks/bench_merge.py [--types 50000]
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "object-fetcher")
+)
+from exporter_matcher import merge_clothing_data  # noqa: E402
+
+from corpora import synthetic_files  # noqa: E402
+
+
+def legacy_merge(clothing_file, item_file, output_file):
+    """The in-memory merge from the original exporter_matcher.py."""
+    with open(clothing_file, "r", encoding="utf-8") as f:
+        clothing_data = json.load(f)
+    with open(item_file, "r", encoding="utf-8") as f:
+        item_data = json.load(f)
+    for item in item_data.get("Types", []):
+        path = item.get("Path")
+        if path and path in clothing_data:
+            armor_data = clothing_data[path].get("armor")
+            if armor_data:
+                if "Variables" not in item:
+                    item["Variables"] = {}
+                item["Variables"]["armor"] = armor_data
+    with open(output_file, "w", encoding="utf-8") as f:
+        json.dump(item_data, f, indent=2, ensure_ascii=False)
+
+
+def peak_memory(func, *args):
+    tracemalloc.start()
+    func(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--types", type=int, default=50000)
+    parser.add_argument("--seed", type=int, default=13)
+    parser.add_argument("--clothing", help="clothing_items.json (default: synthetic)")
+    parser.add_argument("--items", help="civ13.json or civ13_item.json (default: synthetic)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.clothing and args.items:
+            clothing_file, item_file = args.clothing, args.items
+        else:
+            clothing_file, item_file = synthetic_files(tmp, args.types, args.seed)
+        size = os.path.getsize(item_file) / 1e6
+        print(f"item file: {size:.1f} MB")
+        outputs = {}
+        for name, func in (("json.load", legacy_merge), ("streaming", merge_clothing_data)):
+            outputs[name] = os.path.join(tmp, f"{name}.json")
+            # Timed without tracemalloc, which slows allocations down a lot
+            start = time.perf_counter()
+            func(clothing_file, item_file, outputs[name])
+            elapsed = time.perf_counter() - start
+            peak = peak_memory(func, clothing_file, item_file, outputs[name])
+            print(f"{name:>10}: {elapsed:.2f} s, peak {peak / 1e6:.1f} MB")
+        with open(outputs["json.load"], "rb") as a, open(outputs["streaming"], "rb") as b:
+            print("outputs identical:", a.read() == b.read())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+Measures how chunk encoding in map-converter/json2yaml.py scales with the
+number of worker processes.
+
+Usage: python benchmarks/bench_parallel_chunks.py [--size 4096] [--max-workers N]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "map-converter")
+)
+import json2yaml  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", type=int, default=4096)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--seed", type=int, default=13)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    tile_map = rng.choice(list(json2yaml.TILEMAP), size=(args.size, args.size))
+    tile_map = tile_map.astype(np.int32)
+
+    reference = None
+    baseline = None
+    print(f"{'workers':>8} {'time (s)':>10} {'speedup':>9}")
+    counts = sorted(
+        {2**i for i in range(args.max_workers.bit_length())} | {args.max_workers}
+    )
+    for workers in counts:
+        start = time.perf_counter()
+        chunks = list(json2yaml.iter_map_chunks(tile_map, workers=workers))
+        elapsed = time.perf_counter() - start
+        if reference is None:
+            reference, baseline = chunks, elapsed
+        elif chunks != reference:
+            sys.exit(f"Output with {workers} workers differs from the serial one")
+        print(f"{workers:>8} {elapsed:>10.3f} {baseline / elapsed:>8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Compares the two-step PNG -> JSON -> YAML map pipeline with png2yaml.py.
+
+The image2map.js step is emulated in Python (same pretty-printed
+"x,y": id JSON), so the comparison runs without Node and canvas.
+
+Usage: python benchmarks/bench_png_pipeline.py [--sizes 256 1000 2048]
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "map-converter")
+)
+import json2yaml  # noqa: E402
+import png2yaml  # noqa: E402
+from tile_loader import load_tile_map  # noqa: E402
+
+
+def make_png(path, size, color_keys, rng):
+    """Writes a palette PNG with random blobs of the keys.json colors."""
+    colors = np.array(list(color_keys), dtype=np.uint32)
+    coarse = rng.integers(0, len(colors), size=(size // 8 + 1, size // 8 + 1))
+    indices = np.kron(coarse, np.ones((8, 8), dtype=coarse.dtype))[:size, :size]
+    image = Image.frombytes("P", (size, size), indices.astype(np.uint8).tobytes())
+    palette = np.stack([(colors >> 16) & 255, (colors >> 8) & 255, colors & 255], 1)
+    image.putpalette(palette.astype(np.uint8).ravel().tolist())
+    image.save(path)
+
+
+def two_step(png_path, json_path, yml_dir):
+    # image2map.js: one pretty-printed "x,y": id entry per pixel
+    tile_map, _ = png2yaml.png_to_tile_map(png_path)
+    h, w = tile_map.shape
+    rows = tile_map.tolist()
+    tile_json = {f"{x},{y}": rows[y][x] for y in range(h) for x in range(w)}
+    with open(json_path, "w") as f:
+        json.dump({"tileMap": tile_json, "entityMap": {}}, f, indent=2)
+    del tile_json
+    # json2yaml.py
+    json2yaml.save_map_to_yaml(load_tile_map(json_path), yml_dir, "two_step.yml")
+
+
+def direct(png_path, yml_dir):
+    tile_map, _ = png2yaml.png_to_tile_map(png_path)
+    json2yaml.save_map_to_yaml(tile_map, yml_dir, "direct.yml")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[256, 1000])
+    parser.add_argument("--seed", type=int, default=13)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    color_keys = png2yaml.load_color_keys()
+    print(f"{'size':>6} {'two-step (s)':>13} {'direct (s)':>11} {'json (MB)':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            png_path = os.path.join(tmp, "map.png")
+            json_path = os.path.join(tmp, "output.json")
+            make_png(png_path, size, color_keys, rng)
+
+            start = time.perf_counter()
+            two_step(png_path, json_path, tmp)
+            two_step_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            direct(png_path, tmp)
+            direct_time = time.perf_counter() - start
+
+            json_mb = os.path.getsize(json_path) / 1e6
+            print(f"{size:>6} {two_step_time:>13.3f} {direct_time:>11.3f} {json_mb:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
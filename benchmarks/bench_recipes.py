@@ -0,0 +1,94 @@
+"""
+Compares the split(",") recipe parsing recipe-converter.py used to do with
+the csv-based reader that converts the columns into Recipe records.
+
+Runs on a real material_recipes_global.txt when given one, or on a
+synthetic recipe table otherwise. The file is read into memory first, so
+only parsing is timed.
+
+Usage: python benchmarks/bench_recipes.py [--file D:/GitHub/Civ13/config/crafting/material_recipes_global.txt]
+"""
+
+import argparse
+import importlib.util
+import io
+import os
+import time
+
+from corpora import synthetic_recipes
+
+_path = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "recipe-converter", "recipe-converter.py"
+)
+_spec = importlib.util.spec_from_file_location("recipe_converter", _path)
+recipe_converter = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(recipe_converter)
+
+
+def legacy_parse(stream):
+    """The split(",") parser from the previous recipe-converter.py, grouping by material."""
+    columns = (("res_amount", 3, float), ("time", 4, float), ("age1", 8, int), ("age2", 9, int))
+    columns += (("age3", 10, int), ("last_age", 11, int))
+    all_recipes = []
+    by_material = {}
+    errors = []
+    for line_number, line in enumerate(stream, 1):
+        line = line.replace("\n", "")
+        if line.find("RECIPE: ", 0, 10) == -1:
+            continue
+        tline = line.replace("RECIPE: ", "")
+        fields = tline.split(",")
+        if len(fields) != 13:
+            errors.append(line_number)
+            continue
+        numbers = {}
+        try:
+            for key, column, convert in columns:
+                numbers[key] = convert(fields[column])
+        except ValueError:
+            errors.append(line_number)
+            continue
+        recipe = {
+            "name": fields[1],
+            "template_name": fields[2],
+            "res_amount": int(numbers["res_amount"]),
+            "time": int(numbers["time"] * 100),
+            "category": fields[7],
+            "age1": numbers["age1"],
+            "age2": numbers["age2"],
+            "age3": numbers["age3"],
+            "last_age": numbers["last_age"],
+            "material": fields[0].replace("/material/", "").replace("/", ""),
+        }
+        all_recipes.append(recipe)
+        by_material.setdefault(recipe["material"], []).append(recipe)
+    return all_recipes, by_material, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--file", help="a recipe list (default: synthetic)")
+    parser.add_argument("--recipes", type=int, default=200000)
+    parser.add_argument("--seed", type=int, default=13)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, "r") as f:
+            text = f.read()
+    else:
+        text = synthetic_recipes(args.recipes, args.seed)
+    print(f"{text.count(chr(10))} lines, {len(text) / 1e6:.1f} MB")
+
+    for name, parse in (("split", legacy_parse), ("csv", recipe_converter.parse_recipes)):
+        best = float("inf")
+        for _ in range(args.repeat):
+            result = None  # free the last result outside the timing
+            start = time.perf_counter()
+            result = parse(io.StringIO(text))
+            best = min(best, time.perf_counter() - start)
+        print(f"{name:>6}: {best:.3f} s, {len(result[0])} recipes, {len(result[2])} errors")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Compares loading and dumping prototype files with the pure-Python PyYAML
+classes and with the shared common/ss14_yaml.py layer (libyaml when
+available). Both understand `!type:` tags, so real SS14 prototypes load.
+
+Runs on a directory of .yml files when given one (the largest is the
+Civ14 checkout's Resources/Prototypes), or on a synthetic prototype set
+otherwise. Files are read into memory first, so only YAML work is timed.
+
+Usage: python benchmarks/bench_yaml.py [--dir D:/GitHub/civ14/Resources/Prototypes]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import yaml
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common")
+)
+import ss14_yaml  # noqa: E402
+from corpora import synthetic_prototypes  # noqa: E402
+
+
+class PureLoader(yaml.SafeLoader):
+    pass
+
+
+class PureDumper(yaml.SafeDumper):
+    pass
+
+
+PureLoader.add_multi_constructor(ss14_yaml.TYPE_TAG_PREFIX, ss14_yaml.construct_type_tag)
+PureDumper.add_representer(dict, ss14_yaml.represent_type_tags)
+
+
+def read_directory(directory):
+    sources = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if name.endswith(".yml"):
+                with open(os.path.join(root, name), "r", encoding="utf-8") as f:
+                    sources.append(f.read())
+    return sources
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--dir", help="directory of .yml files (default: synthetic)")
+    parser.add_argument("--files", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=13)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    sources = read_directory(args.dir) if args.dir else synthetic_prototypes(args.files, args.seed)
+    size = sum(len(source) for source in sources) / 1e6
+    print(f"{len(sources)} files, {size:.1f} MB, libyaml: {ss14_yaml.LIBYAML}")
+
+    for name, loader, dumper in (
+        ("pure Python", PureLoader, PureDumper),
+        ("ss14_yaml", ss14_yaml.Loader, ss14_yaml.Dumper),
+    ):
+        load_time = dump_time = float("inf")
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            documents = [yaml.load(source, Loader=loader) for source in sources]
+            load_time = min(load_time, time.perf_counter() - start)
+            start = time.perf_counter()
+            for document in documents:
+                yaml.dump(document, Dumper=dumper, **ss14_yaml.DUMP_DEFAULTS)
+            dump_time = min(dump_time, time.perf_counter() - start)
+        print(f"{name:>12}: load {load_time:.2f} s, dump {dump_time:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
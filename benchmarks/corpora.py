@@ -0,0 +1,215 @@
+"""
+Deterministic synthetic inputs shaped like the Civ13 and Civ14 files the
+tools read. The same seed always gives the same data, so timings of
+different runs (and of different versions of a tool) are comparable.
+"""
+
+import json
+import os
+import random
+import sys
+
+import numpy as np
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common")
+)
+import ss14_yaml  # noqa: E402
+
+# Tile ids of json2yaml.TILEMAP and keys.json (0, 1 and 9 are water)
+TILE_IDS = (0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10)
+MATERIALS = ("wood", "stone", "iron", "steel", "copper", "bronze", "gold", "leather", "cloth")
+CATEGORIES = ("weapons", "tools", "furniture", "clothing", "decorations")
+
+
+def tile_grid(size, seed, noise=0.05):
+    """A size x size grid of tile ids, with large regions like a real map and some noise."""
+    rng = np.random.default_rng(seed)
+    # Regions of 64x64 tiles with one base tile each
+    regions = -(-size // 64)
+    base = rng.choice(TILE_IDS, size=(regions, regions)).astype(np.int32)
+    grid = np.kron(base, np.ones((64, 64), dtype=np.int32))[:size, :size]
+    noisy = rng.random((size, size)) < noise
+    grid[noisy] = rng.choice(TILE_IDS, size=int(noisy.sum()))
+    return np.ascontiguousarray(grid)
+
+
+def tile_map_json(grid):
+    """The image2map.js JSON of a grid: one "x,y" key per tile."""
+    ys, xs = np.indices(grid.shape)
+    keys = (f"{x},{y}" for x, y in zip(xs.ravel().tolist(), ys.ravel().tolist()))
+    return json.dumps({"tileMap": dict(zip(keys, grid.ravel().tolist()))})
+
+
+def synthetic_corpus(files, seed):
+    """Returns a list of .dm sources shaped like Civ13 code."""
+    rng = random.Random(seed)
+    kinds = ["suit", "head", "shoes", "under", "mask", "gloves", "accessory"]
+    sources = []
+    for f in range(files):
+        lines = ["// Synthetic file %d" % f, "#define FILE_%d 1" % f, ""]
+        for o in range(rng.randint(5, 40)):
+            base = f"/obj/item/clothing/{rng.choice(kinds)}/item_{f}_{o}"
+            if o % 4 == 0:
+                # A {" "} text block over two lines, with quotes inside
+                desc = ['\tdesc = {"A sturdy piece of clothing,', 'made to "last"."}']
+            else:
+                desc = ['\tdesc = "A sturdy piece of clothing, made to last."']
+            lines += [
+                base,
+                f'\tname = "item {f} {o}"',
+                *desc,
+                f"\tarmor = list(melee = {rng.randint(0, 80)}, arrow = 5, gun = 2, "
+                "energy = 0, bomb = 10, bio = 0, rad = 0)",
+                f"\tslowdown = {rng.random():.2f}",
+                "\tvar/list/extra = list(\"a\", \"b\")",
+                "",
+                f"{base}/New()",
+                "\t..()",
+            ]
+            for i in range(rng.randint(5, 30)):
+                lines.append(f"\tif (src.w_class == {i}) // check the size")
+                lines.append(f"\t\tsrc.desc = \"[src.desc] ({i})\"")
+            lines += ["", "/obj/structure/thing_%d_%d" % (f, o), "\tanchored = TRUE", ""]
+        sources.append("\n".join(lines))
+    return sources
+
+def write_dm_tree(directory, files, seed):
+    """Writes synthetic_corpus() as a tree of .dm files (20 per folder). Returns their paths."""
+    paths = []
+    for i, source in enumerate(synthetic_corpus(files, seed)):
+        folder = os.path.join(directory, f"d{i // 20}")
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"f{i}.dm")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(source)
+        paths.append(path)
+    return paths
+
+
+def synthetic_files(directory, types, seed):
+    rng = random.Random(seed)
+    clothing = {}
+    for i in range(types // 10):
+        clothing[f"/obj/item/clothing/suit/s{i}"] = {
+            "name": f"suit {i}",
+            "armor": {"melee": rng.randint(0, 80), "arrow": 5, "gun": 2},
+            "slowdown": round(rng.random(), 2),
+        }
+    entries = []
+    for i in range(types):
+        path = f"/obj/item/clothing/suit/s{i}" if i % 3 == 0 else f"/obj/thing/t{i}"
+        entries.append(
+            {
+                "Path": path,
+                "Parent": "/obj",
+                "Variables": {"name": f"thing {i}", "icon_state": "x", "w_class": 2},
+                "Procs": [rng.randint(0, 10000) for _ in range(8)],
+            }
+        )
+    document = {
+        "Metadata": {"Version": 1},
+        "Strings": [f"string {i}" for i in range(types)],
+        "Types": entries,
+        "Procs": [{"Name": f"p{i}", "Bytecode": list(range(20))} for i in range(types // 4)],
+    }
+    clothing_file = os.path.join(directory, "clothing_items.json")
+    item_file = os.path.join(directory, "civ13.json")
+    with open(clothing_file, "w", encoding="utf-8") as f:
+        json.dump(clothing, f)
+    with open(item_file, "w", encoding="utf-8") as f:
+        json.dump(document, f)
+    return clothing_file, item_file
+
+
+def synthetic_recipes(count, seed):
+    rng = random.Random(seed)
+    lines = ["// material recipes", ""]
+    for i in range(count):
+        material = rng.choice(MATERIALS)
+        name = f"{material} thing {i}"
+        if rng.random() < 0.05:
+            name = f'"{material} thing, {i}"'
+        ages = sorted(rng.randint(0, 8) for _ in range(3))
+        lines.append(
+            f"RECIPE: /material/{material},{name},/obj/item/{material}/thing{i},"
+            f"{rng.randint(1, 30)},{rng.randint(10, 200) / 10},none,none,"
+            f"{rng.choice(CATEGORIES)},{ages[0]},{ages[1]},{ages[2]},8,0"
+        )
+    return "\n".join(lines) + "\n"
+
+
+def synthetic_prototypes(files, seed):
+    rng = random.Random(seed)
+    sources = []
+    for f in range(files):
+        prototypes = []
+        for p in range(rng.randint(20, 60)):
+            prototypes.append(
+                {
+                    "type": "entity",
+                    "parent": "ClothingOuterBase",
+                    "id": f"civ13_item_{f}_{p}",
+                    "name": f"item {f} {p}",
+                    "description": "A sturdy piece of clothing, made to last.",
+                    "components": [
+                        {"type": "Sprite", "sprite": f"Civ14/Clothing/item_{p}.rsi"},
+                        {
+                            "type": "Armor",
+                            "modifiers": {
+                                "coefficients": {
+                                    "Blunt": round(rng.random(), 2),
+                                    "Slash": round(rng.random(), 2),
+                                    "Piercing": round(rng.random(), 2),
+                                }
+                            },
+                        },
+                        {
+                            "type": "Destructible",
+                            "thresholds": [
+                                {
+                                    "trigger": {"!type:DamageTrigger": {"damage": 50}},
+                                    "behaviors": [
+                                        {"!type:DoActsBehavior": {"acts": ["Destruction"]}},
+                                        {
+                                            "!type:PlaySoundBehavior": {
+                                                "sound": {
+                                                    "!type:SoundPathSpecifier": {
+                                                        "path": "/Audio/Effects/woodhit.ogg"
+                                                    }
+                                                }
+                                            }
+                                        },
+                                    ],
+                                }
+                            ],
+                        },
+                    ],
+                }
+            )
+        sources.append(ss14_yaml.dump(prototypes))
+    return sources
+
+
+def duplicated_prototypes(files, seed, duplicates=0.1):
+    """
+    Like synthetic_prototypes(), but a share of the prototypes reuse an id
+    seen before: half of them as exact copies, half with other content, as
+    checkduplicates.py finds in generated files.
+    """
+    rng = random.Random(seed)
+    seen = []
+    sources = []
+    for source in synthetic_prototypes(files, seed):
+        prototypes = []
+        for prototype in ss14_yaml.load(source):
+            if seen and rng.random() < duplicates:
+                original = rng.choice(seen)
+                if rng.random() < 0.5:
+                    prototype = json.loads(json.dumps(original))
+                else:
+                    prototype["id"] = original["id"]
+            seen.append(prototype)
+            prototypes.append(prototype)
+        sources.append(ss14_yaml.dump(prototypes))
+    return sources
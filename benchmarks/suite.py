@@ -0,0 +1,326 @@
+"""
+Times the hot functions of the Python tools on synthetic inputs and
+compares them with stored baselines.
+
+Inputs come from corpora.py and are the same for a given scale and seed:
+
+    scale    tile grid   .dm files   recipe lines   prototype files
+    small      256^2        100          5 000             20
+    medium    1024^2        500         20 000            100
+    large     4096^2       2000        100 000            400
+
+Every case runs --repeat times and its best time is kept. With a baseline
+for the scale in baselines.json, a case that is more than --threshold
+slower than its baseline is a regression and the exit code is 1; cases
+with no baseline are listed and not compared.
+Baselines depend on the machine: record your own with --save-baseline
+before measuring a change.
+
+Usage: python benchmarks/suite.py [--scale small] [--cases 'recipe*'] [--save-baseline]
+"""
+
+import argparse
+import contextlib
+import fnmatch
+import importlib.util
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+for folder in ("map-converter", "object-fetcher", "common"):
+    sys.path.insert(0, os.path.join(HERE, "..", folder))
+
+import corpora  # noqa: E402
+import json2yaml  # noqa: E402
+import ss14_yaml  # noqa: E402
+from checkduplicates import DuplicateResolver, handle_entities_structure  # noqa: E402
+from civ13exporter import find_object_types, parse_dm_file  # noqa: E402
+from tile_loader import load_tile_map  # noqa: E402
+
+_spec = importlib.util.spec_from_file_location(
+    "recipe_converter", os.path.join(HERE, "..", "recipe-converter", "recipe-converter.py")
+)
+recipe_converter = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(recipe_converter)
+
+BASELINE_VERSION = 1
+DEFAULT_BASELINES = os.path.join(HERE, "baselines.json")
+SCALES = {
+    "small": {"grid": 256, "dm_files": 100, "recipes": 5000, "prototype_files": 20},
+    "medium": {"grid": 1024, "dm_files": 500, "recipes": 20000, "prototype_files": 100},
+    "large": {"grid": 4096, "dm_files": 2000, "recipes": 100000, "prototype_files": 400},
+}
+# Differences below this are noise, whatever the ratio
+NOISE_FLOOR = 0.005
+
+
+class Corpus:
+    """The synthetic inputs of one scale, generated on first use."""
+
+    def __init__(self, scale, seed, directory):
+        self.scale = scale
+        self.seed = seed
+        self.directory = directory
+        self._cache = {}
+
+    def _get(self, name, make):
+        if name not in self._cache:
+            self._cache[name] = make()
+        return self._cache[name]
+
+    def grid(self):
+        return self._get("grid", lambda: corpora.tile_grid(self.scale["grid"], self.seed))
+
+    def tile_json(self):
+        def make():
+            path = os.path.join(self.directory, "tilemap.json")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(corpora.tile_map_json(self.grid()))
+            return path
+
+        return self._get("tile_json", make)
+
+    def dm_directory(self):
+        def make():
+            path = os.path.join(self.directory, "dm")
+            corpora.write_dm_tree(path, self.scale["dm_files"], self.seed)
+            return path
+
+        return self._get("dm", make)
+
+    def recipes(self):
+        return self._get(
+            "recipes", lambda: corpora.synthetic_recipes(self.scale["recipes"], self.seed)
+        )
+
+    def prototypes(self):
+        return self._get(
+            "prototypes",
+            lambda: corpora.duplicated_prototypes(self.scale["prototype_files"], self.seed),
+        )
+
+
+# name -> setup(corpus) returning run() or (prepare(), run(prepared))
+CASES = {}
+
+
+def case(name):
+    def register(setup):
+        CASES[name] = setup
+        return setup
+
+    return register
+
+
+@case("json2yaml.load_tile_map")
+def _load_tile_map(corpus):
+    path = corpus.tile_json()
+    return lambda: load_tile_map(path)
+
+
+@case("json2yaml.encode_tiles")
+def _encode_tiles(corpus):
+    packed = json2yaml.pack_tiles(corpus.grid())
+    return lambda: json2yaml.encode_tiles(packed)
+
+
+@case("json2yaml.encode_chunks")
+def _encode_chunks(corpus):
+    grid = corpus.grid()
+    return lambda: json2yaml.encode_chunks(grid)
+
+
+@case("json2yaml.generate_main_entities")
+def _generate_main_entities(corpus):
+    grid = corpus.grid()
+    return lambda: json2yaml.generate_main_entities(grid)
+
+
+@case("json2yaml.save_map_to_yaml")
+def _save_map_to_yaml(corpus):
+    grid = corpus.grid()
+    tile_entities = json2yaml.load_tile_entities()
+    return lambda: json2yaml.save_map_to_yaml(
+        grid, corpus.directory, "map.yml", tile_entities=tile_entities
+    )
+
+
+@case("civ13exporter.parse_dm_file")
+def _parse_dm_file(corpus):
+    directory = corpus.dm_directory()
+    paths = sorted(
+        os.path.join(root, name)
+        for root, _, names in os.walk(directory)
+        for name in names
+        if name.endswith(".dm")
+    )
+    return lambda: [parse_dm_file(path) for path in paths]
+
+
+@case("civ13exporter.find_object_types")
+def _find_object_types(corpus):
+    directory = corpus.dm_directory()
+    return lambda: find_object_types(directory, jobs=1)
+
+
+@case("recipe_converter.parse_recipes")
+def _parse_recipes(corpus):
+    text = corpus.recipes()
+    return lambda: recipe_converter.parse_recipes(io.StringIO(text))
+
+
+@case("ss14_yaml.load")
+def _yaml_load(corpus):
+    sources = corpus.prototypes()
+    return lambda: [ss14_yaml.load(source) for source in sources]
+
+
+@case("checkduplicates.handle_entities_structure")
+def _handle_entities_structure(corpus):
+    sources = corpus.prototypes()
+
+    def prepare():
+        return [{"entities": ss14_yaml.load(source)} for source in sources]
+
+    def run(documents):
+        resolver = DuplicateResolver()
+        for i, document in enumerate(documents):
+            handle_entities_structure(document, resolver, f"file{i}.yml")
+
+    return prepare, run
+
+
+def time_case(setup, corpus, repeat):
+    """Runs a case `repeat` times. Returns the best time in seconds."""
+    bench = setup(corpus)
+    prepare, run = bench if isinstance(bench, tuple) else (None, lambda _: bench())
+    best = float("inf")
+    for _ in range(repeat):
+        prepared = prepare() if prepare else None
+        # The tools print their progress; keep it out of the table
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            run(prepared)
+            best = min(best, time.perf_counter() - start)
+    return best
+
+
+def load_baselines(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        baselines = json.load(f)
+    if baselines.get("version") != BASELINE_VERSION:
+        return {}
+    return baselines.get("scales", {})
+
+
+def save_baselines(path, scales):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"version": BASELINE_VERSION, "scales": scales}, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def compare(seconds, baseline, threshold):
+    """Returns "regression", "faster", "ok" or "new" for a time and its baseline."""
+    if baseline is None:
+        return "new"
+    if seconds > baseline * (1 + threshold) and seconds - baseline > NOISE_FLOOR:
+        return "regression"
+    if seconds < baseline * (1 - threshold) and baseline - seconds > NOISE_FLOOR:
+        return "faster"
+    return "ok"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scale", choices=SCALES, default="small")
+    parser.add_argument(
+        "--cases", nargs="+", default=["*"], help="glob patterns of the cases to run"
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=13)
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.25,
+        help="slowdown over the baseline reported as a regression (default: 0.25)",
+    )
+    parser.add_argument("--baseline", default=DEFAULT_BASELINES)
+    parser.add_argument(
+        "--save-baseline", action="store_true", help="store these timings as the baseline"
+    )
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    parser.add_argument("--list", action="store_true", help="list the cases")
+    args = parser.parse_args()
+
+    names = [
+        name for name in CASES if any(fnmatch.fnmatch(name, pattern) for pattern in args.cases)
+    ]
+    if args.list:
+        print("\n".join(names))
+        return
+    if not names:
+        sys.exit("No case matches " + " ".join(args.cases))
+
+    baselines = load_baselines(args.baseline)
+    scale_baseline = baselines.get(args.scale, {}).get("cases", {})
+    results = {}
+    regressions = 0
+    print(f"scale {args.scale}, best of {args.repeat}")
+    print(f"{'case':<44} {'seconds':>9} {'baseline':>9} {'change':>8}")
+    with tempfile.TemporaryDirectory() as directory:
+        corpus = Corpus(SCALES[args.scale], args.seed, directory)
+        for name in names:
+            seconds = time_case(CASES[name], corpus, args.repeat)
+            baseline = scale_baseline.get(name)
+            status = compare(seconds, baseline, args.threshold)
+            regressions += status == "regression"
+            results[name] = {"seconds": round(seconds, 6), "baseline": baseline, "status": status}
+            change = "" if baseline is None else f"{(seconds / baseline - 1) * 100:+.0f}%"
+            shown = "-" if baseline is None else f"{baseline:.4f}"
+            flag = "  REGRESSION" if status == "regression" else ""
+            print(f"{name:<44} {seconds:>9.4f} {shown:>9} {change:>8}{flag}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "scale": args.scale,
+                    "seed": args.seed,
+                    "repeat": args.repeat,
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+    if args.save_baseline:
+        cases = dict(scale_baseline)
+        cases.update({name: result["seconds"] for name, result in results.items()})
+        baselines[args.scale] = {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cases": cases,
+        }
+        save_baselines(args.baseline, baselines)
+        print(f"Baseline for {args.scale} saved to {args.baseline}")
+    missing = [name for name, result in results.items() if result["status"] == "new"]
+    if missing and not args.save_baseline:
+        print(
+            f"No {args.scale} baseline in {args.baseline} for {', '.join(missing)}: not compared, "
+            "record one with --save-baseline"
+        )
+    if regressions:
+        print(f"{regressions} regression(s) over {args.threshold:.0%}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
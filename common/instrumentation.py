@@ -0,0 +1,352 @@
+"""
+Stage timing and memory instrumentation for the Python tools.
+
+A tool wraps its run in `instrument()` and its stages in `stage()`:
+
+    with instrumentation.instrument("civ13exporter", args, argv):
+        with instrumentation.stage("parse"):
+            ...
+
+Every stage records its wall and CPU time, the peak RSS of the process
+when it ended and, with --trace-memory, the peak and net Python
+allocations seen by tracemalloc. Stages opened inside another stage are
+named "outer/inner", and a stage entered several times (one per file, say)
+is added up. `timed_iter()` times the work done while a lazy iterator is
+consumed, such as chunks encoded while the map is being written.
+
+The tools share the options added by `add_arguments()`:
+
+    --timings PATH      write the JSON report to PATH (a directory gets a
+                        timestamped <tool>-YYYYmmdd-HHMMSS.json file); the
+                        CIV14_TOOLS_TIMINGS environment variable sets a default
+    --trace-memory      track allocations with tracemalloc (slower)
+    --profile PATH      run cProfile and save its stats to PATH
+
+Outside instrument() the helpers do nothing, so library code can call them
+unconditionally. Stages are meant to be opened from the main thread.
+"""
+
+import io
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+REPORT_VERSION = 1
+TIMINGS_ENV = "CIV14_TOOLS_TIMINGS"
+PROFILE_LINES = 15
+
+
+def peak_rss():
+    """The peak resident set size of the process in bytes, or None if unknown."""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Bytes on macOS, kilobytes elsewhere
+        return peak if sys.platform == "darwin" else peak * 1024
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss)
+    return None
+
+
+def children_peak_rss():
+    """The largest peak RSS of the finished child processes in bytes, or None if unknown."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class StageRecord:
+    """The totals of one stage name."""
+
+    __slots__ = ("name", "count", "wall", "cpu", "peak_rss", "alloc_peak", "alloc_net", "items")
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.peak_rss = None
+        self.alloc_peak = None
+        self.alloc_net = None
+        self.items = None
+
+    def as_dict(self):
+        return {
+            "name": self.name,
+            "count": self.count,
+            "wall_s": round(self.wall, 6),
+            "cpu_s": round(self.cpu, 6),
+            "peak_rss_bytes": self.peak_rss,
+            "alloc_peak_bytes": self.alloc_peak,
+            "alloc_net_bytes": self.alloc_net,
+            "items": self.items,
+        }
+
+
+class Run:
+    """The measurements of one run of a tool."""
+
+    def __init__(self, tool, trace_memory=False, profile_path=None, argv=None):
+        self.tool = tool
+        self.argv = list(sys.argv[1:] if argv is None else argv)
+        self.trace_memory = trace_memory
+        self.profile_path = profile_path
+        self.stages = {}
+        self.counters = {}
+        # [full name, allocation peak so far] of the open stages
+        self._open = []
+        self._profiler = None
+        self._tracing = False
+        self.started = None
+
+    def start(self):
+        self.started = time.time()
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+        if self.profile_path:
+            # cProfile and pstats are only imported when profiling
+            import cProfile
+
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    def stop(self):
+        if self._profiler is not None:
+            self._profiler.disable()
+        self.wall = time.perf_counter() - self._wall
+        self.cpu = time.process_time() - self._cpu
+        self.alloc_peak = None
+        if self.trace_memory:
+            self.alloc_peak = tracemalloc.get_traced_memory()[1]
+            for frame in self._open:
+                self.alloc_peak = max(self.alloc_peak, frame[1])
+            if self._tracing:
+                tracemalloc.stop()
+
+    def _record(self, name):
+        record = self.stages.get(name)
+        if record is None:
+            record = self.stages[name] = StageRecord(name)
+        return record
+
+    def _full_name(self, name):
+        return f"{self._open[-1][0]}/{name}" if self._open else name
+
+    @contextmanager
+    def stage(self, name):
+        full_name = self._full_name(name)
+        alloc_start = None
+        if self.trace_memory:
+            # The peak so far belongs to the enclosing stages
+            current, peak = tracemalloc.get_traced_memory()
+            for frame in self._open:
+                frame[1] = max(frame[1], peak)
+            tracemalloc.reset_peak()
+            alloc_start = current
+        # Created here so that stages are listed in the order they started
+        record = self._record(full_name)
+        frame = [full_name, 0]
+        self._open.append(frame)
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = time.process_time() - cpu
+            self._open.pop()
+            record.count += 1
+            record.wall += wall
+            record.cpu += cpu
+            record.peak_rss = peak_rss()
+            if self.trace_memory:
+                current, peak = tracemalloc.get_traced_memory()
+                peak = max(peak, frame[1])
+                for outer in self._open:
+                    outer[1] = max(outer[1], peak)
+                tracemalloc.reset_peak()
+                record.alloc_peak = max(record.alloc_peak or 0, peak - alloc_start)
+                record.alloc_net = (record.alloc_net or 0) + current - alloc_start
+
+    def timed_iter(self, name, iterable):
+        """Yields the items of iterable, adding the time spent producing them to a stage."""
+        record = self._record(self._full_name(name))
+        record.count += 1
+        record.items = record.items or 0
+        iterator = iter(iterable)
+        while True:
+            wall = time.perf_counter()
+            cpu = time.process_time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                record.peak_rss = peak_rss()
+                return
+            finally:
+                record.wall += time.perf_counter() - wall
+                record.cpu += time.process_time() - cpu
+            record.items += 1
+            yield item
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def report(self):
+        return {
+            "version": REPORT_VERSION,
+            "tool": self.tool,
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            "argv": self.argv,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "wall_s": round(self.wall, 6),
+            "cpu_s": round(self.cpu, 6),
+            "peak_rss_bytes": peak_rss(),
+            "children_peak_rss_bytes": children_peak_rss(),
+            "alloc_peak_bytes": self.alloc_peak,
+            "stages": [record.as_dict() for record in self.stages.values()],
+            "counters": self.counters,
+        }
+
+    def summary(self):
+        """The stage table printed at the end of an instrumented run."""
+        lines = [f"{'stage':<36} {'count':>6} {'wall s':>9} {'cpu s':>9} {'peak RSS':>10}"]
+        for record in self.stages.values():
+            line = (
+                f"{record.name:<36} {record.count:>6} {record.wall:>9.3f} "
+                f"{record.cpu:>9.3f} {_megabytes(record.peak_rss):>10}"
+            )
+            if record.alloc_peak is not None:
+                line += f"  alloc peak {_megabytes(record.alloc_peak)}"
+            lines.append(line)
+        lines.append(f"{'total':<36} {'':>6} {self.wall:>9.3f} {self.cpu:>9.3f} {_megabytes(peak_rss()):>10}")
+        return "\n".join(lines)
+
+    def profile_stats(self, lines=PROFILE_LINES):
+        """The top functions by cumulative time, as text."""
+        import pstats
+
+        out = io.StringIO()
+        stats = pstats.Stats(self._profiler, stream=out)
+        stats.sort_stats("cumulative").print_stats(lines)
+        return out.getvalue()
+
+
+def _megabytes(value):
+    return "-" if value is None else f"{value / (1024 * 1024):.1f} MB"
+
+
+_active = None
+
+
+def active():
+    """The Run of the current instrument() block, or None."""
+    return _active
+
+
+@contextmanager
+def stage(name):
+    """Times a stage of the active run (does nothing outside instrument())."""
+    if _active is None:
+        yield
+        return
+    with _active.stage(name):
+        yield
+
+
+def timed_iter(name, iterable):
+    """Times the production of the items of a lazy iterable as a stage of the active run."""
+    if _active is None:
+        return iterable
+    return _active.timed_iter(name, iterable)
+
+
+def count(name, value=1):
+    """Adds value to a counter of the active run."""
+    if _active is not None:
+        _active.count(name, value)
+
+
+def add_arguments(parser):
+    """Adds --timings, --trace-memory and --profile to an argparse parser."""
+    group = parser.add_argument_group("instrumentation")
+    group.add_argument(
+        "--timings",
+        default=os.environ.get(TIMINGS_ENV),
+        help="write a JSON report of the stage timings to this file or directory "
+        f"(default: ${TIMINGS_ENV})",
+    )
+    group.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="track the allocations of every stage with tracemalloc (slower)",
+    )
+    group.add_argument(
+        "--profile", help="run under cProfile and save the stats to this file"
+    )
+
+
+def report_path(path, tool, started):
+    """The report file for a --timings value; directories get a timestamped name."""
+    if os.path.isdir(path) or path.endswith(("/", "\\")):
+        os.makedirs(path, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(started))
+        return os.path.join(path, f"{tool}-{stamp}.json")
+    return path
+
+
+@contextmanager
+def instrument(tool, args=None, argv=None):
+    """
+    Measures the run of a tool. With the add_arguments() options in args, it
+    prints the stage table and writes the report and profile at the end.
+    `argv` is the argument list the tool parsed (default: sys.argv[1:]), as
+    recorded in the report.
+
+    Yields:
+        The Run.
+    """
+    global _active
+    timings = getattr(args, "timings", None)
+    trace_memory = getattr(args, "trace_memory", False)
+    profile_path = getattr(args, "profile", None)
+    run = Run(tool, trace_memory=trace_memory, profile_path=profile_path, argv=argv)
+    previous = _active
+    _active = run
+    run.start()
+    try:
+        yield run
+    finally:
+        run.stop()
+        _active = previous
+        if timings or trace_memory or profile_path:
+            print(run.summary())
+        if timings:
+            path = report_path(timings, tool, run.started)
+            directory = os.path.dirname(os.path.abspath(path))
+            os.makedirs(directory, exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(run.report(), f, indent=2)
+            print(f"Timings written to {path}")
+        if profile_path:
+            run._profiler.dump_stats(profile_path)
+            print(run.profile_stats())
+            print(f"Profile written to {profile_path}")
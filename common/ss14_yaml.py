@@ -0,0 +1,101 @@
+"""
+Shared YAML loading and dumping for the Python tools.
+
+Uses the libyaml-backed CSafeLoader/CSafeDumper when PyYAML was built with
+them (several times faster than the pure-Python classes) and falls back to
+SafeLoader/SafeDumper otherwise.
+
+SS14 prototypes tag values with their C# type, like
+`sound: !type:SoundPathSpecifier {path: /Audio/alert.ogg}`, which the plain
+safe loader rejects. Here a `!type:Name` value is loaded as the one-key dict
+`{"!type:Name": value}` and such dicts are dumped back as tagged values, so
+files round-trip and tools can write tagged values as plain dicts.
+
+Tools import it after adding this directory to sys.path:
+
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+    import ss14_yaml
+"""
+
+import yaml
+
+TYPE_TAG_PREFIX = "!type:"
+LIBYAML = getattr(yaml, "__with_libyaml__", False)
+
+_BaseLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+_BaseDumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+
+class Loader(_BaseLoader):
+    """Safe loader (libyaml when available) that understands `!type:` tags."""
+
+
+class Dumper(_BaseDumper):
+    """Safe dumper (libyaml when available) that writes `!type:` tags."""
+
+
+def construct_type_tag(loader, suffix, node):
+    """Loads a `!type:Name` value as {"!type:Name": value}."""
+    if isinstance(node, yaml.MappingNode):
+        value = loader.construct_mapping(node, deep=True)
+    elif isinstance(node, yaml.SequenceNode):
+        value = loader.construct_sequence(node, deep=True)
+    else:
+        value = loader.construct_scalar(node) or None
+    return {TYPE_TAG_PREFIX + suffix: value}
+
+
+def type_tag(data):
+    """Returns the tag of a {"!type:Name": value} dict, or None for other dicts."""
+    if len(data) != 1:
+        return None
+    key = next(iter(data))
+    if isinstance(key, str) and key.startswith(TYPE_TAG_PREFIX):
+        return key
+    return None
+
+
+def represent_type_tags(dumper, data):
+    """Dumps {"!type:Name": value} dicts as tagged values, other dicts as usual."""
+    tag = type_tag(data)
+    if tag is None:
+        return dumper.represent_dict(data)
+    value = data[tag]
+    if isinstance(value, dict):
+        return dumper.represent_mapping(tag, value)
+    if isinstance(value, list):
+        return dumper.represent_sequence(tag, value)
+    return dumper.represent_scalar(tag, "" if value is None else str(value))
+
+
+Loader.add_multi_constructor(TYPE_TAG_PREFIX, construct_type_tag)
+Dumper.add_representer(dict, represent_type_tags)
+
+# Block style, keys in insertion order, UTF-8 text as is
+DUMP_DEFAULTS = {"default_flow_style": False, "sort_keys": False, "allow_unicode": True}
+
+
+def load(stream):
+    """Loads one YAML document."""
+    return yaml.load(stream, Loader=Loader)
+
+
+def load_all(stream):
+    """Yields every document of a YAML stream."""
+    return yaml.load_all(stream, Loader=Loader)
+
+
+def parse(stream):
+    """Yields the parser events of a YAML stream (no document is built)."""
+    return yaml.parse(stream, Loader=Loader)
+
+
+def dump(data, stream=None, **kwargs):
+    """
+    Dumps data with the shared Dumper.
+
+    Keyword arguments override DUMP_DEFAULTS and are passed to yaml.dump.
+    Returns the YAML text when no stream is given.
+    """
+    options = {**DUMP_DEFAULTS, "Dumper": Dumper, **kwargs}
+    return yaml.dump(data, stream, **options)
@@ -0,0 +1,138 @@
+"""
+On-disk cache of encoded map chunks.
+
+Encoded chunks are stored per chunk row ("band"), keyed by a hash of the
+band's raw tile data, the chunk size and CACHE_FORMAT_VERSION. A rebuild
+after a small edit to the source image only re-encodes the bands that
+contain changed tiles. Hashing whole bands instead of single chunks keeps
+a cache hit several times cheaper than encoding, which would not be the
+case for per-chunk hashes. The cache is a single SQLite file with
+least-recently-used eviction once it grows past its size limit.
+"""
+
+import hashlib
+import sqlite3
+
+# Bump whenever the chunk encoding changes, to invalidate old entries
+CACHE_FORMAT_VERSION = 1
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+class ChunkCache:
+    """
+    Persistent map from chunk band contents to their base64 chunk encodings.
+
+    Use it as a context manager, or call close() to save the usage data and
+    apply the size limit.
+    """
+
+    def __init__(self, path, chunk_size=16, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        Args:
+            path: The SQLite file to use (created if missing).
+            chunk_size: The chunk edge length, part of every key.
+            max_bytes: Approximate size limit for the cached encodings.
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self._person = f"civ14v{CACHE_FORMAT_VERSION}c{chunk_size}".encode()[:16]
+        self._used = []
+        self._db = sqlite3.connect(path)
+        # Must be set before the tables exist so evictions shrink the file
+        self._db.execute("PRAGMA auto_vacuum = FULL")
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS bands (
+                key BLOB PRIMARY KEY,
+                tiles TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                used INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS bands_used ON bands (used);
+            CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER);
+            """
+        )
+        row = self._db.execute(
+            "SELECT value FROM meta WHERE name = 'generation'"
+        ).fetchone()
+        self.generation = (row[0] if row else 0) + 1
+        self._db.execute(
+            "INSERT OR REPLACE INTO meta VALUES ('generation', ?)", (self.generation,)
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def key(self, tiles, flags=None, variant=None):
+        """Returns the cache key for a band of tile ids and its optional flags/variant."""
+        digest = hashlib.blake2b(digest_size=16, person=self._person)
+        for array in (tiles, flags, variant):
+            if array is None:
+                digest.update(b"-")
+                continue
+            digest.update(f"{array.dtype.str}{array.shape}".encode())
+            digest.update(array.tobytes() if not array.flags.c_contiguous else array)
+        return digest.digest()
+
+    def get(self, key):
+        """Returns the cached chunk encodings for a band, or None."""
+        row = self._db.execute("SELECT tiles FROM bands WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        tiles = row[0].split("\n")
+        self.hits += len(tiles)
+        self._used.append(key)
+        return tiles
+
+    def put(self, key, tiles):
+        """Stores the chunk encodings of a band that had to be encoded."""
+        self.misses += len(tiles)
+        data = "\n".join(tiles)
+        self._db.execute(
+            "INSERT OR REPLACE INTO bands VALUES (?, ?, ?, ?)",
+            (key, data, len(data), self.generation),
+        )
+
+    def evict(self):
+        """Drops the least recently used bands until the cache fits max_bytes."""
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM bands").fetchone()[0]
+        excess = total - self.max_bytes
+        if excess <= 0:
+            return
+        stale = []
+        for key, size in self._db.execute("SELECT key, size FROM bands ORDER BY used"):
+            stale.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        self._db.executemany("DELETE FROM bands WHERE key = ?", stale)
+        self.evicted += len(stale)
+
+    def close(self):
+        """Records which bands were used in this run, evicts and commits."""
+        if self._db is None:
+            return
+        self._db.executemany(
+            "UPDATE bands SET used = ? WHERE key = ?",
+            ((self.generation, key) for key in self._used),
+        )
+        self._used.clear()
+        self.evict()
+        self._db.commit()
+        self._db.close()
+        self._db = None
+
+    def report(self):
+        """Returns a one-line summary of this run's cache usage, counted in chunks."""
+        total = self.hits + self.misses
+        rate = 100.0 * self.hits / total if total else 0.0
+        return (
+            f"Chunk cache: {self.hits} hits, {self.misses} misses "
+            f"({rate:.1f}% hit rate), {self.evicted} bands evicted"
+        )
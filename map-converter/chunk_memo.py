@@ -0,0 +1,112 @@
+"""
+In-memory memo of encoded map chunks.
+
+Nomads maps are mostly large uniform regions, so the same 16x16 chunk
+(all FloorGrass, all FloorSnow...) is encoded thousands of times. The memo
+keeps the encoding of the uniform chunk of every tile, found by comparing
+a chunk with the chunk its first tile would make, and of other chunks by
+their packed bytes, so a repeated chunk costs a comparison or a dictionary
+lookup instead of a new base64 string. Other chunks are only kept until the
+memo holds max_entries of them, which bounds its memory on noisy maps, and
+they stop being looked up when they turn out not to repeat.
+"""
+
+import base64
+
+DEFAULT_MAX_ENTRIES = 1024
+
+
+class ChunkMemo:
+    """Maps packed chunk bytes to their base64 encoding, counting the chunks reused."""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        """
+        Args:
+            max_entries: How many non-uniform chunks to remember.
+        """
+        self.max_entries = max_entries
+        self.uniform_hits = 0
+        self.repeated_hits = 0
+        self.misses = 0
+        # First tile -> [uniform chunk bytes, encoding or None if not seen yet]
+        self._uniform = {}
+        # Chunk bytes -> encoding of the other chunks
+        self._repeated = {}
+        self._text_size = 0
+
+    def encode(self, chunks):
+        """
+        Encodes chunks, reusing the encoding of the ones seen before.
+
+        Args:
+            chunks: A (count, size, size) array of packed tiles, one
+                contiguous chunk per item.
+
+        Returns:
+            The base64 string of every chunk, in order.
+        """
+        uniform = self._uniform
+        repeated = self._repeated
+        tile_size = chunks.dtype.itemsize
+        tiles = chunks[0].size if len(chunks) else 0
+        # Once the memo is full, the other chunks are only looked up while
+        # they repeat often enough to pay for hashing them (noisy maps do not)
+        look_up = len(repeated) < self.max_entries or self.repeated_hits >= len(repeated)
+        result = []
+        for chunk in chunks:
+            data = chunk.tobytes()
+            first = data[:tile_size]
+            entry = uniform.get(first)
+            if entry is None:
+                # The uniform chunk of this tile, encoded when first seen
+                entry = [first * tiles, None]
+                if len(uniform) < self.max_entries:
+                    uniform[first] = entry
+            if entry[0] == data:
+                text = entry[1]
+                if text is not None:
+                    self.uniform_hits += 1
+                    result.append(text)
+                    continue
+                text = entry[1] = base64.b64encode(data).decode("utf-8")
+            elif look_up:
+                text = repeated.get(data)
+                if text is not None:
+                    self.repeated_hits += 1
+                    result.append(text)
+                    continue
+                text = base64.b64encode(data).decode("utf-8")
+                if len(repeated) < self.max_entries:
+                    repeated[data] = text
+            else:
+                text = base64.b64encode(data).decode("utf-8")
+            self.misses += 1
+            self._text_size = len(text)
+            result.append(text)
+        return result
+
+    @property
+    def hits(self):
+        return self.uniform_hits + self.repeated_hits
+
+    def stats(self):
+        """The (uniform_hits, repeated_hits, misses, encoded chunk size) of the memo."""
+        return self.uniform_hits, self.repeated_hits, self.misses, self._text_size
+
+    def add_stats(self, uniform_hits, repeated_hits, misses, text_size=0):
+        """Adds the counters of a memo used in another process (see stats())."""
+        self.uniform_hits += uniform_hits
+        self.repeated_hits += repeated_hits
+        self.misses += misses
+        self._text_size = self._text_size or text_size
+
+    def report(self):
+        """Returns a one-line summary of the chunks served from the memo."""
+        total = self.hits + self.misses
+        rate = 100.0 * self.hits / total if total else 0.0
+        saved = self.hits * self._text_size / (1024 * 1024)
+        return (
+            f"Chunk memo: {self.hits} of {total} chunks reused ({rate:.1f}%: "
+            f"{self.uniform_hits} uniform, {self.repeated_hits} repeated), "
+            f"{saved:.1f} MB of base64 not encoded again"
+        )
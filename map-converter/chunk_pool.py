@@ -0,0 +1,192 @@
+"""
+Parallel chunk encoding for json2yaml.py.
+
+The tile grid is shared with the worker processes as a `.npy` file opened as
+a TileGrid, instead of being pickled into every task. Each task encodes a
+band of chunk rows, reading only those rows, and results are yielded in the
+same order as the serial encoder. Every worker keeps its own ChunkMemo for
+the whole pool, and sends its counters back with each band.
+
+With a ChunkCache, the parent process looks up every chunk row before
+sending it out: cached rows are yielded as they are, only the runs of rows
+that missed become tasks, and their encodings are stored when they come
+back. The cache is only ever used from the parent.
+"""
+
+import mmap
+import os
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from chunk_memo import ChunkMemo
+from json2yaml import band_chunks, iter_encoded_chunks
+from tile_loader import TileGrid
+
+# Tasks kept in flight per worker, bounding the memory used by pending results
+TASKS_PER_WORKER = 4
+
+_grids = {}
+_memo = {}
+
+
+def _init_worker(grids, memo):
+    """Keeps the shared grids of the worker process, and its memo if memo is set."""
+    _grids.update(grids)
+    if memo:
+        _memo["memo"] = ChunkMemo()
+
+
+def _encode_band(task):
+    first_row, last_row, chunk_size = task
+    band = slice(first_row, last_row)
+    flags, variant = _grids["flags"], _grids["variant"]
+    memo = _memo.get("memo")
+    before = memo.stats() if memo is not None else None
+    chunks = list(
+        iter_encoded_chunks(
+            _grids["tiles"][band],
+            chunk_size,
+            None if flags is None else flags[band],
+            None if variant is None else variant[band],
+            row_offset=first_row // chunk_size,
+            memo=memo,
+        )
+    )
+    if memo is None:
+        return chunks, None
+    # Only the counts of this band, so the parent can add them up
+    stats = memo.stats()
+    return chunks, [now - then for now, then in zip(stats[:3], before[:3])] + [stats[3]]
+
+
+def _share(array, directory, name):
+    """Returns a TileGrid (or another picklable grid) the workers can read `array` from."""
+    if array is None or not isinstance(array, np.ndarray):
+        return array
+    filename = getattr(array, "filename", None)
+    # Views of a memmap keep its filename, so the file is only reused for
+    # the array that maps all of it
+    if (
+        isinstance(array, np.memmap)
+        and isinstance(array.base, mmap.mmap)
+        and array.flags.c_contiguous
+        and filename
+        and filename.endswith(".npy")
+    ):
+        grid = TileGrid.open_npy(filename)
+        if (
+            grid is not None
+            and grid.shape == array.shape
+            and grid.dtype == array.dtype
+            and grid.offset == array.offset
+        ):
+            return grid
+    path = os.path.join(directory, f"{name}.npy")
+    np.save(path, np.ascontiguousarray(array))
+    return TileGrid.open_npy(path)
+
+
+def _plan(tile_map, chunk_size, rows_per_task, flags, variant, cache):
+    """
+    Splits the map into tasks of at most rows_per_task rows.
+
+    Yields:
+        (task, keys) for rows to encode, keys being their cache keys (None
+        without a cache), and (None, chunks) for chunk rows found in the cache.
+    """
+    h = tile_map.shape[0]
+    if cache is None:
+        for y in range(0, h, rows_per_task):
+            yield (y, min(y + rows_per_task, h), chunk_size), None
+        return
+    first, keys = 0, []
+    for y in range(0, h, chunk_size):
+        band = slice(y, y + chunk_size)
+        key = cache.key(
+            tile_map[band],
+            None if flags is None else flags[band],
+            None if variant is None else variant[band],
+        )
+        band_tiles = cache.get(key)
+        if band_tiles is not None:
+            if keys:
+                yield (first, y, chunk_size), keys
+                keys = []
+            yield None, list(band_chunks(band_tiles, y // chunk_size))
+            continue
+        if not keys:
+            first = y
+        keys.append(key)
+        if len(keys) * chunk_size >= rows_per_task:
+            yield (first, min(y + chunk_size, h), chunk_size), keys
+            keys = []
+    if keys:
+        yield (first, h, chunk_size), keys
+
+
+def iter_encoded_chunks_parallel(
+    tile_map, chunk_size=16, workers=None, flags=None, variant=None, memo=None, cache=None
+):
+    """
+    Encodes the map chunks on a process pool.
+
+    Args:
+        tile_map: The (height, width) grid of tile ids.
+        chunk_size: The chunk edge length in tiles.
+        workers: Number of worker processes (defaults to the CPU count).
+        flags: Optional per-tile flags array.
+        variant: Optional per-tile variant array.
+        memo: Optional ChunkMemo. The workers memoize chunks on their own,
+            and their counters are added to this one.
+        cache: Optional ChunkCache. Only the chunk rows it misses are sent
+            to the workers.
+
+    Yields:
+        (key, chunk) pairs in the same order as iter_encoded_chunks.
+    """
+    workers = workers or os.cpu_count() or 1
+    h, w = tile_map.shape
+    bands = (h + chunk_size - 1) // chunk_size
+    columns = (w + chunk_size - 1) // chunk_size
+    bands_per_task = max(1, bands // (workers * TASKS_PER_WORKER * 2))
+    rows_per_task = bands_per_task * chunk_size
+
+    with tempfile.TemporaryDirectory(prefix="civ14-chunks-") as tmp:
+        grids = {
+            "tiles": _share(tile_map, tmp, "tiles"),
+            "flags": _share(flags, tmp, "flags"),
+            "variant": _share(variant, tmp, "variant"),
+        }
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(grids, memo is not None),
+        ) as executor:
+            # (future, cache keys of its rows) for tasks, (None, chunks) for cached rows
+            pending = deque()
+            plan = _plan(tile_map, chunk_size, rows_per_task, flags, variant, cache)
+            for task, result in plan:
+                future = None if task is None else executor.submit(_encode_band, task)
+                pending.append((future, result))
+                while pending and (
+                    pending[0][0] is None or len(pending) >= workers * TASKS_PER_WORKER
+                ):
+                    yield from _band_chunks(*pending.popleft(), memo, cache, columns)
+            while pending:
+                yield from _band_chunks(*pending.popleft(), memo, cache, columns)
+
+
+def _band_chunks(future, result, memo, cache, columns):
+    if future is None:
+        return result
+    chunks, stats = future.result()
+    if stats is not None:
+        memo.add_stats(*stats)
+    if result is not None:
+        for number, key in enumerate(result):
+            band = chunks[number * columns : (number + 1) * columns]
+            cache.put(key, [chunk["tiles"] for _, chunk in band])
+    return chunks
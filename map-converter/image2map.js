@@ -60,6 +60,9 @@ async function imageToMapAndSaveJson(
 		}
 
 		const tileMap = {}; // Changed to an object
+		// Raw grid for the .npy sidecar, in the smallest type that holds the ids
+		const GridArray = smallestGridArray(Object.values(colorMap));
+		const tileGrid = new GridArray(width * height);
 
 		for (let y = 0; y < height; y++) {
 			for (let x = 0; x < width; x++) {
@@ -70,6 +73,7 @@ async function imageToMapAndSaveJson(
 				const hexColor = rgbToHex(r, g, b);
 				const tileId = colorMap[hexColor]; // Get numeric tile ID
 				tileMap[`${x},${y}`] = tileId;
+				tileGrid[y * width + x] = tileId ?? 0;
 			}
 		}
 
@@ -80,6 +84,10 @@ async function imageToMapAndSaveJson(
 
 		await fs.writeFile(outputJsonPath, JSON.stringify(jsonData, null, 2));
 		console.log(`Successfully saved JSON data to ${outputJsonPath}`);
+
+		const outputNpyPath = outputJsonPath.replace(/\.json$/, "") + ".npy";
+		await fs.writeFile(outputNpyPath, toNpy(tileGrid, width, height));
+		console.log(`Successfully saved tile grid to ${outputNpyPath}`);
 	} catch (err) {
 		throw new Error(`Error processing image or saving JSON: ${err}`);
 	}
@@ -98,6 +106,54 @@ function rgbToHex(r, g, b) {
 	return `#${toHex(r)}${toHex(g)}${toHex(b)}`;
 }
 
+/**
+ * Picks the smallest typed array that holds every tile id.
+ *
+ * @param {number[]} ids - The tile ids in use.
+ * @returns {Function} - Uint8Array, Uint16Array or Int32Array.
+ */
+function smallestGridArray(ids) {
+	const min = Math.min(0, ...ids);
+	const max = Math.max(0, ...ids);
+	if (min >= 0 && max <= 0xff) return Uint8Array;
+	if (min >= 0 && max <= 0xffff) return Uint16Array;
+	return Int32Array;
+}
+
+// NumPy dtype of each grid array type
+const NPY_DESCR = new Map([
+	[Uint8Array, "|u1"],
+	[Uint16Array, "<u2"],
+	[Int32Array, "<i4"],
+]);
+
+/**
+ * Serializes a row-major grid as a NumPy .npy (format 1.0) file, so
+ * json2yaml.py can load the grid without parsing the JSON.
+ *
+ * @param {Uint8Array|Uint16Array|Int32Array} grid - The tile ids, row by row.
+ * @param {number} width - The grid width.
+ * @param {number} height - The grid height.
+ * @returns {Buffer} - The .npy file contents.
+ */
+function toNpy(grid, width, height) {
+	const descr = NPY_DESCR.get(grid.constructor);
+	let header = `{'descr': '${descr}', 'fortran_order': False, 'shape': (${height}, ${width}), }`;
+	// Magic (6) + version (2) + header length (2) + header must be a multiple of 64
+	const unpadded = 10 + header.length + 1;
+	header += " ".repeat((64 - (unpadded % 64)) % 64) + "\n";
+	const preamble = Buffer.alloc(10);
+	preamble.write("\x93NUMPY", 0, "latin1");
+	preamble.writeUInt8(1, 6);
+	preamble.writeUInt8(0, 7);
+	preamble.writeUInt16LE(header.length, 8);
+	return Buffer.concat([
+		preamble,
+		Buffer.from(header, "latin1"),
+		Buffer.from(grid.buffer, grid.byteOffset, grid.byteLength),
+	]);
+}
+
 /**
  * Creates a mapping between hexadecimal colors and characters.
  *
@@ -1,9 +1,21 @@
 import numpy as np
-import yaml
 import base64
-import struct
+import argparse
 import json
 import os
+import sys
+
+from chunk_cache import ChunkCache
+from chunk_memo import ChunkMemo
+from map_writer import (
+    StreamedMapping,
+    StreamedSequence,
+    write_map_yaml,
+)
+from tile_loader import iter_bands, load_tile_map
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+import instrumentation  # noqa: E402
 
 # -----------------------------------------------------------------------------
 # Tilemap
@@ -28,32 +40,118 @@ TILEMAP_REVERSE = {v: k for k, v in TILEMAP.items()}
 # -----------------------------------------------------------------------------
 # Funções Auxiliares
 # -----------------------------------------------------------------------------
-def encode_tiles(tile_map):
+# Layout binário de cada tile no chunk: 4 bytes id, 1 byte flags, 1 byte variant
+TILE_DTYPE = np.dtype([("id", "<u4"), ("flags", "u1"), ("variant", "u1")])
+
+
+def pack_tiles(tile_map, flags=None, variant=None):
+    """Empacota os tiles num array estruturado com o layout de TILE_DTYPE."""
+    packed = np.zeros(tile_map.shape, dtype=TILE_DTYPE)
+    packed["id"] = tile_map
+    if flags is not None:
+        packed["flags"] = flags
+    if variant is not None:
+        packed["variant"] = variant
+    return packed
+
+
+def pad_to_chunks(packed, chunk_size):
+    """Preenche o array com zeros até um múltiplo de chunk_size nos dois eixos."""
+    h, w = packed.shape
+    pad_h = -h % chunk_size
+    pad_w = -w % chunk_size
+    if pad_h == 0 and pad_w == 0:
+        return packed
+    padded = np.zeros((h + pad_h, w + pad_w), dtype=packed.dtype)
+    padded[:h, :w] = packed
+    return padded
+
+
+def encode_tiles(tile_map, flags=None, variant=None):
     """Codifica os tiles em formato base64 para o YAML."""
-    tile_bytes = bytearray()
-    for y in range(tile_map.shape[0]):
-        for x in range(tile_map.shape[1]):
-            tile_id = tile_map[y, x]
-            flags = 0
-            variant = 0
-            tile_bytes.extend(struct.pack("<I", tile_id))  # 4 bytes tile_id
-            tile_bytes.append(flags)  # 1 byte flag
-            tile_bytes.append(variant)  # 1 byte variant
-    return base64.b64encode(tile_bytes).decode("utf-8")
-
-
-def generate_atmosphere_tiles(width, height, chunk_size):
-    """Gera os tiles de atmosfera com base no tamanho do mapa."""
+    if tile_map.dtype != TILE_DTYPE:
+        tile_map = pack_tiles(tile_map, flags, variant)
+    return base64.b64encode(tile_map.tobytes()).decode("utf-8")
+
+
+# Tiles lidos de uma vez nas passagens por faixas (atmosfera, entidades por tile)
+BAND_TILES = 1 << 20
+
+
+def band_rows(tile_map, multiple=1):
+    """Linhas por faixa: cerca de BAND_TILES tiles, em múltiplos de `multiple`."""
+    width = max(1, tile_map.shape[1])
+    return max(multiple, BAND_TILES // width // multiple * multiple)
+
+
+def iter_atmosphere_occupancy(tile_map, chunk_size):
+    """
+    Gera, uma linha de chunks por vez, quais chunks de atmosfera contêm algum
+    tile do TILEMAP (não espaço). O mapa é lido por faixas.
+    """
+    solid_ids = list(TILEMAP)
+    for _, band in iter_bands(tile_map, band_rows(tile_map, chunk_size)):
+        solid = pad_to_chunks(np.isin(band, solid_ids), chunk_size)
+        rows, cols = solid.shape[0] // chunk_size, solid.shape[1] // chunk_size
+        yield from solid.reshape(rows, chunk_size, cols, chunk_size).any(axis=(1, 3))
+
+
+def atmosphere_occupancy(tile_map, chunk_size):
+    """Marca os chunks de atmosfera que contêm algum tile do TILEMAP (não espaço)."""
+    cols = (tile_map.shape[1] + chunk_size - 1) // chunk_size
+    rows = list(iter_atmosphere_occupancy(tile_map, chunk_size))
+    return np.array(rows, dtype=bool).reshape(len(rows), cols)
+
+
+def iter_atmosphere_tiles(width, height, chunk_size, occupied=None):
+    """
+    Gera (chave, tile) da atmosfera linha a linha, sem montar o dicionário inteiro.
+    Com occupied (o array de atmosphere_occupancy ou as linhas de
+    iter_atmosphere_occupancy), só emite os chunks ocupados e a borda externa
+    vizinha a eles; só as três últimas linhas de occupied ficam na memória.
+    """
     max_x = (width + chunk_size - 1) // chunk_size - 1
     max_y = (height + chunk_size - 1) // chunk_size - 1
-    tiles = {}
-    for y in range(-1, max_y + 1):
-        for x in range(-1, max_x + 1):
-            if x == -1 or x == max_x or y == -1 or y == max_y:
-                tiles[f"{x},{y}"] = {0: 65535}
+    # Índice 0 da grade corresponde à coordenada -1 (borda externa)
+    rows, cols = max_y + 2, max_x + 2
+    inner_mix = np.ones(cols, dtype=np.int8)
+    inner_mix[[0, -1]] = 0
+    border_mix = np.zeros(cols, dtype=np.int8)
+    every_col = np.arange(cols)
+    if occupied is not None:
+        source = iter(occupied)
+        # {índice: linha} das linhas de occupied ainda necessárias
+        window = {}
+        read = 0
+    for row in range(rows):
+        mix = border_mix if row in (0, rows - 1) else inner_mix
+        if occupied is None:
+            keep_cols = every_col
+        else:
+            # A linha `row` da grade usa as linhas row-2 a row de occupied
+            while read <= min(row, rows - 2):
+                window[read] = np.asarray(next(source), dtype=bool)
+                window.pop(read - 3, None)
+                read += 1
+            if row == 0:
+                # Borda de cima: vizinha dos chunks ocupados da primeira linha
+                padded = np.zeros(cols + 2, dtype=bool)
+                padded[2 : cols + 1] = window[0]
+                keep = padded[:-2] | padded[1:-1] | padded[2:]
             else:
-                tiles[f"{x},{y}"] = {1: 65535}
-    return tiles
+                keep = np.zeros(cols, dtype=bool)
+                keep[1:] = window[row - 1]
+                # Borda da esquerda: vizinha dos chunks ocupados da primeira coluna
+                keep[0] = any(window[i][0] for i in range(row - 2, row + 1) if i in window)
+            keep_cols = np.flatnonzero(keep)
+        y = row - 1
+        for col, m in zip(keep_cols.tolist(), mix[keep_cols].tolist()):
+            yield f"{col - 1},{y}", {m: 65535}
+
+
+def generate_atmosphere_tiles(width, height, chunk_size, occupied=None):
+    """Gera os tiles de atmosfera com base no tamanho do mapa."""
+    return dict(iter_atmosphere_tiles(width, height, chunk_size, occupied))
 
 
 # Definir uniqueMixes para atmosfera
@@ -72,27 +170,118 @@ unique_mixes = [
 ]
 
 
-def generate_main_entities(tile_map, chunk_size=16):
-    """Gera as entidades principais, incluindo os chunks do mapa e a atmosfera."""
+def encode_band(packed, chunk_size=16, memo=None):
+    """
+    Codifica uma faixa de chunks já preenchida, devolvendo um base64 por chunk.
+    Com um ChunkMemo, chunks já vistos (uniformes ou repetidos) não são recodificados.
+    """
+    count = packed.shape[1] // chunk_size
+    # Reordena a faixa para que cada chunk fique contíguo na memória
+    chunks = np.ascontiguousarray(
+        packed.reshape(chunk_size, count, chunk_size).swapaxes(0, 1)
+    )
+    if memo is not None:
+        return memo.encode(chunks)
+    return [encode_tiles(chunk) for chunk in chunks]
+
+
+def iter_encoded_chunks(
+    tile_map, chunk_size=16, flags=None, variant=None, row_offset=0, cache=None, memo=None
+):
+    """
+    Codifica o mapa por faixas de chunks, gerando (chave, chunk) em ordem.
+    row_offset é somado ao índice y dos chunks (usado ao codificar uma faixa do mapa).
+    Com um ChunkCache, só as faixas alteradas são recodificadas; com um
+    ChunkMemo, chunks repetidos reaproveitam a codificação.
+    """
     h, w = tile_map.shape
-    chunks = {}
     for cy in range(0, h, chunk_size):
-        for cx in range(0, w, chunk_size):
-            chunk_key = f"{cx//chunk_size},{cy//chunk_size}"
-            chunk_tiles = tile_map[cy : cy + chunk_size, cx : cx + chunk_size]
-            # Preenche chunks incompletos nas bordas
-            if chunk_tiles.shape[0] < chunk_size or chunk_tiles.shape[1] < chunk_size:
-                full_chunk = np.zeros((chunk_size, chunk_size), dtype=np.int32)
-                full_chunk[: chunk_tiles.shape[0], : chunk_tiles.shape[1]] = chunk_tiles
-                chunk_tiles = full_chunk
-            chunks[chunk_key] = {
-                "ind": f"{cx//chunk_size},{cy//chunk_size}",
-                "tiles": encode_tiles(chunk_tiles),
-                "version": 6,
-            }
+        band = slice(cy, cy + chunk_size)
+        band_flags = None if flags is None else flags[band]
+        band_variant = None if variant is None else variant[band]
+        band_tiles = None
+        if cache is not None:
+            cache_key = cache.key(tile_map[band], band_flags, band_variant)
+            band_tiles = cache.get(cache_key)
+        if band_tiles is None:
+            packed = pad_to_chunks(
+                pack_tiles(tile_map[band], band_flags, band_variant), chunk_size
+            )
+            band_tiles = encode_band(packed, chunk_size, memo)
+            if cache is not None:
+                cache.put(cache_key, band_tiles)
+        yield from band_chunks(band_tiles, cy // chunk_size + row_offset)
+
+
+def band_chunks(band_tiles, row):
+    """Gera os pares (chave, chunk) de uma faixa já codificada, na linha de chunks row."""
+    for index, tiles in enumerate(band_tiles):
+        chunk_key = f"{index},{row}"
+        yield chunk_key, {"ind": chunk_key, "tiles": tiles, "version": 6}
+
+
+def encode_chunks(tile_map, chunk_size=16, flags=None, variant=None, memo=None):
+    """Codifica todos os chunks do mapa num dicionário."""
+    return dict(iter_encoded_chunks(tile_map, chunk_size, flags, variant, memo=memo))
+
 
+def iter_map_chunks(
+    tile_map, chunk_size=16, flags=None, variant=None, workers=1, cache=None, memo=None
+):
+    """
+    Codifica os chunks no processo atual ou, com workers > 1, num pool de processos.
+    Com workers > 1, cada processo tem seu próprio memo e os contadores vão para memo;
+    o cache é consultado e atualizado pelo processo atual, faixa por faixa.
+    """
+    if workers > 1:
+        from chunk_pool import iter_encoded_chunks_parallel
+
+        return iter_encoded_chunks_parallel(
+            tile_map, chunk_size, workers, flags, variant, memo=memo, cache=cache
+        )
+    return iter_encoded_chunks(tile_map, chunk_size, flags, variant, cache=cache, memo=memo)
+
+
+def generate_main_entities(
+    tile_map,
+    chunk_size=16,
+    flags=None,
+    variant=None,
+    stream=False,
+    workers=1,
+    cache=None,
+    sparse_atmosphere=False,
+    memo=None,
+):
+    """
+    Gera as entidades principais, incluindo os chunks do mapa e a atmosfera.
+    Com stream=True, chunks e atmosfera são gerados sob demanda pelo writer.
+    Com sparse_atmosphere=True, só há atmosfera onde existem tiles que não são espaço.
+    """
+    h, w = tile_map.shape
     atmosphere_chunk_size = 4
-    atmosphere_tiles = generate_atmosphere_tiles(w, h, atmosphere_chunk_size)
+    # O tempo gasto gerando chunks e atmosfera entra como etapa própria
+    def chunk_items():
+        return instrumentation.timed_iter(
+            "encode chunks",
+            iter_map_chunks(tile_map, chunk_size, flags, variant, workers, cache, memo),
+        )
+
+    def atmosphere_items():
+        occupied = None
+        if sparse_atmosphere:
+            occupied = iter_atmosphere_occupancy(tile_map, atmosphere_chunk_size)
+        return instrumentation.timed_iter(
+            "atmosphere",
+            iter_atmosphere_tiles(w, h, atmosphere_chunk_size, occupied),
+        )
+
+    if stream:
+        chunks = StreamedMapping(chunk_items)
+        atmosphere_tiles = StreamedMapping(atmosphere_items)
+    else:
+        chunks = dict(chunk_items())
+        atmosphere_tiles = dict(atmosphere_items())
 
     main = {
         "proto": "",
@@ -170,7 +359,15 @@ def generate_main_entities(tile_map, chunk_size=16):
 # -----------------------------------------------------------------------------
 # Geração de Spawn Points
 # -----------------------------------------------------------------------------
-global_uid = 3
+# UIDs 1 e 2 são o mapa e o grid; as demais entidades começam em FIRST_UID
+FIRST_UID = 3
+global_uid = FIRST_UID
+
+
+def reset_uids():
+    """Recomeça a numeração: cada mapa de um lote tem os UIDs de uma execução isolada."""
+    global global_uid
+    global_uid = FIRST_UID
 
 
 def next_uid():
@@ -202,27 +399,143 @@ def generate_spawn_points(tile_map, num_points=2):
 
 
 # -----------------------------------------------------------------------------
-# Salvar YAML
+# Entidades por tile (keys.json)
 # -----------------------------------------------------------------------------
-def represent_sound_path_specifier(dumper, data):
-    """Representação personalizada para SoundPathSpecifier no YAML."""
-    for key, value in data.items():
-        if isinstance(key, str) and key.startswith("!type:"):
-            tag = key
-            if isinstance(value, dict) and "path" in value:
-                return dumper.represent_mapping(tag, value)
-    return dumper.represent_dict(data)
+def reserve_uids(count):
+    """Reserva um bloco contíguo de UIDs e devolve o primeiro."""
+    global global_uid
+    first = global_uid
+    global_uid += count
+    return first
+
+
+def load_tile_entities(keys_path=None):
+    """Lê o keys.json e agrupa os ids de tile por protótipo de entidade."""
+    if keys_path is None:
+        keys_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "keys.json")
+    with open(keys_path, "r") as f:
+        keys = json.load(f)
+    tile_entities = {}
+    for tile_id, entry in keys.items():
+        for proto in entry.get("entities", []):
+            tile_entities.setdefault(proto, []).append(int(tile_id))
+    return tile_entities
 
 
+def count_tile_entities(tile_map, tile_entities):
+    """Conta as entidades de cada protótipo, lendo o mapa por faixas."""
+    counts = dict.fromkeys(tile_entities, 0)
+    for _, band in iter_bands(tile_map, band_rows(tile_map)):
+        for proto, tile_ids in tile_entities.items():
+            counts[proto] += int(np.count_nonzero(np.isin(band, tile_ids)))
+    return counts
+
+
+def _iter_tile_entities(tile_map, tile_ids, first_uid, parent):
+    """Gera as entidades de um protótipo, em ordem de linha, faixa por faixa do mapa."""
+    uid = first_uid
+    for first_row, band in iter_bands(tile_map, band_rows(tile_map)):
+        ys, xs = np.nonzero(np.isin(band, tile_ids))
+        for x, y in zip(xs.tolist(), (ys + first_row).tolist()):
+            yield {
+                "uid": uid,
+                "components": [
+                    {"type": "Transform", "parent": parent, "pos": f"{x + 0.5},{y + 0.5}"}
+                ],
+            }
+            uid += 1
+
+
+def generate_tile_entities(tile_map, tile_entities, parent=2, stream=False):
+    """
+    Gera um grupo de entidades por protótipo do keys.json, uma por tile correspondente.
+    Os UIDs de cada grupo são um bloco contíguo; com stream=True as entidades
+    são geradas sob demanda pelo writer. Devolve uma lista de (grupo, quantidade).
+    """
+    groups = []
+    counts = count_tile_entities(tile_map, tile_entities)
+    for proto, tile_ids in tile_entities.items():
+        count = counts[proto]
+        if not count:
+            continue
+        first_uid = reserve_uids(count)
+        entities = StreamedSequence(
+            lambda ids=tile_ids, uid=first_uid: instrumentation.timed_iter(
+                "tile entities", _iter_tile_entities(tile_map, ids, uid, parent)
+            )
+        )
+        groups.append(
+            ({"proto": proto, "entities": entities if stream else entities.to_list()}, count)
+        )
+    return groups
+
+
+# -----------------------------------------------------------------------------
+# Salvar YAML
+# -----------------------------------------------------------------------------
 def save_map_to_yaml(
-    tile_map, output_dir, filename="nomads_from_json.yml", chunk_size=16
+    tile_map,
+    output_dir,
+    filename="nomads_from_json.yml",
+    chunk_size=16,
+    workers=1,
+    cache=None,
+    sparse_atmosphere=False,
+    tile_entities=None,
+    memo=None,
+):
+    """
+    Salva o mapa gerado em um arquivo YAML no diretório especificado.
+    tile_entities (de load_tile_entities) adiciona as entidades por tile do keys.json;
+    memo (um ChunkMemo) reaproveita a codificação dos chunks repetidos.
+    """
+    map_data = build_map_data(
+        tile_map,
+        chunk_size,
+        workers=workers,
+        cache=cache,
+        sparse_atmosphere=sparse_atmosphere,
+        tile_entities=tile_entities,
+        memo=memo,
+    )
+    output_path = os.path.join(output_dir, filename)
+    with open(output_path, "w") as outfile:
+        write_map_yaml(outfile, map_data)
+
+
+def build_map_data(
+    tile_map,
+    chunk_size=16,
+    workers=1,
+    cache=None,
+    sparse_atmosphere=False,
+    tile_entities=None,
+    memo=None,
 ):
-    """Salva o mapa gerado em um arquivo YAML no diretório especificado."""
-    main_entities = generate_main_entities(tile_map, chunk_size)
+    """
+    Monta o documento do mapa que save_map_to_yaml escreve, com chunks,
+    atmosfera e entidades como StreamedMapping/StreamedSequence.
+    """
+    reset_uids()
+    main_entities = generate_main_entities(
+        tile_map,
+        chunk_size,
+        stream=True,
+        workers=workers,
+        cache=cache,
+        sparse_atmosphere=sparse_atmosphere,
+        memo=memo,
+    )
     spawn_points = generate_spawn_points(tile_map)
     all_entities = [main_entities, spawn_points]
     count = sum(len(group.get("entities", [])) for group in all_entities)
-    map_data = {
+    if tile_entities:
+        for group, group_count in generate_tile_entities(
+            tile_map, tile_entities, stream=True
+        ):
+            all_entities.append(group)
+            count += group_count
+    return {
         "meta": {
             "format": 7,
             "category": "Map",
@@ -239,45 +552,228 @@ def save_map_to_yaml(
         "tilemap": TILEMAP,
         "entities": all_entities,
     }
-    yaml.add_representer(dict, represent_sound_path_specifier)
-    output_path = os.path.join(output_dir, filename)
-    with open(output_path, "w") as outfile:
-        yaml.dump(map_data, outfile, default_flow_style=False, sort_keys=False)
 
 
 # -----------------------------------------------------------------------------
 # Execução
 # -----------------------------------------------------------------------------
-# Determina o diretório do script
-script_dir = os.path.dirname(os.path.abspath(__file__))
-json_path = os.path.join(script_dir, "output.json")
-
-# Lê o arquivo JSON
-with open(json_path, "r") as f:
-    data = json.load(f)
-tilemap_data = data["tileMap"]
-
-# Extrai as dimensões do tilemap
-positions = [
-    eval(pos) for pos in tilemap_data.keys()
-]  # Converte "(x,y)" para tupla (x, y)
-max_x = max(pos[0] for pos in positions)
-max_y = max(pos[1] for pos in positions)
-width = max_x + 1
-height = max_y + 1
-
-# Cria a matriz NumPy para o tilemap
-tile_map = np.zeros((height, width), dtype=np.int32)
-for pos_str, tile_info in tilemap_data.items():
-    x, y = eval(pos_str)
-    tile_id = tile_info["tile"]
-    # Os IDs do JSON correspondem diretamente ao TILEMAP
-    tile_map[y, x] = tile_id
-
-output_dir = os.path.join(script_dir, "output")
-os.makedirs(output_dir, exist_ok=True)
-
-# Saves the map as YAML
-save_map_to_yaml(tile_map, output_dir, filename="nomads_from_json.yml", chunk_size=16)
-
-print("Map generated from JSON successfully!")
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def add_output_arguments(parser):
+    """Adiciona as opções de geração do mapa (comuns a json2yaml e png2yaml)."""
+    parser.add_argument(
+        "--output",
+        default=os.path.join(SCRIPT_DIR, "output", "nomads_from_json.yml"),
+        help="map file to write (default: output/nomads_from_json.yml)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of processes used to encode the map chunks (default: 1)",
+    )
+    parser.add_argument(
+        "--cache",
+        nargs="?",
+        const=os.path.join(SCRIPT_DIR, "output", "chunk_cache.sqlite"),
+        help="reuse unchanged chunks from this cache file "
+        "(default: output/chunk_cache.sqlite)",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=256,
+        help="chunk cache size limit in MB (default: 256)",
+    )
+    parser.add_argument(
+        "--sparse-atmosphere",
+        action="store_true",
+        help="only emit atmosphere for chunks that contain non-space tiles",
+    )
+    parser.add_argument(
+        "--no-chunk-memo",
+        dest="chunk_memo",
+        action="store_false",
+        help="encode every chunk, even the ones identical to a chunk already encoded",
+    )
+    parser.add_argument(
+        "--no-tile-entities",
+        dest="tile_entities",
+        action="store_false",
+        help="do not place the per-tile entities listed in keys.json",
+    )
+
+
+def check_output_arguments(parser, args):
+    """Valida combinações inválidas das opções de geração."""
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+
+
+class MapBatch:
+    """
+    Salva mapas usando as opções de add_output_arguments. O cache de chunks,
+    o memo de chunks e o keys.json são abertos uma vez só, por mais mapas que
+    o lote tenha.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.cache = None
+        if args.cache:
+            os.makedirs(os.path.dirname(os.path.abspath(args.cache)), exist_ok=True)
+            self.cache = ChunkCache(args.cache, max_bytes=args.cache_size * 1024 * 1024)
+        self.tile_entities = load_tile_entities() if args.tile_entities else None
+        self.memo = ChunkMemo() if args.chunk_memo else None
+
+    def write(self, tile_map, output):
+        """Salva um mapa no arquivo output."""
+        output_dir, filename = os.path.split(os.path.abspath(output))
+        os.makedirs(output_dir, exist_ok=True)
+        save_map_to_yaml(
+            tile_map,
+            output_dir,
+            filename=filename,
+            chunk_size=16,
+            workers=self.args.workers,
+            cache=self.cache,
+            sparse_atmosphere=self.args.sparse_atmosphere,
+            tile_entities=self.tile_entities,
+            memo=self.memo,
+        )
+
+    def close(self):
+        if self.cache is not None:
+            self.cache.close()
+            print(self.cache.report())
+            self.cache = None
+        if self.memo is not None:
+            print(self.memo.report())
+            instrumentation.count("chunks reused", self.memo.hits)
+            self.memo = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def write_map(tile_map, args):
+    """Salva o mapa usando as opções de add_output_arguments."""
+    with MapBatch(args) as batch:
+        batch.write(tile_map, args.output)
+
+
+def batch_outputs(inputs, output):
+    """
+    Os arquivos de saída de um lote. Com uma entrada só, é o próprio output;
+    com várias, cada mapa recebe o nome da sua entrada, na pasta output (ou
+    na pasta do arquivo output, se ele terminar em .yml).
+    """
+    if len(inputs) == 1:
+        return [output]
+    directory = output
+    if output.endswith((".yml", ".yaml")):
+        directory = os.path.dirname(output)
+    return [
+        os.path.join(directory, os.path.splitext(os.path.basename(path))[0] + ".yml")
+        for path in inputs
+    ]
+
+
+def check_batch_outputs(parser, outputs):
+    """Recusa lotes em que duas entradas gerariam o mesmo arquivo."""
+    seen = set()
+    for output in outputs:
+        if os.path.abspath(output) in seen:
+            parser.error(f"two inputs would be written to {output}; rename one of them")
+        seen.add(os.path.abspath(output))
+
+
+def parse_size(value):
+    """Lê um tamanho WIDTHxHEIGHT e devolve o shape (altura, largura)."""
+    try:
+        width, height = (int(n) for n in value.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected WIDTHxHEIGHT, got {value!r}")
+    if width <= 0 or height <= 0:
+        raise argparse.ArgumentTypeError("the size must be positive")
+    return height, width
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Converts the image2map.js output into a Civ14 map."
+    )
+    parser.add_argument(
+        "inputs",
+        nargs="*",
+        metavar="input",
+        default=[os.path.join(SCRIPT_DIR, "output.json")],
+        help="tileMap JSON, .npy tile grid, .tiles archive or .raw/.bin grid "
+        "(default: output.json); with "
+        "several inputs, each map is written to the --output folder under its "
+        "input's name",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="parse the JSON incrementally with ijson to save memory",
+    )
+    parser.add_argument(
+        "--raw-size",
+        type=parse_size,
+        metavar="WIDTHxHEIGHT",
+        help="size of the headerless row-major .raw/.bin grids",
+    )
+    parser.add_argument(
+        "--raw-dtype",
+        choices=("uint8", "uint16", "int32"),
+        default="uint8",
+        help="tile id type of the .raw/.bin grids (default: uint8)",
+    )
+    add_output_arguments(parser)
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args(argv)
+    check_output_arguments(parser, args)
+    outputs = batch_outputs(args.inputs, args.output)
+    check_batch_outputs(parser, outputs)
+
+    failed = 0
+    with instrumentation.instrument("json2yaml", args, argv), MapBatch(args) as batch:
+        for input_path, output in zip(args.inputs, outputs):
+            # Lê o tilemap (JSON ou .npy) sem usar eval()
+            try:
+                with instrumentation.stage("load"):
+                    tile_map = load_tile_map(
+                        input_path,
+                        stream=args.stream,
+                        raw_shape=args.raw_size,
+                        raw_dtype=args.raw_dtype,
+                    )
+            except (OSError, ValueError, KeyError) as e:
+                # Num lote, uma entrada ruim não impede as outras
+                if len(args.inputs) == 1:
+                    raise
+                print(f"Error reading {input_path}: {e}")
+                failed += 1
+                continue
+            instrumentation.count("tiles", int(tile_map.size))
+            instrumentation.count("maps")
+
+            # Saves the map as YAML
+            with instrumentation.stage("write"):
+                batch.write(tile_map, output)
+            if len(args.inputs) > 1:
+                print(f"{input_path} -> {output}")
+
+    if failed:
+        print(f"{failed} of {len(args.inputs)} maps could not be read")
+        sys.exit(1)
+    print("Map generated from JSON successfully!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+"""
+Compressed tile grid archives (.tiles).
+
+A .tiles file holds a tile grid compressed one band of rows at a time, so a
+map of mostly uniform regions takes a small fraction of its .npy size and
+can still be read band by band, like a TileGrid, without decompressing the
+whole grid. json2yaml.py and map_server.py accept it wherever they accept
+a .npy grid.
+
+Layout: the magic, the compressed bands, a JSON index (shape, dtype, codec,
+rows per band and the offset and length of every band) and a footer with
+the offset of the index and the magic again.
+
+Bands are compressed with zstd when the `zstandard` package is installed,
+and with zlib otherwise.
+
+Usage: python map_archive.py pack output.npy [-o map.tiles] [--codec zstd|zlib]
+       python map_archive.py unpack map.tiles [-o map.npy]
+       python map_archive.py info map.tiles
+"""
+
+import argparse
+import json
+import os
+import struct
+import time
+import zlib
+
+import numpy as np
+
+from tile_loader import iter_bands, load_tile_map, smallest_tile_dtype
+
+MAGIC = b"C14TILES"
+FOOTER = struct.Struct("<Q8s")
+VERSION = 1
+# Tiles per compressed band; band heights are a multiple of the chunk size
+BAND_TILES = 1 << 20
+DEFAULT_LEVELS = {"zstd": 3, "zlib": 6}
+
+
+def band_height(width):
+    """Rows per band for a grid `width` tiles wide (a multiple of 16)."""
+    return max(16, BAND_TILES // max(width, 1) // 16 * 16)
+
+
+def default_codec():
+    """zstd if the zstandard package is installed, zlib otherwise."""
+    try:
+        import zstandard  # noqa: F401
+    except ImportError:
+        return "zlib"
+    return "zstd"
+
+
+def _compressor(codec, level):
+    if codec == "zstd":
+        import zstandard
+
+        return zstandard.ZstdCompressor(level=level).compress
+    if codec == "zlib":
+        return lambda data: zlib.compress(data, level)
+    raise ValueError(f"Unknown codec {codec!r} (expected zstd or zlib)")
+
+
+def _decompressor(codec):
+    if codec == "zstd":
+        import zstandard
+
+        return zstandard.ZstdDecompressor().decompress
+    if codec == "zlib":
+        return zlib.decompress
+    raise ValueError(f"Unknown codec {codec!r} (expected zstd or zlib)")
+
+
+def write_archive(path, tile_map, codec=None, level=None):
+    """
+    Writes a tile grid to a .tiles archive, in the smallest dtype that holds its ids.
+
+    Args:
+        path: The .tiles file to write.
+        tile_map: A (height, width) array or TileGrid of tile ids.
+        codec: "zstd" or "zlib" (defaults to default_codec()).
+        level: Compression level (defaults to DEFAULT_LEVELS[codec]).
+
+    Returns:
+        A dictionary with the codec, the grid and archive sizes in bytes
+        and the seconds taken.
+    """
+    start = time.perf_counter()
+    codec = codec or default_codec()
+    compress = _compressor(codec, DEFAULT_LEVELS[codec] if level is None else level)
+    height, width = tile_map.shape
+    rows = band_height(width)
+    # The ids are scanned first so the bands are stored in the narrowest dtype
+    low, high = 0, 0
+    for _, band in iter_bands(tile_map, rows):
+        if band.size:
+            low, high = min(low, int(band.min())), max(high, int(band.max()))
+    dtype = smallest_tile_dtype(high, low)
+
+    bands = []
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        for _, band in iter_bands(tile_map, rows):
+            data = compress(np.ascontiguousarray(band, dtype=dtype).tobytes())
+            bands.append((f.tell(), len(data)))
+            f.write(data)
+        index_offset = f.tell()
+        index = {
+            "version": VERSION,
+            "shape": [height, width],
+            "dtype": dtype.str,
+            "codec": codec,
+            "band_rows": rows,
+            "bands": bands,
+        }
+        f.write(json.dumps(index, separators=(",", ":")).encode("utf-8"))
+        f.write(FOOTER.pack(index_offset, MAGIC))
+        size = f.tell()
+    return {
+        "codec": codec,
+        "grid_bytes": height * width * dtype.itemsize,
+        "archive_bytes": size,
+        "seconds": time.perf_counter() - start,
+    }
+
+
+class TileArchive:
+    """
+    A (height, width) tile grid in a .tiles archive, read one band of rows at a time.
+
+    Works like a TileGrid: slicing rows (`archive[start:stop]`) decompresses
+    only the bands that hold them, and the last band read is kept, so
+    walking the map by bands decompresses every band once.
+    """
+
+    ndim = 2
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path}: not a .tiles archive")
+            f.seek(-FOOTER.size, os.SEEK_END)
+            index_offset, magic = FOOTER.unpack(f.read(FOOTER.size))
+            if magic != MAGIC:
+                raise ValueError(f"{path}: truncated .tiles archive")
+            end = f.seek(0, os.SEEK_END) - FOOTER.size
+            f.seek(index_offset)
+            index = json.loads(f.read(end - index_offset))
+        if index["version"] != VERSION:
+            raise ValueError(f"{path}: unsupported .tiles version {index['version']}")
+        self.shape = tuple(index["shape"])
+        self.dtype = np.dtype(index["dtype"])
+        self.codec = index["codec"]
+        self.band_rows = index["band_rows"]
+        self.bands = [tuple(band) for band in index["bands"]]
+        self._cached = (None, None)
+
+    def __getstate__(self):
+        # The cached band is not sent to worker processes
+        state = self.__dict__.copy()
+        state["_cached"] = (None, None)
+        return state
+
+    @property
+    def size(self):
+        return self.shape[0] * self.shape[1]
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _band(self, number):
+        cached_number, band = self._cached
+        if cached_number == number:
+            return band
+        offset, length = self.bands[number]
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            data = _decompressor(self.codec)(f.read(length))
+        band = np.frombuffer(data, dtype=self.dtype).reshape(-1, self.shape[1])
+        self._cached = (number, band)
+        return band
+
+    def __getitem__(self, key):
+        columns = slice(None)
+        if isinstance(key, tuple):
+            key, columns = key
+        if not isinstance(key, slice) or key.step not in (None, 1):
+            raise TypeError("TileArchive only supports slices of consecutive rows")
+        start, stop, _ = key.indices(self.shape[0])
+        stop = max(start, stop)
+        if stop == start or self.shape[1] == 0:
+            return np.empty((stop - start, self.shape[1]), self.dtype)[:, columns]
+        rows = self.band_rows
+        first, last = start // rows, (stop - 1) // rows
+        if first == last:
+            return self._band(first)[start - first * rows : stop - first * rows, columns]
+        parts = [self._band(number) for number in range(first, last + 1)]
+        return np.concatenate(parts)[start - first * rows : stop - first * rows, columns]
+
+    def __array__(self, dtype=None, copy=None):
+        grid = np.array(self[:], copy=True)
+        return grid if dtype is None else grid.astype(dtype, copy=False)
+
+
+def unpack(archive, npy_path):
+    """Writes the grid of a TileArchive to a .npy file, band by band."""
+    grid = np.lib.format.open_memmap(npy_path, mode="w+", dtype=archive.dtype, shape=archive.shape)
+    for start, band in iter_bands(archive, archive.band_rows):
+        grid[start : start + band.shape[0]] = band
+    grid.flush()
+    del grid
+
+
+def megabytes(value):
+    return f"{value / (1024 * 1024):.1f} MB"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Packs tile grids into compressed .tiles archives."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    pack = commands.add_parser("pack", help="compress a tile grid (.npy, .json or raw)")
+    pack.add_argument("input", help="the tile grid to compress")
+    pack.add_argument("-o", "--output", help="archive to write (default: input name + .tiles)")
+    pack.add_argument("--codec", choices=sorted(DEFAULT_LEVELS), help="default: zstd if installed")
+    pack.add_argument("--level", type=int, help="compression level of the codec")
+    unpack_parser = commands.add_parser("unpack", help="write the grid of an archive as .npy")
+    unpack_parser.add_argument("input", help="the .tiles archive")
+    unpack_parser.add_argument("-o", "--output", help=".npy to write (default: input name + .npy)")
+    info = commands.add_parser("info", help="print the size and codec of an archive")
+    info.add_argument("input", help="the .tiles archive")
+    args = parser.parse_args(argv)
+
+    if args.command == "pack":
+        output = args.output or os.path.splitext(args.input)[0] + ".tiles"
+        stats = write_archive(output, load_tile_map(args.input), args.codec, args.level)
+        print(
+            f"{args.input} -> {output}: {megabytes(stats['grid_bytes'])} grid stored in "
+            f"{megabytes(stats['archive_bytes'])} with {stats['codec']} "
+            f"({stats['grid_bytes'] / max(stats['archive_bytes'], 1):.0f}x smaller) "
+            f"in {stats['seconds']:.2f} s"
+        )
+    elif args.command == "unpack":
+        output = args.output or os.path.splitext(args.input)[0] + ".npy"
+        start = time.perf_counter()
+        unpack(TileArchive(args.input), output)
+        print(f"{args.input} -> {output} in {time.perf_counter() - start:.2f} s")
+    else:
+        archive = TileArchive(args.input)
+        grid_bytes = archive.size * archive.dtype.itemsize
+        archive_bytes = os.path.getsize(args.input)
+        print(
+            f"{archive.shape[1]}x{archive.shape[0]} {archive.dtype} tiles, "
+            f"{len(archive.bands)} {archive.codec} bands of {archive.band_rows} rows: "
+            f"{megabytes(archive_bytes)} for a {megabytes(grid_bytes)} grid"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,611 @@
+"""
+Local map conversion server.
+
+Keeps a pool of worker processes with json2yaml, NumPy, Pillow and
+keys.json already loaded, so converting one more map costs only the
+conversion itself. Each worker also keeps a ChunkMemo across jobs, so the
+chunks shared by the maps it converts are encoded once. Uploads wait in a
+bounded queue, and the YAML is streamed back as soon as its map is written.
+
+    POST /convert     body: a PNG, a tileMap JSON, a .npy tile grid or a
+                      .tiles archive (guessed from its first bytes, or
+                      ?format=png|json|npy|tiles).
+                      Other query options: sparse_atmosphere=1,
+                      tile_entities=0, max_width=N, max_height=N (PNG only).
+                      Answers with the map YAML.
+    GET  /metrics     queue depth, running jobs and latency figures as JSON
+    GET  /health      "ok"
+
+Usage: python map_server.py [--port 8014] [--workers 4]
+       curl --data-binary @test.png http://127.0.0.1:8014/convert -o map.yml
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import shutil
+import signal
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+from chunk_memo import ChunkMemo
+from json2yaml import SCRIPT_DIR, load_tile_entities, save_map_to_yaml
+from map_archive import MAGIC as ARCHIVE_MAGIC
+from png2yaml import DEFAULT_MAX_SIZE, image_to_tile_map, load_color_keys
+from tile_loader import load_tile_map
+
+DEFAULT_PORT = 8014
+DEFAULT_MAX_QUEUE = 64
+DEFAULT_MAX_UPLOAD_MB = 256
+STREAM_CHUNK_SIZE = 64 * 1024
+# Jobs kept for the latency percentiles, and the ones listed in /metrics
+LATENCY_HISTORY = 1000
+RECENT_JOBS = 20
+MAGIC_FORMATS = ((b"\x89PNG", "png"), (b"\x93NUMPY", "npy"), (ARCHIVE_MAGIC, "tiles"))
+INPUT_EXTENSIONS = {"png": ".png", "json": ".json", "npy": ".npy", "tiles": ".tiles"}
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    411: "Length Required",
+    413: "Payload Too Large",
+    422: "Unprocessable Entity",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers or {}
+
+
+# -----------------------------------------------------------------------------
+# Worker processes
+# -----------------------------------------------------------------------------
+_warm = {}
+
+
+def _init_worker(keys_path):
+    """Loads what every conversion needs, once per worker process."""
+    _warm["tile_entities"] = load_tile_entities(keys_path)
+    _warm["color_keys"] = load_color_keys(keys_path)
+    _warm["memo"] = ChunkMemo()
+    try:
+        from PIL import Image  # noqa: F401
+    except ImportError:
+        pass  # Only PNG uploads need it
+
+
+def _ping():
+    return os.getpid()
+
+
+def convert_upload(kind, input_path, output_path, options):
+    """
+    Converts an uploaded file into a map YAML (runs in a worker process).
+
+    Args:
+        kind: "png", "json", "npy" or "tiles".
+        options: The conversion options of the request.
+
+    Returns:
+        A dictionary with the map size, the number of unknown pixels and
+        the number of chunks served from the worker's memo.
+    """
+    unknown = 0
+    if kind == "png":
+        from PIL import Image
+
+        with Image.open(input_path) as image:
+            image.load()
+            tile_map, unknown = image_to_tile_map(
+                image, _warm["color_keys"], options["max_width"], options["max_height"]
+            )
+    else:
+        tile_map = load_tile_map(input_path)
+    output_dir, filename = os.path.split(output_path)
+    memo = _warm["memo"]
+    reused = memo.hits
+    save_map_to_yaml(
+        tile_map,
+        output_dir,
+        filename=filename,
+        sparse_atmosphere=options["sparse_atmosphere"],
+        tile_entities=_warm["tile_entities"] if options["tile_entities"] else None,
+        memo=memo,
+    )
+    height, width = tile_map.shape
+    return {
+        "width": width,
+        "height": height,
+        "unknown": unknown,
+        "chunks_reused": memo.hits - reused,
+    }
+
+
+# -----------------------------------------------------------------------------
+# Jobs and metrics
+# -----------------------------------------------------------------------------
+class Job:
+    """One conversion, from its upload to the end of its response."""
+
+    def __init__(self, job_id, kind, input_path, output_path, options, future):
+        self.id = job_id
+        self.kind = kind
+        self.input_path = input_path
+        self.output_path = output_path
+        self.options = options
+        self.future = future
+        self.received = time.perf_counter()
+        self.started = None
+        self.finished = None
+        # Set when the client is gone before the conversion ended: the
+        # dispatcher then removes the files once the worker is done with them
+        self.abandoned = False
+
+    def remove_files(self):
+        for path in (self.input_path, self.output_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def record(self, status, size=None):
+        now = time.perf_counter()
+        return {
+            "id": self.id,
+            "format": self.kind,
+            "status": status,
+            "size": size,
+            "wait_s": None if self.started is None else round(self.started - self.received, 6),
+            "convert_s": (
+                None if self.finished is None else round(self.finished - self.started, 6)
+            ),
+            "total_s": round(now - self.received, 6),
+        }
+
+
+def _percentile(ordered, fraction):
+    return ordered[round(fraction * (len(ordered) - 1))]
+
+
+class Metrics:
+    """Job counts and latencies of the server."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.latencies = deque(maxlen=LATENCY_HISTORY)
+        self.waits = deque(maxlen=LATENCY_HISTORY)
+        self.recent = deque(maxlen=RECENT_JOBS)
+
+    def record(self, record):
+        if record["status"] == "ok":
+            self.completed += 1
+            self.latencies.append(record["total_s"])
+            self.waits.append(record["wait_s"])
+        else:
+            self.failed += 1
+        self.recent.append(record)
+
+    @staticmethod
+    def _summary(values):
+        if not values:
+            return None
+        ordered = sorted(values)
+        return {
+            "count": len(ordered),
+            "mean": round(sum(ordered) / len(ordered), 6),
+            "p50": _percentile(ordered, 0.5),
+            "p95": _percentile(ordered, 0.95),
+            "max": ordered[-1],
+        }
+
+    def snapshot(self, queue_depth, running, workers):
+        return {
+            "uptime_s": round(time.time() - self.started, 3),
+            "workers": workers,
+            "queue_depth": queue_depth,
+            "running": running,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "latency_s": self._summary(self.latencies),
+            "queue_wait_s": self._summary(self.waits),
+            "recent": list(self.recent),
+        }
+
+
+# -----------------------------------------------------------------------------
+# HTTP
+# -----------------------------------------------------------------------------
+async def read_request_head(reader):
+    """Reads the request line and headers. Returns (method, target, headers) or None."""
+    request_line = await reader.readline()
+    if not request_line.strip():
+        return None
+    parts = request_line.decode("latin-1").split()
+    if len(parts) != 3:
+        raise HttpError(400, "malformed request line")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    return parts[0], parts[1], headers
+
+
+def _head(status, headers):
+    lines = [f"HTTP/1.1 {status} {REASONS.get(status, '')}"]
+    lines.extend(f"{name}: {value}" for name, value in headers.items())
+    lines.append("Connection: close")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+async def send_response(writer, status, body, content_type="application/json", headers=None):
+    if not isinstance(body, bytes):
+        body = body.encode("utf-8")
+    all_headers = {"Content-Type": content_type, "Content-Length": len(body)}
+    all_headers.update(headers or {})
+    writer.write(_head(status, all_headers) + body)
+    await writer.drain()
+
+
+async def send_file(writer, path, content_type, headers):
+    """Streams a file as a chunked response."""
+    all_headers = {"Content-Type": content_type, "Transfer-Encoding": "chunked"}
+    all_headers.update(headers)
+    writer.write(_head(200, all_headers))
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(STREAM_CHUNK_SIZE)
+            if not data:
+                break
+            writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+            await writer.drain()
+    writer.write(b"0\r\n\r\n")
+    await writer.drain()
+
+
+def _flag(query, name, default):
+    value = query.get(name, [None])[-1]
+    if value is None:
+        return default
+    return value.lower() not in ("0", "false", "no", "off", "")
+
+
+def _number(query, name, default):
+    value = query.get(name, [None])[-1]
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise HttpError(400, f"{name} must be an integer")
+
+
+def conversion_options(query):
+    return {
+        "sparse_atmosphere": _flag(query, "sparse_atmosphere", False),
+        "tile_entities": _flag(query, "tile_entities", True),
+        "max_width": _number(query, "max_width", DEFAULT_MAX_SIZE),
+        "max_height": _number(query, "max_height", DEFAULT_MAX_SIZE),
+    }
+
+
+def guess_format(path):
+    """The upload format from its first bytes: png, npy, tiles, or else json."""
+    with open(path, "rb") as f:
+        start = f.read(8)
+    for magic, kind in MAGIC_FORMATS:
+        if start.startswith(magic):
+            return kind
+    return "json"
+
+
+# -----------------------------------------------------------------------------
+# Server
+# -----------------------------------------------------------------------------
+class MapServer:
+    """Accepts uploads, queues them and converts them on the worker pool."""
+
+    def __init__(
+        self,
+        workers,
+        spool_dir,
+        keys_path,
+        max_queue=DEFAULT_MAX_QUEUE,
+        max_upload=DEFAULT_MAX_UPLOAD_MB * 1024 * 1024,
+    ):
+        self.workers = workers
+        self.spool_dir = spool_dir
+        self.keys_path = keys_path
+        self.max_upload = max_upload
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.metrics = Metrics()
+        self.running = 0
+        self.pool = None
+        self._ids = itertools.count(1)
+        self._dispatchers = []
+
+    async def start(self):
+        """Starts the worker processes and waits until all of them are warm."""
+        loop = asyncio.get_running_loop()
+        self.pool = ProcessPoolExecutor(
+            max_workers=self.workers, initializer=_init_worker, initargs=(self.keys_path,)
+        )
+        # One ping per worker starts the processes (and runs their initializer)
+        # now rather than on the first uploads
+        await asyncio.gather(
+            *(loop.run_in_executor(self.pool, _ping) for _ in range(self.workers))
+        )
+        self._dispatchers = [
+            asyncio.create_task(self._dispatch()) for _ in range(self.workers)
+        ]
+
+    async def close(self):
+        for task in self._dispatchers:
+            task.cancel()
+        await asyncio.gather(*self._dispatchers, return_exceptions=True)
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self.queue.get()
+            if job.abandoned:
+                job.remove_files()
+                self.queue.task_done()
+                continue
+            job.started = time.perf_counter()
+            self.running += 1
+            try:
+                result = await loop.run_in_executor(
+                    self.pool,
+                    convert_upload,
+                    job.kind,
+                    job.input_path,
+                    job.output_path,
+                    job.options,
+                )
+            except Exception as e:
+                if not job.future.done():
+                    job.future.set_exception(e)
+            else:
+                if not job.future.done():
+                    job.future.set_result(result)
+            finally:
+                job.finished = time.perf_counter()
+                self.running -= 1
+                self.queue.task_done()
+                if job.abandoned:
+                    job.remove_files()
+
+    async def handle(self, reader, writer):
+        try:
+            request = await read_request_head(reader)
+            if request is not None:
+                await self.route(*request, reader, writer)
+        except HttpError as e:
+            await send_response(
+                writer, e.status, json.dumps({"error": e.message}), headers=e.headers
+            )
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass  # The client went away
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def route(self, method, target, headers, reader, writer):
+        url = urlsplit(target)
+        if url.path == "/health":
+            await send_response(writer, 200, "ok\n", content_type="text/plain")
+        elif url.path == "/metrics":
+            snapshot = self.metrics.snapshot(self.queue.qsize(), self.running, self.workers)
+            await send_response(writer, 200, json.dumps(snapshot, indent=2))
+        elif url.path == "/convert":
+            if method != "POST":
+                raise HttpError(405, "use POST", {"Allow": "POST"})
+            await self.convert(parse_qs(url.query), headers, reader, writer)
+        else:
+            raise HttpError(404, f"no such path: {url.path}")
+
+    async def _receive(self, reader, headers, path):
+        """Copies the request body to path without holding all of it in memory."""
+        if "content-length" not in headers:
+            raise HttpError(411, "send the upload with a Content-Length")
+        try:
+            remaining = int(headers["content-length"])
+        except ValueError:
+            raise HttpError(400, "invalid Content-Length")
+        if remaining > self.max_upload:
+            raise HttpError(413, f"uploads are limited to {self.max_upload} bytes")
+        if remaining == 0:
+            raise HttpError(400, "empty upload")
+        with open(path, "wb") as f:
+            while remaining:
+                data = await reader.read(min(remaining, STREAM_CHUNK_SIZE))
+                if not data:
+                    raise asyncio.IncompleteReadError(b"", remaining)
+                f.write(data)
+                remaining -= len(data)
+
+    async def convert(self, query, headers, reader, writer):
+        options = conversion_options(query)
+        kind = query.get("format", [None])[-1]
+        if kind is not None and kind not in INPUT_EXTENSIONS:
+            raise HttpError(400, f"format must be one of {', '.join(INPUT_EXTENSIONS)}")
+        if self.queue.full():
+            self.metrics.rejected += 1
+            raise HttpError(503, "the queue is full, try again later", {"Retry-After": 5})
+
+        job_id = next(self._ids)
+        upload_path = os.path.join(self.spool_dir, f"job{job_id}.upload")
+        output_path = os.path.join(self.spool_dir, f"job{job_id}.yml")
+        job = queued = None
+        try:
+            await self._receive(reader, headers, upload_path)
+            if kind is None:
+                kind = guess_format(upload_path)
+            # The loaders pick the parser from the extension
+            input_path = os.path.splitext(upload_path)[0] + INPUT_EXTENSIONS[kind]
+            os.replace(upload_path, input_path)
+            upload_path = input_path
+
+            job = Job(
+                job_id,
+                kind,
+                input_path,
+                output_path,
+                options,
+                asyncio.get_running_loop().create_future(),
+            )
+            try:
+                self.queue.put_nowait(job)
+            except asyncio.QueueFull:
+                self.metrics.rejected += 1
+                job = None
+                raise HttpError(503, "the queue is full, try again later", {"Retry-After": 5})
+            queued = job
+            try:
+                # Shielded so a cancelled handler does not cancel the conversion
+                result = await asyncio.shield(job.future)
+            except (OSError, ValueError, KeyError) as e:
+                raise HttpError(422, f"could not convert the {kind} upload: {e}")
+            except Exception as e:
+                raise HttpError(500, f"{type(e).__name__}: {e}")
+
+            await send_file(
+                writer,
+                output_path,
+                "application/x-yaml",
+                {
+                    "Content-Disposition": f'attachment; filename="map{job_id}.yml"',
+                    "X-Job-Id": job_id,
+                    "X-Map-Size": f"{result['width']}x{result['height']}",
+                    "X-Unknown-Pixels": result["unknown"],
+                    "X-Chunks-Reused": result["chunks_reused"],
+                    "X-Queue-Wait": f"{job.started - job.received:.6f}",
+                    "X-Convert-Seconds": f"{job.finished - job.started:.6f}",
+                },
+            )
+            self.metrics.record(job.record("ok", f"{result['width']}x{result['height']}"))
+            job = None
+        finally:
+            if job is not None:
+                self.metrics.record(job.record("failed"))
+            if queued is not None and not queued.future.done():
+                # A worker may still be converting the files; the dispatcher
+                # removes them when it is done
+                queued.abandoned = True
+            else:
+                for path in (upload_path, output_path):
+                    if os.path.exists(path):
+                        os.remove(path)
+
+
+async def serve(args):
+    spool_dir = args.spool or tempfile.mkdtemp(prefix="map-server-")
+    os.makedirs(spool_dir, exist_ok=True)
+    server = MapServer(
+        args.workers,
+        spool_dir,
+        args.keys,
+        max_queue=args.max_queue,
+        max_upload=args.max_upload * 1024 * 1024,
+    )
+    await server.start()
+    if args.unix:
+        listener = await asyncio.start_unix_server(server.handle, path=args.unix)
+        where = args.unix
+    else:
+        listener = await asyncio.start_server(server.handle, args.host, args.port)
+        host, port = listener.sockets[0].getsockname()[:2]
+        where = f"http://{host}:{port}"
+    try:
+        # Stop cleanly (removing the spool folder) on kill as on Ctrl+C
+        asyncio.get_running_loop().add_signal_handler(
+            signal.SIGTERM, asyncio.current_task().cancel
+        )
+    except NotImplementedError:
+        pass  # Windows
+    print(f"{args.workers} warm workers, serving on {where} (Ctrl+C to stop)", flush=True)
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        await server.close()
+        if args.unix and os.path.exists(args.unix):
+            os.remove(args.unix)
+        if not args.spool:
+            shutil.rmtree(spool_dir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Serves map conversions to Civ14 YAML from a warm worker pool."
+    )
+    parser.add_argument(
+        "--host", default="127.0.0.1", help="address to listen on (default: 127.0.0.1)"
+    )
+    parser.add_argument(
+        "--port", type=int, default=DEFAULT_PORT, help=f"port (default: {DEFAULT_PORT}, 0 = any)"
+    )
+    parser.add_argument("--unix", help="listen on this Unix socket instead of TCP")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=max(1, (os.cpu_count() or 2) // 2),
+        help="number of conversion processes (default: half the CPUs)",
+    )
+    parser.add_argument(
+        "--max-queue",
+        type=int,
+        default=DEFAULT_MAX_QUEUE,
+        help="uploads waiting for a worker before new ones are refused "
+        f"(default: {DEFAULT_MAX_QUEUE})",
+    )
+    parser.add_argument(
+        "--max-upload",
+        type=int,
+        default=DEFAULT_MAX_UPLOAD_MB,
+        help=f"largest accepted upload in MB (default: {DEFAULT_MAX_UPLOAD_MB})",
+    )
+    parser.add_argument(
+        "--keys",
+        default=os.path.join(SCRIPT_DIR, "keys.json"),
+        help="color to tile table (default: keys.json)",
+    )
+    parser.add_argument(
+        "--spool", help="folder for uploads and maps being converted (default: a temporary one)"
+    )
+    args = parser.parse_args(argv)
+    if args.unix and not hasattr(asyncio, "start_unix_server"):
+        parser.error("--unix is not available on this platform")
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+
+    try:
+        asyncio.run(serve(args))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+"""
+Streaming YAML writer for Civ14 maps.
+
+PyYAML has to represent and emit the whole map document at once, which for
+large maps means tens of thousands of chunk and atmosphere dictionaries in
+memory. This writer walks the map structure itself: values wrapped in
+StreamedMapping or StreamedSequence are produced lazily and written entry by
+entry with a small hand-rolled emitter, while anything the emitter is not
+sure about is handed to the shared ss14_yaml dumper (libyaml-backed, when
+available, and aware of `!type:` tags) as small fragments.
+"""
+
+import os
+import re
+import sys
+
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+import ss14_yaml  # noqa: E402
+from ss14_yaml import Dumper  # noqa: E402
+
+# "x,y" coordinates and positions never resolve to anything but a string
+_COORDINATE = re.compile(r"-?\d+(?:\.\d+)?,-?\d+(?:\.\d+)?")
+# Strings (like base64 chunk data) that are plain scalars if the resolver agrees
+_PLAIN_SAFE = re.compile(r"[A-Za-z0-9+/][A-Za-z0-9+/=]*")
+_resolver = yaml.resolver.Resolver()
+
+
+class StreamedMapping:
+    """A mapping whose (key, value) pairs are produced while the file is written."""
+
+    __slots__ = ("factory",)
+
+    def __init__(self, factory):
+        """
+        Args:
+            factory: A callable returning a fresh iterator of (key, value) pairs.
+        """
+        self.factory = factory
+
+    def __iter__(self):
+        return iter(self.factory())
+
+    def to_dict(self):
+        """Materializes the mapping (for callers that need the whole dict)."""
+        return dict(self.factory())
+
+
+class StreamedSequence:
+    """A sequence whose items are produced while the file is written."""
+
+    __slots__ = ("factory",)
+
+    def __init__(self, factory):
+        """
+        Args:
+            factory: A callable returning a fresh iterator over the items.
+        """
+        self.factory = factory
+
+    def __iter__(self):
+        return iter(self.factory())
+
+    def to_list(self):
+        """Materializes the sequence (for callers that need the whole list)."""
+        return list(self.factory())
+
+
+_STREAMED = (StreamedMapping, StreamedSequence)
+
+
+def _contains_stream(value):
+    if isinstance(value, _STREAMED):
+        return True
+    if isinstance(value, dict):
+        return any(_contains_stream(v) for v in value.values())
+    if isinstance(value, list):
+        return any(_contains_stream(v) for v in value)
+    return False
+
+
+def _format_scalar(value):
+    """Returns the plain YAML form of simple scalars, or None if unsure."""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, int):
+        return str(value)
+    if not isinstance(value, str):
+        return None
+    if _COORDINATE.fullmatch(value):
+        return value
+    if (
+        _PLAIN_SAFE.fullmatch(value)
+        and _resolver.resolve(yaml.ScalarNode, value, (True, False))
+        == yaml.resolver.BaseResolver.DEFAULT_SCALAR_TAG
+    ):
+        return value
+    return None
+
+
+def _fast_entry(key, value, prefix, pad, lines):
+    """
+    Appends the block YAML lines of `key: value` without going through PyYAML.
+
+    `prefix` starts the first line, `pad` is the indentation of the key.
+    Returns False if something needs the dumper (lines are then discarded).
+    """
+    key_text = _format_scalar(key)
+    if key_text is None:
+        return False
+    if isinstance(value, dict):
+        if not value:
+            lines.append(f"{prefix}{key_text}: {{}}\n")
+            return True
+        lines.append(f"{prefix}{key_text}:\n")
+        inner = pad + "  "
+        for sub_key, sub_value in value.items():
+            if not _fast_entry(sub_key, sub_value, inner, inner, lines):
+                return False
+        return True
+    if isinstance(value, list):
+        if not value:
+            lines.append(f"{prefix}{key_text}: []\n")
+            return True
+        lines.append(f"{prefix}{key_text}:\n")
+        # Like PyYAML, sequences are not indented under their key
+        return all(_fast_item(item, pad, lines) for item in value)
+    value_text = _format_scalar(value)
+    if value_text is None:
+        return False
+    lines.append(f"{prefix}{key_text}: {value_text}\n")
+    return True
+
+
+def _fast_item(item, pad, lines):
+    """Appends the lines of one `- item` sequence entry (see _fast_entry)."""
+    if isinstance(item, dict):
+        if not item:
+            return False
+        prefix = pad + "- "
+        inner = pad + "  "
+        for key, value in item.items():
+            if not _fast_entry(key, value, prefix, inner, lines):
+                return False
+            prefix = inner
+        return True
+    if isinstance(item, list):
+        return False
+    item_text = _format_scalar(item)
+    if item_text is None:
+        return False
+    lines.append(f"{pad}- {item_text}\n")
+    return True
+
+
+class MapYamlWriter:
+    """Writes a map document to a text stream, expanding streamed values lazily."""
+
+    def __init__(self, stream, dumper=Dumper):
+        self.stream = stream
+        self.dumper = dumper
+
+    def write(self, data):
+        """Writes the whole document."""
+        self._write_mapping(data.items(), 0, "")
+
+    def _dump(self, data, pad, first_prefix):
+        """Writes a fragment with the generic dumper, shifted to the given indentation."""
+        text = ss14_yaml.dump(data, Dumper=self.dumper)
+        lines = text.splitlines(True)
+        out = [first_prefix + lines[0]]
+        out.extend(pad + line if line.strip() else line for line in lines[1:])
+        self.stream.write("".join(out))
+
+    def _write_mapping(self, items, depth, first_prefix):
+        pad = " " * depth
+        prefix = first_prefix or pad
+        for key, value in items:
+            lines = []
+            if _fast_entry(key, value, prefix, pad, lines):
+                self.stream.write("".join(lines))
+            elif _contains_stream(value):
+                self.stream.write(f"{prefix}{_format_scalar(key) or key}:")
+                self._write_nested(value, depth)
+            else:
+                self._dump({key: value}, pad, prefix)
+            prefix = pad
+
+    def _write_nested(self, value, depth):
+        """Writes a value that contains streamed parts, after its `key:`."""
+        if isinstance(value, (list, StreamedSequence)):
+            iterator = iter(value)
+            first = next(iterator, _END)
+            if first is _END:
+                self.stream.write(" []\n")
+                return
+            self.stream.write("\n")
+            self._write_sequence(_chain_first(first, iterator), depth)
+            return
+        items = value if isinstance(value, StreamedMapping) else value.items()
+        iterator = iter(items)
+        first = next(iterator, _END)
+        if first is _END:
+            self.stream.write(" {}\n")
+            return
+        self.stream.write("\n")
+        self._write_mapping(_chain_first(first, iterator), depth + 2, "")
+
+    def _write_sequence(self, values, depth):
+        # PyYAML's default block style does not indent sequences under a key
+        pad = " " * depth
+        for value in values:
+            lines = []
+            if _fast_item(value, pad, lines):
+                self.stream.write("".join(lines))
+            elif isinstance(value, dict) and value and _contains_stream(value):
+                self._write_mapping(value.items(), depth + 2, pad + "- ")
+            else:
+                self._dump([value], pad, pad)
+
+
+_END = object()
+
+
+def _chain_first(first, iterator):
+    yield first
+    yield from iterator
+
+
+def write_map_yaml(stream, data, dumper=Dumper):
+    """
+    Writes a map document to `stream`.
+
+    Args:
+        stream: A writable text stream.
+        data: The map document; streamed values are written lazily.
+        dumper: The PyYAML dumper used for the parts the fast path cannot write.
+    """
+    MapYamlWriter(stream, dumper).write(data)
@@ -0,0 +1,170 @@
+"""
+Converts an indexed PNG straight into a Civ14 map.
+
+This does the work of image2map.js and json2yaml.py in one step: the image
+colors are mapped to tile ids through keys.json with a lookup table over the
+whole pixel array, and the resulting grid is passed to save_map_to_yaml,
+without writing the intermediate per-pixel JSON.
+
+Usage: python png2yaml.py [test.png ...] [--output output/nomads_from_json.yml]
+"""
+
+import argparse
+import json
+import os
+
+import numpy as np
+
+from json2yaml import (
+    SCRIPT_DIR,
+    MapBatch,
+    add_output_arguments,
+    batch_outputs,
+    check_batch_outputs,
+    check_output_arguments,
+)
+from tile_loader import smallest_tile_dtype
+
+# Same defaults as image2map.js
+DEFAULT_MAX_SIZE = 1000
+
+
+def load_color_keys(keys_path=None):
+    """
+    Reads keys.json (the one next to this script by default).
+
+    Returns:
+        A dictionary mapping packed 0xRRGGBB colors to tile ids.
+    """
+    with open(keys_path or os.path.join(SCRIPT_DIR, "keys.json"), "r") as f:
+        keys = json.load(f)
+    return {int(entry["color"].lstrip("#"), 16): int(key) for key, entry in keys.items()}
+
+
+def pack_rgb(pixels):
+    """Packs an (..., 3) uint8 RGB array into 0xRRGGBB integers."""
+    pixels = pixels.astype(np.uint32)
+    return (pixels[..., 0] << 16) | (pixels[..., 1] << 8) | pixels[..., 2]
+
+
+def image_to_tile_map(image, color_keys, max_width=0, max_height=0, default_tile=0):
+    """
+    Maps every pixel of a PIL image to its tile id.
+
+    Palette images are looked up through their (at most 256 entry) palette;
+    other images are reduced to their unique colors first. Colors missing
+    from keys.json become `default_tile`, like the undefined ids that
+    json2yaml.py used to fill with 0.
+
+    Args:
+        image: A PIL image.
+        color_keys: The mapping returned by load_color_keys.
+        max_width: Scale the image down to at most this width (0 = no limit).
+        max_height: Scale the image down to at most this height (0 = no limit).
+        default_tile: The id used for unknown colors.
+
+    Returns:
+        A tuple (tile_map, unknown) with the grid, in the smallest dtype
+        that holds its ids, and the number of pixels whose color was not found.
+    """
+    from PIL import Image
+
+    image = _fit(image, max_width, max_height, Image.NEAREST)
+    if image.mode == "P":
+        indices = np.asarray(image)
+        palette = np.asarray(image.getpalette("RGB"), dtype=np.uint8).reshape(-1, 3)
+        colors = pack_rgb(palette)
+    else:
+        rgb = np.asarray(image.convert("RGB"))
+        colors, indices = np.unique(pack_rgb(rgb).ravel(), return_inverse=True)
+        indices = indices.reshape(rgb.shape[:2])
+
+    lut = np.full(len(colors), -1, dtype=np.int32)
+    for i, color in enumerate(colors.tolist()):
+        lut[i] = color_keys.get(color, -1)
+    missing = lut < 0
+    count = int(np.count_nonzero(missing[indices])) if missing.any() else 0
+    lut[missing] = default_tile
+    # The grid is built directly in its final dtype, never as int32
+    lut = lut.astype(smallest_tile_dtype(int(lut.max(initial=0)), int(lut.min(initial=0))))
+    return lut[indices], count
+
+
+def _fit(image, max_width, max_height, resample):
+    """Scales the image down like image2map.js does, keeping the aspect ratio."""
+    width, height = image.size
+    if max_width and width > max_width:
+        height *= max_width / width
+        width = max_width
+    if max_height and height > max_height:
+        width *= max_height / height
+        height = max_height
+    size = (int(width), int(height))
+    if size == image.size:
+        return image
+    return image.resize(size, resample)
+
+
+def png_to_tile_map(png_path, keys_path=None, max_width=0, max_height=0):
+    """Loads a PNG and returns (tile_map, unknown_pixel_count)."""
+    from PIL import Image
+
+    color_keys = load_color_keys(keys_path)
+    with Image.open(png_path) as image:
+        image.load()
+        return image_to_tile_map(image, color_keys, max_width, max_height)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Converts an indexed PNG straight into a Civ14 map."
+    )
+    parser.add_argument(
+        "inputs",
+        nargs="*",
+        metavar="input",
+        default=[os.path.join(SCRIPT_DIR, "test.png")],
+        help="the map image (default: test.png); with several images, each map "
+        "is written to the --output folder under its image's name",
+    )
+    parser.add_argument(
+        "--keys",
+        default=os.path.join(SCRIPT_DIR, "keys.json"),
+        help="color to tile table (default: keys.json)",
+    )
+    parser.add_argument(
+        "--max-width",
+        type=int,
+        default=DEFAULT_MAX_SIZE,
+        help=f"scale wider images down (default: {DEFAULT_MAX_SIZE}, 0 = no limit)",
+    )
+    parser.add_argument(
+        "--max-height",
+        type=int,
+        default=DEFAULT_MAX_SIZE,
+        help=f"scale taller images down (default: {DEFAULT_MAX_SIZE}, 0 = no limit)",
+    )
+    add_output_arguments(parser)
+    args = parser.parse_args(argv)
+    check_output_arguments(parser, args)
+    outputs = batch_outputs(args.inputs, args.output)
+    check_batch_outputs(parser, outputs)
+
+    with MapBatch(args) as batch:
+        for input_path, output in zip(args.inputs, outputs):
+            tile_map, unknown = png_to_tile_map(
+                input_path, args.keys, args.max_width, args.max_height
+            )
+            if unknown:
+                print(
+                    f"Warning: {unknown} pixels of {input_path} have colors "
+                    f"missing from {args.keys}"
+                )
+            batch.write(tile_map, output)
+            if len(args.inputs) > 1:
+                print(f"{input_path} -> {output}")
+    print("Map generated from PNG successfully!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+"""
+Loaders for the tile grids produced by image2map.js.
+
+The JSON output stores one "x,y" key per pixel. Instead of evaluating every
+key, the keys are joined and parsed in bulk by NumPy, so the grid is filled
+with a single fancy-indexing assignment. Maps can also be loaded from the
+raw `.npy` sidecar that image2map.js writes next to the JSON, or from a raw
+grid file; both are opened as a TileGrid and read one band of rows at a
+time, so maps larger than the memory available can be converted. The
+compressed `.tiles` archives of map_archive.py are read by bands as well.
+
+Grids are stored in the smallest dtype that holds their tile ids (uint8 for
+the ids in keys.json).
+"""
+
+import json
+import os
+
+import numpy as np
+
+# Number of tileMap entries parsed per batch when streaming the JSON
+STREAM_BATCH_SIZE = 1 << 16
+RAW_EXTENSIONS = (".raw", ".bin")
+ARCHIVE_EXTENSION = ".tiles"
+
+
+def smallest_tile_dtype(max_id, min_id=0):
+    """The smallest dtype that holds tile ids from min_id to max_id: uint8, uint16 or int32."""
+    if min_id >= 0:
+        for dtype in (np.uint8, np.uint16):
+            if max_id <= np.iinfo(dtype).max:
+                return np.dtype(dtype)
+    return np.dtype(np.int32)
+
+
+def narrow_tile_map(tile_map):
+    """Returns the grid in the smallest dtype that holds its ids (not copied if it already is)."""
+    if tile_map.size == 0:
+        return tile_map.astype(np.uint8)
+    dtype = smallest_tile_dtype(int(tile_map.max()), int(tile_map.min()))
+    return tile_map.astype(dtype, copy=False)
+
+
+class TileGrid:
+    """
+    A (height, width) tile grid in a file, read one band of rows at a time.
+
+    Slicing rows (`grid[start:stop]`) maps only those rows of the file, so
+    neither the memory nor the address space used grow with the size of the
+    map. The code that walks the map by bands of rows (chunk encoding,
+    atmosphere, per-tile entities) takes a TileGrid wherever it takes an
+    array; `np.asarray(grid)` reads the whole grid.
+    """
+
+    ndim = 2
+
+    def __init__(self, path, shape, dtype, offset=0):
+        self.path = path
+        self.shape = tuple(int(n) for n in shape)
+        self.dtype = np.dtype(dtype)
+        self.offset = offset
+
+    @classmethod
+    def open_npy(cls, path):
+        """Opens a C-order .npy file. Returns None for the Fortran-order ones."""
+        with open(path, "rb") as f:
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                header = np.lib.format.read_array_header_1_0(f)
+            else:
+                header = np.lib.format.read_array_header_2_0(f)
+            shape, fortran_order, dtype = header
+            offset = f.tell()
+        if len(shape) != 2:
+            raise ValueError(f"{path}: expected a 2D tile grid, got {len(shape)}D")
+        if dtype.kind not in "iu":
+            raise ValueError(f"{path}: expected integer tile ids, got {dtype}")
+        if fortran_order:
+            return None
+        return cls(path, shape, dtype, offset)
+
+    @classmethod
+    def open_raw(cls, path, shape, dtype):
+        """Opens a headerless row-major grid of the given shape and dtype."""
+        grid = cls(path, shape, dtype)
+        expected = grid.size * grid.dtype.itemsize
+        actual = os.path.getsize(path)
+        if actual != expected:
+            raise ValueError(
+                f"{path}: {actual} bytes, but a {shape[1]}x{shape[0]} {grid.dtype} grid "
+                f"needs {expected}"
+            )
+        return grid
+
+    @property
+    def size(self):
+        return self.shape[0] * self.shape[1]
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        columns = slice(None)
+        if isinstance(key, tuple):
+            key, columns = key
+        if not isinstance(key, slice) or key.step not in (None, 1):
+            raise TypeError("TileGrid only supports slices of consecutive rows")
+        start, stop, _ = key.indices(self.shape[0])
+        stop = max(start, stop)
+        height, width = self.shape
+        if stop == start or width == 0:
+            return np.empty((stop - start, width), self.dtype)[:, columns]
+        rows = np.memmap(
+            self.path,
+            dtype=self.dtype,
+            mode="r",
+            offset=self.offset + start * width * self.dtype.itemsize,
+            shape=(stop - start, width),
+        )
+        return rows[:, columns]
+
+    def __array__(self, dtype=None, copy=None):
+        grid = np.array(self[:], copy=True)
+        return grid if dtype is None else grid.astype(dtype, copy=False)
+
+
+def iter_bands(tile_map, rows):
+    """Yields (first_row, band) for consecutive bands of `rows` rows of an array or TileGrid."""
+    for start in range(0, tile_map.shape[0], rows):
+        yield start, tile_map[start : start + rows]
+
+
+def parse_positions(keys):
+    """
+    Parses "x,y" tileMap keys in bulk.
+
+    Args:
+        keys: An iterable of "x,y" strings.
+
+    Returns:
+        Two int32 arrays with the x and y coordinates.
+    """
+    keys = list(keys)
+    if not keys:
+        empty = np.empty(0, dtype=np.int32)
+        return empty, empty
+    coords = np.fromstring(",".join(keys), dtype=np.int64, sep=",")
+    if coords.size != 2 * len(keys):
+        raise ValueError("Malformed tileMap key: expected 'x,y' integer pairs")
+    coords = coords.reshape(-1, 2)
+    return coords[:, 0].astype(np.int32), coords[:, 1].astype(np.int32)
+
+
+def parse_tile_ids(values):
+    """
+    Extracts the tile ids from tileMap values.
+
+    image2map.js stores the id directly, older exports store {"tile": id}.
+
+    Args:
+        values: A sized iterable of tileMap values.
+
+    Returns:
+        An int32 array with one tile id per value.
+    """
+    return np.fromiter(
+        (v["tile"] if isinstance(v, dict) else v for v in values),
+        dtype=np.int32,
+        count=len(values),
+    )
+
+
+def build_tile_map(xs, ys, ids):
+    """
+    Creates the (height, width) grid from coordinate and id arrays.
+
+    Positions missing from the input are left as 0, like the old loader.
+    The grid has the smallest dtype that holds the ids.
+    """
+    if xs.size == 0:
+        return np.zeros((0, 0), dtype=np.uint8)
+    if xs.min() < 0 or ys.min() < 0:
+        raise ValueError("Negative tileMap coordinates are not supported")
+    dtype = smallest_tile_dtype(int(ids.max()), min(int(ids.min()), 0))
+    tile_map = np.zeros((int(ys.max()) + 1, int(xs.max()) + 1), dtype=dtype)
+    tile_map[ys, xs] = ids
+    return tile_map
+
+
+def tile_map_from_dict(tilemap_data):
+    """Builds the grid from an already loaded tileMap dictionary."""
+    xs, ys = parse_positions(tilemap_data.keys())
+    ids = parse_tile_ids(list(tilemap_data.values()))
+    return build_tile_map(xs, ys, ids)
+
+
+def load_tile_map_json(json_path):
+    """Loads the tileMap of an image2map.js JSON file into a grid."""
+    with open(json_path, "r") as f:
+        data = json.load(f)
+    return tile_map_from_dict(data["tileMap"])
+
+
+def stream_tile_map_json(json_path, batch_size=STREAM_BATCH_SIZE):
+    """
+    Loads the tileMap with the incremental ijson parser.
+
+    Entries are parsed in batches into compact int32 arrays, so the full
+    tileMap dictionary is never held in memory.
+
+    Raises:
+        ImportError: If ijson is not installed.
+    """
+    import ijson
+
+    xs_parts, ys_parts, id_parts = [], [], []
+    keys, values = [], []
+
+    def flush():
+        xs, ys = parse_positions(keys)
+        xs_parts.append(xs)
+        ys_parts.append(ys)
+        id_parts.append(parse_tile_ids(values))
+        keys.clear()
+        values.clear()
+
+    with open(json_path, "rb") as f:
+        for key, value in ijson.kvitems(f, "tileMap"):
+            keys.append(key)
+            values.append(value)
+            if len(keys) >= batch_size:
+                flush()
+    if keys or not xs_parts:
+        flush()
+
+    return build_tile_map(
+        np.concatenate(xs_parts), np.concatenate(ys_parts), np.concatenate(id_parts)
+    )
+
+
+def load_tile_map_npy(npy_path):
+    """Loads the whole tile grid sidecar written by image2map.js into memory."""
+    tile_map = np.load(npy_path, allow_pickle=False)
+    if tile_map.ndim != 2:
+        raise ValueError(f"{npy_path}: expected a 2D tile grid, got {tile_map.ndim}D")
+    if tile_map.dtype.kind not in "iu":
+        tile_map = tile_map.astype(np.int32)
+    return tile_map
+
+
+def load_tile_map(path, stream=False, raw_shape=None, raw_dtype=np.uint8):
+    """
+    Loads a tile grid from a `.npy` sidecar, a raw grid or an image2map.js JSON file.
+
+    Args:
+        path: Path to the `.npy`, `.raw`/`.bin`, `.tiles` or `.json` file.
+        stream: Parse the JSON incrementally (needs ijson).
+        raw_shape: The (height, width) of a raw grid.
+        raw_dtype: The dtype of a raw grid.
+
+    Returns:
+        A (height, width) grid of tile ids: a TileGrid read band by band
+        for `.npy` and raw files, a map_archive.TileArchive for `.tiles`
+        files, a NumPy array for JSON.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".npy":
+        # Fortran-order files cannot be read by rows; they are loaded whole
+        return TileGrid.open_npy(path) or load_tile_map_npy(path)
+    if extension in RAW_EXTENSIONS:
+        if raw_shape is None:
+            raise ValueError(f"{path}: a raw grid needs its size (--raw-size WIDTHxHEIGHT)")
+        return TileGrid.open_raw(path, raw_shape, raw_dtype)
+    if extension == ARCHIVE_EXTENSION:
+        from map_archive import TileArchive
+
+        return TileArchive(path)
+    if stream:
+        return stream_tile_map_json(path)
+    return load_tile_map_json(path)
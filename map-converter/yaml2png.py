@@ -0,0 +1,359 @@
+"""
+Converts a Civ14 map YAML back into a tile grid and an indexed PNG.
+
+The map is read as a stream of YAML parser events, so no document tree is
+built: only the `tilemap` and the chunks of one MapGrid (the first, or the
+one picked with --grid) are picked out. Each chunk is base64-decoded and
+viewed as a structured id/flags/variant array, then copied into the grid at
+its `ind` position. Tile ids become palette indices
+through keys.json, so maps made by json2yaml.py or png2yaml.py convert
+back to the image they came from (padded to whole chunks).
+
+Usage: python yaml2png.py map.yml [--png map.png] [--npy map.npy] [--grid UID]
+"""
+
+import argparse
+import base64
+import json
+import math
+import os
+import sys
+
+import numpy as np
+import yaml
+
+from json2yaml import SCRIPT_DIR, TILE_DTYPE
+from tile_loader import narrow_tile_map
+
+sys.path.insert(0, os.path.join(SCRIPT_DIR, "..", "common"))
+import ss14_yaml  # noqa: E402
+
+# Chunk format written by json2yaml.py
+SUPPORTED_CHUNK_VERSION = 6
+# Palette index for tiles that have no color in keys.json
+UNKNOWN_INDEX = 255
+UNKNOWN_COLOR = (255, 0, 255)
+
+
+class _Frame:
+    __slots__ = (
+        "is_map", "name", "expect_key", "key", "values", "type", "uid", "is_grid", "pending"
+    )
+
+    def __init__(self, is_map, name, values=None):
+        self.is_map = is_map
+        self.name = name
+        self.expect_key = True
+        self.key = None
+        self.values = values
+        # The `type` and `uid` scalars of a mapping, for components and entities
+        self.type = None
+        self.uid = None
+        self.is_grid = False
+        # Chunks read before the component's `type`, kept until it is known
+        self.pending = []
+
+
+def _owner_uid(stack):
+    """The uid of the innermost entity around the top of the stack."""
+    for frame in reversed(stack):
+        if frame.uid is not None:
+            return frame.uid
+    return None
+
+
+def iter_map_parts(stream):
+    """
+    Scans a map YAML without building the document.
+
+    Only the `chunks` of `type: MapGrid` components are picked out; other
+    components that happen to have a `chunks` mapping are skipped.
+
+    Yields:
+        ("tilemap", {id: name}) once, ("grid", uid) when a MapGrid component
+        starts (uid being the uid of its entity), and ("chunk", {"ind",
+        "tiles", "version"}) for every chunk of the last grid, in file order.
+    """
+    stack = []
+    for event in ss14_yaml.parse(stream):
+        cls = event.__class__
+        if cls is yaml.ScalarEvent or cls is yaml.AliasEvent:
+            frame = stack[-1] if stack else None
+            if frame is None or not frame.is_map:
+                continue
+            if frame.expect_key:
+                frame.key = getattr(event, "value", None)
+                frame.expect_key = False
+                continue
+            value = getattr(event, "value", None)
+            if frame.values is not None:
+                frame.values[frame.key] = value
+            frame.expect_key = True
+            if frame.key == "uid":
+                frame.uid = value
+            elif frame.key == "type":
+                frame.type = value
+                if value == "MapGrid":
+                    frame.is_grid = True
+                    yield "grid", _owner_uid(stack)
+                    for chunk in frame.pending:
+                        yield "chunk", chunk
+                frame.pending = []
+        elif cls is yaml.MappingStartEvent or cls is yaml.SequenceStartEvent:
+            is_map = cls is yaml.MappingStartEvent
+            parent = stack[-1] if stack else None
+            name = parent.key if parent is not None and parent.is_map else None
+            values = None
+            if is_map and name == "tilemap" and len(stack) == 1:
+                values = {}
+            elif (
+                is_map
+                and name is not None
+                and parent.name == "chunks"
+                and len(stack) >= 2
+                and stack[-2].is_map
+                and stack[-2].type in (None, "MapGrid")
+            ):
+                values = {}
+            stack.append(_Frame(is_map, name, values))
+        elif cls is yaml.MappingEndEvent or cls is yaml.SequenceEndEvent:
+            frame = stack.pop()
+            if frame.values is not None:
+                if frame.name == "tilemap":
+                    yield "tilemap", frame.values
+                else:
+                    # stack[-1] is the chunks mapping, stack[-2] its component
+                    component = stack[-2]
+                    if component.is_grid:
+                        yield "chunk", frame.values
+                    elif component.type is None:
+                        component.pending.append(frame.values)
+            if stack and stack[-1].is_map:
+                stack[-1].expect_key = True
+
+
+class _GrowableGrid:
+    """A structured tile grid that grows (by doubling) as chunks arrive."""
+
+    def __init__(self, chunk_size):
+        self.chunk_size = chunk_size
+        self.grid = None
+        # Chunk coordinates of grid[0, 0] and the bounds of the placed chunks
+        self.origin = (0, 0)
+        self.low = None
+        self.high = None
+
+    def place(self, cx, cy, chunk):
+        cs = self.chunk_size
+        if self.grid is None:
+            self.grid = np.zeros((cs, cs), dtype=TILE_DTYPE)
+            self.origin = (cx, cy)
+            self.low = self.high = (cx, cy)
+        self.low = (min(self.low[0], cx), min(self.low[1], cy))
+        self.high = (max(self.high[0], cx), max(self.high[1], cy))
+        ox, oy = self.origin
+        rows, cols = self.grid.shape[0] // cs, self.grid.shape[1] // cs
+        if not (ox <= cx < ox + cols and oy <= cy < oy + rows):
+            self._grow()
+            ox, oy = self.origin
+        x, y = (cx - ox) * cs, (cy - oy) * cs
+        self.grid[y : y + cs, x : x + cs] = chunk
+
+    def _grow(self):
+        cs = self.chunk_size
+        rows, cols = self.grid.shape[0] // cs, self.grid.shape[1] // cs
+        (lx, ly), (hx, hy) = self.low, self.high
+        ox, oy = self.origin
+        new_ox, new_cols = _grow_axis(ox, cols, lx, hx)
+        new_oy, new_rows = _grow_axis(oy, rows, ly, hy)
+        grid = np.zeros((new_rows * cs, new_cols * cs), dtype=TILE_DTYPE)
+        x, y = (ox - new_ox) * cs, (oy - new_oy) * cs
+        grid[y : y + self.grid.shape[0], x : x + self.grid.shape[1]] = self.grid
+        self.grid, self.origin = grid, (new_ox, new_oy)
+
+    def result(self):
+        """Returns the grid trimmed to the placed chunks and its chunk origin."""
+        if self.grid is None:
+            return np.zeros((0, 0), dtype=TILE_DTYPE), (0, 0)
+        cs = self.chunk_size
+        (lx, ly), (hx, hy) = self.low, self.high
+        ox, oy = self.origin
+        x, y = (lx - ox) * cs, (ly - oy) * cs
+        width, height = (hx - lx + 1) * cs, (hy - ly + 1) * cs
+        return self.grid[y : y + height, x : x + width].copy(), self.low
+
+
+def _grow_axis(origin, size, low, high):
+    """Returns the new (origin, size) of one grid axis so that [low, high] fits."""
+    if low < origin:
+        end = origin + size
+        size = max(size * 2, end - low)
+        return end - size, size
+    if high >= origin + size:
+        return origin, max(size * 2, high - origin + 1)
+    return origin, size
+
+
+def decode_chunk(chunk):
+    """Decodes one MapGrid chunk into a square structured tile array."""
+    version = int(chunk.get("version", SUPPORTED_CHUNK_VERSION))
+    if version != SUPPORTED_CHUNK_VERSION:
+        raise ValueError(
+            f"Chunk {chunk.get('ind')}: unsupported chunk version {version}"
+        )
+    tiles = np.frombuffer(base64.b64decode(chunk["tiles"]), dtype=TILE_DTYPE)
+    side = math.isqrt(tiles.size)
+    if side * side != tiles.size:
+        raise ValueError(f"Chunk {chunk.get('ind')} is not square ({tiles.size} tiles)")
+    return tiles.reshape(side, side)
+
+
+def decode_map(yaml_path, grid_uid=None):
+    """
+    Rebuilds the tile grid of one MapGrid of a Civ14 map.
+
+    Args:
+        yaml_path: The map .yml file.
+        grid_uid: The uid of the grid entity to decode (default: the first
+            MapGrid of the map).
+
+    Returns:
+        A tuple (grid, origin, tilemap, grids): the structured
+        id/flags/variant grid covering every chunk of the grid, the chunk
+        coordinates of grid[0, 0], the map's {tile id: tile name} table and
+        the uids of every MapGrid in the map, in file order.
+
+    Raises:
+        ValueError: No MapGrid has the uid grid_uid, or a chunk cannot be decoded.
+    """
+    tilemap = {}
+    grid = None
+    grids = []
+    selected = False
+    with open(yaml_path, "r", encoding="utf-8") as f:
+        for kind, part in iter_map_parts(f):
+            if kind == "tilemap":
+                tilemap = {int(k): v for k, v in part.items()}
+                continue
+            if kind == "grid":
+                grids.append(part)
+                if grid_uid is None:
+                    selected = len(grids) == 1
+                else:
+                    selected = part == str(grid_uid)
+                continue
+            # Chunks of the other grids are skipped, their ind would overlap
+            if not selected:
+                continue
+            tiles = decode_chunk(part)
+            if grid is None:
+                grid = _GrowableGrid(tiles.shape[0])
+            elif tiles.shape[0] != grid.chunk_size:
+                raise ValueError(f"Chunk {part.get('ind')} has a different size")
+            cx, cy = (int(v) for v in part["ind"].split(","))
+            grid.place(cx, cy, tiles)
+    if grid_uid is not None and str(grid_uid) not in grids:
+        found = ", ".join(map(str, grids)) or "none"
+        raise ValueError(f"{yaml_path}: no MapGrid with uid {grid_uid} (grids: {found})")
+    if grid is None:
+        return np.zeros((0, 0), dtype=TILE_DTYPE), (0, 0), tilemap, grids
+    return (*grid.result(), tilemap, grids)
+
+
+def palette_lookup(tilemap, keys):
+    """
+    Builds a tile id -> keys.json index table.
+
+    Ids whose name matches keys.json at the same index map to themselves
+    (maps written by json2yaml.py), otherwise the first key with the same
+    tile name is used. Ids missing from the map's tilemap fall back to the
+    keys.json index with the same number (the tiles json2yaml.py leaves out
+    of TILEMAP).
+    """
+    by_name = {}
+    for index, entry in sorted(keys.items(), key=lambda item: int(item[0])):
+        by_name.setdefault(entry["tile"], int(index))
+    lookup = {}
+    for tile_id, name in tilemap.items():
+        same = keys.get(str(tile_id))
+        if same is not None and same["tile"] == name:
+            lookup[tile_id] = tile_id
+        elif name in by_name:
+            lookup[tile_id] = by_name[name]
+    for index in keys:
+        lookup.setdefault(int(index), int(index))
+    return lookup
+
+
+def grid_to_indices(ids, lookup):
+    """Maps tile ids to palette indices, using UNKNOWN_INDEX for the rest."""
+    unique, inverse = np.unique(ids, return_inverse=True)
+    table = np.array(
+        [lookup.get(int(tile_id), UNKNOWN_INDEX) for tile_id in unique], dtype=np.uint8
+    )
+    return table[inverse].reshape(ids.shape)
+
+
+def save_png(indices, keys, png_path):
+    """Writes palette indices as an indexed PNG with the keys.json colors."""
+    from PIL import Image
+
+    palette = [0] * (256 * 3)
+    palette[UNKNOWN_INDEX * 3 : UNKNOWN_INDEX * 3 + 3] = UNKNOWN_COLOR
+    for index, entry in keys.items():
+        color = int(entry["color"].lstrip("#"), 16)
+        i = int(index) * 3
+        palette[i : i + 3] = [(color >> 16) & 255, (color >> 8) & 255, color & 255]
+    height, width = indices.shape
+    image = Image.frombytes("P", (width, height), np.ascontiguousarray(indices).tobytes())
+    image.putpalette(palette)
+    image.save(png_path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Converts a Civ14 map YAML back into a tile grid and PNG."
+    )
+    parser.add_argument("input", help="the map .yml file")
+    parser.add_argument("--png", help="PNG to write (default: input name + .png)")
+    parser.add_argument("--npy", help="also write the tile id grid as .npy")
+    parser.add_argument(
+        "--keys",
+        default=os.path.join(SCRIPT_DIR, "keys.json"),
+        help="color to tile table (default: keys.json)",
+    )
+    parser.add_argument(
+        "--grid", help="uid of the grid entity to decode (default: the first MapGrid)"
+    )
+    args = parser.parse_args(argv)
+
+    try:
+        grid, origin, tilemap, grids = decode_map(args.input, args.grid)
+    except ValueError as e:
+        sys.exit(f"Error: {e}")
+    uid = args.grid if args.grid is not None else (grids[0] if grids else None)
+    print(
+        f"Decoded {grid.shape[1]}x{grid.shape[0]} tiles of grid {uid}, "
+        f"chunk origin {origin[0]},{origin[1]}"
+    )
+    if len(grids) > 1:
+        print(
+            f"The map has {len(grids)} grids ({', '.join(map(str, grids))}); "
+            "pick another one with --grid UID"
+        )
+    if args.npy:
+        np.save(args.npy, narrow_tile_map(grid["id"]))
+
+    with open(args.keys, "r") as f:
+        keys = json.load(f)
+    indices = grid_to_indices(grid["id"], palette_lookup(tilemap, keys))
+    unknown = int(np.count_nonzero(indices == UNKNOWN_INDEX))
+    if unknown:
+        print(f"Warning: {unknown} tiles have no color in {args.keys}")
+    png_path = args.png or os.path.splitext(args.input)[0] + ".png"
+    save_png(indices, keys, png_path)
+    print(f"Image saved to {png_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,87 +1,262 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+
 import yaml
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+import instrumentation  # noqa: E402
+import ss14_yaml  # noqa: E402
+
+UPDATED_SUFFIX = "_updated.yml"
+
 
-def update_duplicate_ids(filepath):
+class DuplicateResolver:
     """
-    Finds and updates duplicate IDs in a YAML file, adding sequential numbers.
-    Handles various YAML structures, including lists of strings, lists of dictionaries, and dictionaries with an "entities" key.  Also handles cases where IDs might be dictionaries.
-    Writes the updated data to a new file.
+    Gives every prototype a unique id across any number of files.
 
-    Args:
-        filepath: Path to the YAML file.
+    Ids are unique per prototype type (an entity and a constructionGraph may
+    share an id), and the namespace is shared by every file given to the
+    same resolver. The first prototype with an id keeps it; later ones get
+    the next free `_1`, `_2`, ... suffix. Ids passed to reserve() are never
+    picked as suffixes, so reserving every literal id first leaves an
+    existing `X_1` untouched when a duplicated `X` is renamed.
+
+    main() therefore makes two passes: the first loads each file only to
+    reserve its ids and drops it, the second loads, resolves and writes one
+    file at a time. Only one file's prototypes are held at once (plus the
+    ids of all of them), at the cost of parsing every file twice.
     """
+
+    def __init__(self, merge_identical=False):
+        """
+        Args:
+            merge_identical: Drop duplicates that are identical to the first
+                prototype with their id instead of renaming them.
+        """
+        self.merge_identical = merge_identical
+        # (type, id) -> digest of the first prototype with that id
+        self.seen = {}
+        # (type, id) of every prototype in the files, taken or not yet
+        self.reserved = set()
+        # (type, id) -> next suffix to try
+        self.next_suffix = {}
+        self.renamed = []
+        self.merged = []
+
+    def reserve(self, ids):
+        """Keeps these (type, id) pairs from being given to a renamed duplicate."""
+        self.reserved.update(ids)
+
+    def resolve(self, kind, item_id, item, filepath):
+        """
+        Registers one prototype.
+
+        Returns:
+            The id to use, or None if the prototype is an identical
+            duplicate that should be dropped.
+        """
+        key = (kind, item_id)
+        digest = _digest(item) if self.merge_identical else None
+        if key not in self.seen:
+            self.seen[key] = digest
+            return item_id
+        if self.merge_identical and self.seen[key] == digest:
+            self.merged.append({"file": filepath, "type": kind, "id": item_id})
+            return None
+        suffix = self.next_suffix.get(key, 1)
+        new_id = f"{item_id}_{suffix}"
+        while (kind, new_id) in self.seen or (kind, new_id) in self.reserved:
+            suffix += 1
+            new_id = f"{item_id}_{suffix}"
+        self.next_suffix[key] = suffix + 1
+        self.seen[(kind, new_id)] = digest
+        self.renamed.append({"file": filepath, "type": kind, "id": item_id, "new_id": new_id})
+        return new_id
+
+    def report(self):
+        return {"renamed": self.renamed, "merged": self.merged}
+
+
+def _digest(item):
+    canonical = json.dumps(item, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.blake2b(canonical.encode("utf-8"), digest_size=16).digest()
+
+
+def _rename(item, old_id, new_id):
+    """Sets a prototype's id and the fields that refer to its own id."""
+    item["id"] = new_id
+    # A recipe's construction and graph share the id of the entity they build
+    if item.get("type") == "construction" and item.get("graph") == old_id:
+        item["graph"] = new_id
+    elif item.get("type") == "constructionGraph":
+        for node in item.get("graph") or ():
+            if isinstance(node, dict) and node.get("entity") == old_id:
+                node["entity"] = new_id
+
+
+def load_prototypes(filepath):
+    """Loads a YAML file, or prints why it cannot be read and returns None."""
     try:
-        with open(filepath, "r", encoding="utf-8") as file:
-            data = yaml.safe_load(file)
+        with instrumentation.stage("load"), open(filepath, "r", encoding="utf-8") as file:
+            return ss14_yaml.load(file)
     except FileNotFoundError:
         print(f"Error: File not found: {filepath}")
-        return
     except yaml.YAMLError as e:
-        print(f"Error parsing YAML file: {e}")
+        print(f"Error parsing YAML file {filepath}: {e}")
+    return None
+
+
+def literal_ids(data):
+    """Yields the (type, id) of every prototype and plain id in loaded YAML data."""
+    items = data.get("entities") if isinstance(data, dict) else data
+    if not isinstance(items, list):
         return
+    for item in items:
+        if isinstance(item, dict) and item.get("id") is not None:
+            yield item.get("type"), str(item["id"])
+        elif isinstance(item, str):
+            yield None, item
+
+
+def update_duplicate_ids(filepath, resolver=None, in_place=False, data=None):
+    """
+    Finds and updates duplicate IDs in a YAML file, adding sequential numbers.
+    Handles lists of prototypes, lists of strings and dictionaries with an "entities" key.
+    Writes the updated data to a new file (or over the original with `in_place`).
+
+    Args:
+        filepath: Path to the YAML file.
+        resolver: The DuplicateResolver shared by the files of one run. To
+            check several files, reserve the ids of all of them first.
+        in_place: Overwrite the file instead of writing `<name>_updated.yml`.
+        data: The file already loaded with load_prototypes().
+
+    Returns:
+        The path written, or None if the file could not be processed.
+    """
+    if resolver is None:
+        resolver = DuplicateResolver()
+    if data is None:
+        data = load_prototypes(filepath)
+        if data is None:
+            return None
+    resolver.reserve(literal_ids(data))
 
     # Handle different YAML structures
-    if isinstance(data, list):
-        updated_data = handle_list_structure(data)
-    elif isinstance(data, dict) and "entities" in data:
-        updated_data = handle_entities_structure(data)
-    else:
-        print("Error: Unsupported YAML structure.")
-        return
+    with instrumentation.stage("resolve"):
+        if isinstance(data, list):
+            updated_data = handle_list_structure(data, resolver, filepath)
+        elif isinstance(data, dict) and "entities" in data:
+            updated_data = handle_entities_structure(data, resolver, filepath)
+        else:
+            print(f"Error: Unsupported YAML structure in {filepath}.")
+            return None
 
-    # Write updated data to a new file
-    if updated_data:
-        with open(filepath.replace(".yml", "_updated.yml"), "w", encoding="utf-8") as f:
-            yaml.dump(updated_data, f, indent=2, default_flow_style=False)
-        print(f"Updated YAML file saved to: {filepath.replace('.yml', '_updated.yml')}")
+    output = filepath if in_place else filepath[: -len(".yml")] + UPDATED_SUFFIX
+    with instrumentation.stage("write"), open(output, "w", encoding="utf-8") as f:
+        ss14_yaml.dump(updated_data, f, indent=2)
+    return output
 
 
-def handle_list_structure(data):
-    """Handles the case where the YAML data is a list (e.g., recipes_clothing_uniform.yml)."""
-    id_counts = {}
-    duplicates = {}
+def handle_list_structure(data, resolver, filepath=None):
+    """Handles a list of prototypes (e.g. recipes_clothing_uniform.yml) or of plain ids."""
     updated_data = []
     for item in data:
-        item_id = str(item)  # Convert to string to handle various types
-        id_counts[item_id] = id_counts.get(item_id, 0) + 1
-    for item_id, count in id_counts.items():
-        if count > 1:
-            duplicates[item_id] = duplicates.get(item_id, 0) + 1
-    for item in data:
-        item_id = str(item)
-        if item_id in duplicates:
-            updated_data.append(f"{item_id}_{duplicates[item_id]}")
-        else:
-            updated_data.append(item)
+        if isinstance(item, dict) and item.get("id") is not None:
+            kind = item.get("type")
+            item_id = str(item["id"])
+            new_id = resolver.resolve(kind, item_id, item, filepath)
+            if new_id is None:
+                continue
+            if new_id != item_id:
+                _rename(item, item_id, new_id)
+        elif isinstance(item, str):
+            new_id = resolver.resolve(None, item, item, filepath)
+            if new_id is None:
+                continue
+            item = new_id
+        updated_data.append(item)
     return updated_data
 
 
-def handle_entities_structure(data):
+def handle_entities_structure(data, resolver, filepath=None):
     """Handles the case where the YAML data has an "entities" key (e.g., entities_clothing_uniform.yml)."""
-    entity_counts = {}
-    duplicates = {}
-    updated_data = data.copy()
-    entities = updated_data["entities"]
-    for entity in entities:
-        entity_id = entity.get("id")
-        if entity_id:
-            entity_id_str = str(entity_id)  # Convert to string if it's a dictionary
-            entity_counts[entity_id_str] = entity_counts.get(entity_id_str, 0) + 1
-    for entity_id_str, count in entity_counts.items():
-        if count > 1:
-            duplicates[entity_id_str] = duplicates.get(entity_id_str, 0) + 1
-    for entity in updated_data["entities"]:
-        entity_id = entity.get("id")
-        if entity_id:
-            entity_id_str = str(entity_id)
-            if entity_id_str in duplicates:
-                entity["id"] = f"{entity_id_str}_{duplicates[entity_id_str]}"
+    updated_data = dict(data)
+    updated_data["entities"] = handle_list_structure(data["entities"], resolver, filepath)
     return updated_data
 
 
-# Example usage:
-filepath = r"output/yml/entities_clothing_uniform.yml"
-update_duplicate_ids(filepath)
+def find_yaml_files(paths):
+    """Expands directories into their .yml files (skipping earlier _updated.yml output)."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith(".yml") and not name.endswith(UPDATED_SUFFIX):
+                    files.append(os.path.join(path, name))
+        else:
+            files.append(path)
+    return files
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Gives duplicated prototype ids in the generated .yml files unique suffixes."
+    )
+    parser.add_argument(
+        "paths",
+        nargs="*",
+        default=["output/yml"],
+        help=".yml files or directories, sharing one id namespace (default: output/yml)",
+    )
+    parser.add_argument(
+        "--in-place", action="store_true", help="overwrite the files instead of writing _updated.yml"
+    )
+    parser.add_argument(
+        "--merge-identical",
+        action="store_true",
+        help="drop duplicates identical to the first prototype instead of renaming them",
+    )
+    parser.add_argument("--report", help="write the renamed and merged ids to this JSON file")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    with instrumentation.instrument("checkduplicates", args, argv):
+        resolver = DuplicateResolver(merge_identical=args.merge_identical)
+        files = find_yaml_files(args.paths)
+        # Every literal id is reserved before any duplicate is renamed; the
+        # files are loaded again one at a time, so only one is held in memory
+        readable = []
+        with instrumentation.stage("reserve"):
+            for filepath in files:
+                data = load_prototypes(filepath)
+                if data is not None:
+                    resolver.reserve(literal_ids(data))
+                    readable.append(filepath)
+        for filepath in readable:
+            output = update_duplicate_ids(filepath, resolver, args.in_place)
+            if output and output != filepath:
+                print(f"Updated YAML file saved to: {output}")
+        instrumentation.count("files", len(files))
+        instrumentation.count("renamed", len(resolver.renamed))
+        instrumentation.count("merged", len(resolver.merged))
+
+        for entry in resolver.renamed:
+            print(f"{entry['file']}: {entry['type'] or 'id'} {entry['id']} -> {entry['new_id']}")
+        for entry in resolver.merged:
+            print(f"{entry['file']}: dropped identical {entry['type'] or 'id'} {entry['id']}")
+        print(
+            f"{len(files)} files, {len(resolver.seen)} unique ids, "
+            f"{len(resolver.renamed)} renamed, {len(resolver.merged)} merged"
+        )
+        if args.report:
+            with open(args.report, "w", encoding="utf-8") as f:
+                json.dump(resolver.report(), f, indent=2, ensure_ascii=False)
+            print(f"Report written to {args.report}")
+
 
-filepath = r"output/yml/recipes_clothing_uniform.yml"
-update_duplicate_ids(filepath)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,423 @@
+"""
+Indexed store for the OpenDream civ13.json dump.
+
+`civ13.json` is hundreds of megabytes and every step used to json.load it
+and scan its "Types" list. `ingest` streams the dump once into a SQLite file
+with one row per type (indexed by path and parent) and one row per variable
+(indexed by name), so later runs open it in milliseconds and only read the
+types they ask for.
+
+Usage:
+    python civ13_store.py ingest civ13.json
+    python civ13_store.py query /obj/item/weapon/gun --var caliber
+    python civ13_store.py get /obj/item/weapon/gun/projectile/pistol/colt
+    python civ13_store.py export /obj/item/ --output output/civ13_item.json
+    python civ13_store.py split
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+
+# Bump when the store layout changes, to force a new ingest
+STORE_FORMAT_VERSION = 1
+DEFAULT_STORE = "./output/civ13.sqlite"
+INGEST_BATCH_SIZE = 2000
+# Keys object-fetcher.js strips from the exported types
+PROC_KEYS = ("procs", "initproc")
+# The files object-fetcher.js writes, and the paths they hold
+SPLIT_OUTPUTS = {
+    "civ13_structure.json": "/obj/structure/",
+    "civ13_item.json": "/obj/item/",
+    "civ13_mob.json": "/mob/living/simple_animal/",
+    "civ13_turf.json": "/turf/",
+}
+
+
+def _source_stamp(json_path):
+    stat = os.stat(json_path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def ingest(json_path, store_path=DEFAULT_STORE):
+    """
+    Converts an OpenDream JSON dump into a store.
+
+    The dump is read incrementally (ijson), so memory use does not depend
+    on its size. The store is built next to `store_path` and moved into
+    place when complete.
+
+    Returns:
+        The number of types ingested.
+    """
+    import ijson
+
+    temp_path = store_path + ".tmp"
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    os.makedirs(os.path.dirname(os.path.abspath(store_path)), exist_ok=True)
+    db = sqlite3.connect(temp_path)
+    try:
+        db.executescript(
+            """
+            PRAGMA journal_mode = OFF;
+            PRAGMA synchronous = OFF;
+            CREATE TABLE types (
+                id INTEGER PRIMARY KEY,
+                path TEXT NOT NULL,
+                parent TEXT,
+                parent_id INTEGER,
+                data TEXT NOT NULL
+            );
+            CREATE TABLE variables (
+                type_id INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                value TEXT NOT NULL
+            );
+            CREATE TABLE meta (name TEXT PRIMARY KEY, value TEXT);
+            """
+        )
+        types, variables = [], []
+        count = 0
+        with open(json_path, "rb") as f:
+            for index, entry in enumerate(ijson.items(f, "Types.item", use_float=True)):
+                if not isinstance(entry, dict) or not isinstance(entry.get("Path"), str):
+                    continue
+                parent = entry.get("Parent")
+                types.append(
+                    (
+                        index,
+                        entry["Path"],
+                        parent if isinstance(parent, str) else None,
+                        parent if type(parent) is int else None,
+                        _dumps(entry),
+                    )
+                )
+                own = entry.get("Variables")
+                if isinstance(own, dict):
+                    variables.extend(
+                        (index, name, _dumps(value)) for name, value in own.items()
+                    )
+                if len(types) >= INGEST_BATCH_SIZE:
+                    count += _insert(db, types, variables)
+        count += _insert(db, types, variables)
+        # OpenDream refers to parents by their index in "Types"
+        db.executescript(
+            """
+            UPDATE types SET parent = (SELECT p.path FROM types p WHERE p.id = types.parent_id)
+                WHERE parent IS NULL AND parent_id IS NOT NULL;
+            CREATE TEMP TABLE by_path AS SELECT min(id) AS id, path FROM types GROUP BY path;
+            CREATE UNIQUE INDEX temp.by_path_path ON by_path (path);
+            UPDATE types SET parent_id = (SELECT b.id FROM by_path b WHERE b.path = types.parent)
+                WHERE parent_id IS NULL AND parent IS NOT NULL;
+            DROP TABLE by_path;
+            CREATE INDEX types_path ON types (path);
+            CREATE INDEX types_parent ON types (parent);
+            CREATE INDEX variables_name ON variables (name, type_id);
+            CREATE INDEX variables_type ON variables (type_id);
+            """
+        )
+        db.executemany(
+            "INSERT INTO meta VALUES (?, ?)",
+            [
+                ("version", str(STORE_FORMAT_VERSION)),
+                ("source", os.path.abspath(json_path)),
+                ("source_stamp", _source_stamp(json_path)),
+            ],
+        )
+        db.commit()
+    except BaseException:
+        db.close()
+        os.remove(temp_path)
+        raise
+    db.close()
+    os.replace(temp_path, store_path)
+    return count
+
+
+def _insert(db, types, variables):
+    db.executemany("INSERT INTO types VALUES (?, ?, ?, ?, ?)", types)
+    db.executemany("INSERT INTO variables VALUES (?, ?, ?)", variables)
+    count = len(types)
+    types.clear()
+    variables.clear()
+    return count
+
+
+def _subtree_range(path):
+    """Returns the [low, high) path range of the strict subtypes of `path`."""
+    base = path.rstrip("/") + "/"
+    # "0" sorts right after "/"
+    return base, base[:-1] + "0"
+
+
+class Civ13Store:
+    """
+    Read access to a store written by `ingest`.
+
+    Use it as a context manager, or call close() when done.
+    """
+
+    def __init__(self, store_path=DEFAULT_STORE):
+        if not os.path.exists(store_path):
+            raise FileNotFoundError(f"No store at {store_path}, run the ingest first")
+        self._db = sqlite3.connect(f"file:{store_path}?mode=ro", uri=True)
+        self.meta = dict(self._db.execute("SELECT name, value FROM meta"))
+        if self.meta.get("version") != str(STORE_FORMAT_VERSION):
+            self._db.close()
+            raise ValueError(
+                f"{store_path} is not a version {STORE_FORMAT_VERSION} store, ingest again"
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._db.close()
+
+    def is_current(self, json_path):
+        """True if the store was ingested from this version of `json_path`."""
+        return self.meta.get("source_stamp") == _source_stamp(json_path)
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM types").fetchone()[0]
+
+    def get(self, path):
+        """Returns the dump entry of a type, or None."""
+        row = self._db.execute(
+            "SELECT data FROM types WHERE path = ? ORDER BY id LIMIT 1", (path,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def children(self, path):
+        """Returns the paths of the direct children of a type."""
+        rows = self._db.execute(
+            "SELECT path FROM types WHERE parent = ? ORDER BY id", (path,)
+        )
+        return [row[0] for row in rows]
+
+    def iter_types(self, prefixes=None, variable=None, inherited=False, include_self=True):
+        """
+        Yields the dump entries of matching types, in dump order.
+
+        Args:
+            prefixes: A type path or a list of them; yields these types and
+                their subtypes (None for every type). Paths ending with "/"
+                match only the subtypes, like object-fetcher.js.
+            variable: Only types that set this variable.
+            inherited: With `variable`, also types that inherit it from a
+                parent that sets it.
+            include_self: Also yield the prefix types themselves.
+        """
+        for data in self._select(prefixes, variable, inherited, include_self):
+            yield json.loads(data)
+
+    def paths(self, prefixes=None, variable=None, inherited=False, include_self=True):
+        """Like iter_types, but returns only the matching paths."""
+        return list(self._select(prefixes, variable, inherited, include_self, "path"))
+
+    def _select(self, prefixes, variable, inherited, include_self, column="data"):
+        if isinstance(prefixes, str):
+            prefixes = [prefixes]
+        clauses, params = [], []
+        for prefix in prefixes or ():
+            low, high = _subtree_range(prefix)
+            if include_self and not prefix.endswith("/"):
+                clauses.append("(path = ? OR (path >= ? AND path < ?))")
+                params += [prefix, low, high]
+            else:
+                clauses.append("(path >= ? AND path < ?)")
+                params += [low, high]
+        where = " OR ".join(clauses) if clauses else "1"
+        if variable is not None and not inherited:
+            where = (
+                f"({where}) AND id IN "
+                "(SELECT type_id FROM variables WHERE name = ?)"
+            )
+            params.append(variable)
+        rows = self._db.execute(
+            f"SELECT id, parent_id, {column} FROM types WHERE {where} ORDER BY id", params
+        )
+        if variable is None or not inherited:
+            for _, _, value in rows:
+                yield value
+            return
+        defining = {
+            row[0]
+            for row in self._db.execute(
+                "SELECT type_id FROM variables WHERE name = ?", (variable,)
+            )
+        }
+        parent_of = dict(self._db.execute("SELECT id, parent_id FROM types"))
+        memo = {}
+        for type_id, _, value in rows:
+            if _inherits(type_id, defining, parent_of, memo):
+                yield value
+
+    def variable(self, path, name, inherited=True):
+        """
+        Returns the value of one variable of a type, following its parents
+        when the type does not set it (KeyError if no type in the chain does).
+        """
+        row = self._db.execute(
+            "SELECT id FROM types WHERE path = ? ORDER BY id LIMIT 1", (path,)
+        ).fetchone()
+        type_id = row[0] if row else None
+        seen = set()
+        while type_id is not None and type_id not in seen:
+            seen.add(type_id)
+            value = self._db.execute(
+                "SELECT value FROM variables WHERE type_id = ? AND name = ?",
+                (type_id, name),
+            ).fetchone()
+            if value is not None:
+                return json.loads(value[0])
+            if not inherited:
+                break
+            type_id = self._db.execute(
+                "SELECT parent_id FROM types WHERE id = ?", (type_id,)
+            ).fetchone()[0]
+        raise KeyError(f"{path} has no variable {name}")
+
+
+def _inherits(type_id, defining, parent_of, memo):
+    chain = []
+    result = False
+    while type_id is not None:
+        if type_id in memo:
+            result = memo[type_id]
+            break
+        if type_id in defining:
+            result = True
+            break
+        if type_id in chain:
+            break
+        chain.append(type_id)
+        type_id = parent_of.get(type_id)
+    for visited in chain:
+        memo[visited] = result
+    return result
+
+
+def open_store(store_path=DEFAULT_STORE, json_path=None):
+    """
+    Opens a store, ingesting `json_path` first if the store is missing or
+    was built from another version of it.
+    """
+    if json_path is not None:
+        current = False
+        if os.path.exists(store_path):
+            try:
+                with Civ13Store(store_path) as store:
+                    current = store.is_current(json_path)
+            except (ValueError, sqlite3.DatabaseError):
+                current = False
+        if not current:
+            count = ingest(json_path, store_path)
+            print(f"Ingested {count} types from {json_path} into {store_path}")
+    return Civ13Store(store_path)
+
+
+def strip_procs(entry):
+    """Removes the proc data of a dump entry, like object-fetcher.js does."""
+    for key in list(entry):
+        if key.lower() in PROC_KEYS:
+            del entry[key]
+    return entry
+
+
+def export_types(store, prefixes, output_file, keep_procs=False):
+    """
+    Writes the matching types as {"Types": [...]}, the format of the files
+    object-fetcher.js writes and the creators read.
+
+    Returns:
+        The number of types written.
+    """
+    entries = [
+        entry if keep_procs else strip_procs(entry)
+        for entry in store.iter_types(prefixes)
+    ]
+    os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+    with open(output_file, "w", encoding="utf-8") as f:
+        json.dump({"Types": entries}, f, indent=2, ensure_ascii=False)
+    return len(entries)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Builds and queries an indexed store of the OpenDream civ13.json."
+    )
+    parser.add_argument(
+        "--store", default=DEFAULT_STORE, help=f"the store file (default: {DEFAULT_STORE})"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ingest_parser = commands.add_parser("ingest", help="build the store from civ13.json")
+    ingest_parser.add_argument("json", nargs="?", default="./civ13.json")
+
+    query_parser = commands.add_parser("query", help="list a type and its subtypes")
+    query_parser.add_argument("paths", nargs="*", help="type paths (default: all)")
+    query_parser.add_argument("--var", help="only types that set this variable")
+    query_parser.add_argument(
+        "--inherited", action="store_true", help="with --var, also types inheriting it"
+    )
+    query_parser.add_argument(
+        "--show", action="store_true", help="print the value of --var for each type"
+    )
+
+    get_parser = commands.add_parser("get", help="print the dump entry of a type")
+    get_parser.add_argument("path")
+
+    export_parser = commands.add_parser(
+        "export", help="write matching types as {\"Types\": [...]} JSON"
+    )
+    export_parser.add_argument("paths", nargs="+", help="type paths or prefixes")
+    export_parser.add_argument("--output", required=True)
+    export_parser.add_argument(
+        "--keep-procs", action="store_true", help="keep Procs and InitProc"
+    )
+    split_parser = commands.add_parser(
+        "split", help="write the civ13_*.json files that object-fetcher.js writes"
+    )
+    split_parser.add_argument("--output-dir", default="./output")
+    args = parser.parse_args(argv)
+
+    if args.command == "ingest":
+        count = ingest(args.json, args.store)
+        print(f"Ingested {count} types from {args.json} into {args.store}")
+        return
+
+    with Civ13Store(args.store) as store:
+        if args.command == "query":
+            for path in store.paths(args.paths or None, args.var, args.inherited):
+                if args.show and args.var:
+                    value = store.variable(path, args.var, inherited=args.inherited)
+                    print(f"{path}\t{_dumps(value)}")
+                else:
+                    print(path)
+        elif args.command == "get":
+            entry = store.get(args.path)
+            if entry is None:
+                parser.exit(1, f"{args.path} is not in the store\n")
+            print(json.dumps(entry, indent=2, ensure_ascii=False))
+        elif args.command == "export":
+            count = export_types(store, args.paths, args.output, args.keep_procs)
+            print(f"Exported {count} types to {args.output}")
+        elif args.command == "split":
+            for filename, prefix in SPLIT_OUTPUTS.items():
+                output = os.path.join(args.output_dir, filename)
+                count = export_types(store, [prefix], output)
+                print(f"Exported {count} types to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,147 +1,298 @@
 import os
-import re
+import sys
 import json
-import chardet  # Import the chardet library
+import argparse
+
+from dm_tokenizer import iter_dm_records, parse_value
+from type_tree import TypeTree
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+import instrumentation  # noqa: E402
+
+# Bump when the parser output changes, to invalidate cached parse results
+PARSER_VERSION = 3
+# Types kept by the parser; clothing inherits from /obj/item and /obj
+OBJECT_PREFIXES = ("/obj",)
+CLOTHING_PREFIXES = ("/obj/item/clothing/",)
+# chardet only needs a sample to guess the encoding
+ENCODING_SAMPLE_SIZE = 64 * 1024
+
+
+def read_dm_file(filepath):
+    """
+    Reads a .dm file as text, detecting the encoding if it is not UTF-8.
+
+    Args:
+        filepath: The path to the .dm file.
+
+    Returns:
+        The file contents, or None if the file could not be read.
+    """
+    try:
+        with open(filepath, "rb") as f:
+            rawdata = f.read()
+    except OSError as e:
+        print(f"Error processing {filepath}: {e}")
+        return None
+    try:
+        return _normalize_newlines(rawdata.decode("utf-8"))
+    except UnicodeDecodeError:
+        pass
+
+    import chardet  # Only needed for the few files that are not UTF-8
+
+    detected_encoding = chardet.detect(rawdata[:ENCODING_SAMPLE_SIZE])["encoding"]
+    print(
+        f"Warning: Could not decode file {filepath} with utf-8. "
+        f"Detected encoding: {detected_encoding}"
+    )
+    if not detected_encoding:
+        print(f"Error: Could not detect encoding for {filepath}. Skipping.")
+        return None
+    try:
+        return _normalize_newlines(rawdata.decode(detected_encoding, errors="replace"))
+    except LookupError as e:
+        print(f"Error processing {filepath}: {e}")
+        return None
+
+
+def _normalize_newlines(content):
+    # Same translation as reading the file in text mode
+    return content.replace("\r\n", "\n").replace("\r", "\n")
 
 
 def parse_dm_file(filepath):
     """
-    Parses a .dm file and extracts information about clothing items.
+    Parses a .dm file and extracts the object types it declares.
     Attempts to detect the file's encoding if UTF-8 fails.
 
     Args:
         filepath: The path to the .dm file.
 
     Returns:
-        A dictionary containing the extracted clothing item data, or None if no relevant data is found.
+        A dictionary of type path -> the variables set in this file, or None
+        if no relevant data is found.
+    """
+    content = read_dm_file(filepath)
+    if content is None:
+        return None
+
+    object_types = {}
+    for path, var_name, value in iter_dm_records(content, OBJECT_PREFIXES):
+        variables = object_types.setdefault(path, {})
+        if var_name is not None:
+            variables[var_name] = parse_value(value)
+
+    return object_types if object_types else None
+
+
+def find_dm_files(directory):
+    """
+    Recursively lists the .dm files of a directory, in a stable order.
+
+    Args:
+        directory: The directory to search.
+
+    Returns:
+        A list of file paths.
+    """
+    dm_files = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for file in sorted(files):
+            if file.endswith(".dm"):
+                dm_files.append(os.path.join(root, file))
+    return dm_files
+
+
+def load_parse_cache(cache_path):
+    """
+    Loads the per-file parse cache.
+
+    Args:
+        cache_path: The cache JSON file, or None to disable the cache.
+
+    Returns:
+        A dictionary of path -> {"mtime_ns", "size", "data"} entries.
     """
-    clothing_items = {}
+    if not cache_path or not os.path.exists(cache_path):
+        return {}
     try:
-        with open(filepath, "r", encoding="utf-8") as f:
-            content = f.read()
-    except UnicodeDecodeError:
-        print(
-            f"Warning: Could not decode file {filepath} with utf-8. Attempting to detect encoding..."
-        )
-        try:
-            with open(filepath, "rb") as f:  # Open in binary mode for detection
-                rawdata = f.read()
-                result = chardet.detect(rawdata)
-                detected_encoding = result["encoding"]
-                print(f"Detected encoding: {detected_encoding}")
-
-            if detected_encoding:
-                with open(filepath, "r", encoding=detected_encoding) as f:
-                    content = f.read()
-            else:
-                print(f"Error: Could not detect encoding for {filepath}. Skipping.")
-                return None
-        except Exception as e:
-            print(f"Error processing {filepath}: {e}")
-            return None
-
-    # Regular expression to find clothing item definitions
-    pattern = r"/obj/item/clothing/(.*?)\n(.*?)(?=\n\n|\Z)"
-    matches = re.findall(pattern, content, re.DOTALL)
-
-    for match in matches:
-        path = f"/obj/item/clothing/{match[0]}"
-        variables_str = match[1]
-
-        variables = {}
-        # Extract variables and their values
-        var_pattern = r"(\w+)\s*=\s*(.*?)(?=\n|$)"
-        var_matches = re.findall(var_pattern, variables_str, re.DOTALL)
-        for var_match in var_matches:
-            var_name = var_match[0].strip()
-            var_value = var_match[1].strip()
-
-            # Handle list type variables
-            if var_value.startswith("list("):
-                list_content = var_value[5:-1]
-                list_items = {}
-                list_pattern = r"(\w+)\s*=\s*(.*?)(?:,|$)"
-                list_matches = re.findall(list_pattern, list_content)
-                for list_match in list_matches:
-                    list_items[list_match[0].strip()] = parse_value(
-                        list_match[1].strip()
-                    )
-                variables[var_name] = list_items
-            elif var_value.upper() == "FALSE":
-                variables[var_name] = False
-            elif var_value.upper() == "TRUE":
-                variables[var_name] = True
-            elif var_value.upper() == "UPPER_TORSO|LOWER_TORSO":
-                variables[var_name] = "UPPER_TORSO|LOWER_TORSO"
-            else:
-                variables[var_name] = parse_value(var_value)
+        with open(cache_path, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Warning: Ignoring unreadable cache {cache_path}: {e}")
+        return {}
+    if cache.get("version") != PARSER_VERSION:
+        return {}
+    return cache.get("files", {})
 
-        clothing_items[path] = variables
 
-    return clothing_items if clothing_items else None
+def save_parse_cache(cache_path, entries):
+    """Writes the per-file parse cache."""
+    if not cache_path:
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+    with open(cache_path, "w", encoding="utf-8") as f:
+        json.dump({"version": PARSER_VERSION, "files": entries}, f)
 
 
-def parse_value(value_str):
+def find_object_types(directory, jobs=1, cache_path=None, verbose=False):
     """
-    Parses a string value and returns the appropriate Python type.
+    Recursively searches a directory for .dm files and builds their type tree.
+
+    Files whose path, modification time and size match the cache are not
+    parsed again; the others are parsed on a pool of `jobs` processes.
 
     Args:
-        value_str: The string value to parse.
+        directory: The directory to search.
+        jobs: Number of parser processes.
+        cache_path: The parse cache file, or None to parse every file.
+        verbose: Print the name of every file that is parsed.
 
     Returns:
-        The parsed value as a Python type (int, float, str, bool).
+        A TypeTree of every object type, in file order.
     """
-    if value_str.isdigit():
-        return int(value_str)
-    elif re.match(r"^-?\d+\.\d+$", value_str):
-        return float(value_str)
-    elif value_str.startswith('"') and value_str.endswith('"'):
-        return value_str[1:-1]
-    elif value_str.upper() == "FALSE":
-        return False
-    elif value_str.upper() == "TRUE":
-        return True
-    else:
-        return value_str
-
-
-def find_clothing_items(directory):
+    cached = load_parse_cache(cache_path)
+    entries = {}
+    results = {}
+    stale = []
+    with instrumentation.stage("scan"):
+        for filepath in find_dm_files(directory):
+            stat = os.stat(filepath)
+            entry = cached.get(filepath)
+            if (
+                entry
+                and entry["mtime_ns"] == stat.st_mtime_ns
+                and entry["size"] == stat.st_size
+            ):
+                entries[filepath] = entry
+                results[filepath] = entry["data"]
+            else:
+                entries[filepath] = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+                results[filepath] = None
+                stale.append(filepath)
+
+    if verbose:
+        for filepath in stale:
+            print("Reading file:", os.path.basename(filepath))
+    with instrumentation.stage("parse"):
+        if jobs > 1 and len(stale) > 1:
+            # Imported here: a single-process run does not need it
+            from concurrent.futures import ProcessPoolExecutor
+
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                parsed = executor.map(parse_dm_file, stale, chunksize=16)
+                for filepath, clothing_data in zip(stale, parsed):
+                    results[filepath] = clothing_data
+        else:
+            for filepath in stale:
+                results[filepath] = parse_dm_file(filepath)
+    for filepath in stale:
+        entries[filepath]["data"] = results[filepath]
+
+    print(
+        f"Parsed {len(stale)} .dm files, {len(results) - len(stale)} unchanged from cache"
+    )
+    instrumentation.count("parsed files", len(stale))
+    instrumentation.count("cached files", len(results) - len(stale))
+    with instrumentation.stage("save cache"):
+        save_parse_cache(cache_path, entries)
+
+    with instrumentation.stage("build tree"):
+        tree = TypeTree()
+        for object_types in results.values():
+            if object_types:
+                for path, variables in object_types.items():
+                    tree.add(path, variables)
+    return tree
+
+
+def find_clothing_items(directory, jobs=1, cache_path=None, verbose=False, tree=None):
     """
     Recursively searches a directory for .dm files and extracts clothing item data.
 
+    Every clothing type gets its full variable set, including the variables
+    it inherits from its parent types.
+
     Args:
-        directory: The directory to search.
+        directory: The directory to search (see find_object_types).
+        tree: An already built TypeTree to use instead of parsing `directory`.
 
     Returns:
         A dictionary containing all extracted clothing item data.
     """
-    all_clothing_data = {}
-    for root, _, files in os.walk(directory):
-        for file in files:
-            if file.endswith(".dm"):
-                print("Reading file:", file)
-                filepath = os.path.join(root, file)
-                clothing_data = parse_dm_file(filepath)
-                if clothing_data:
-                    all_clothing_data.update(clothing_data)
-    return all_clothing_data
+    if tree is None:
+        tree = find_object_types(directory, jobs, cache_path, verbose)
+    return {path: tree.resolve(path) for path in tree.iter_types(CLOTHING_PREFIXES)}
 
 
-def main():
+def main(argv=None):
     """
     Main function to run the script.
     """
-    dm_directory = "input/dm/"
-    output_filepath = "./output/clothing_items.json"
+    parser = argparse.ArgumentParser(
+        description="Extracts clothing item variables from the Civ13 .dm files."
+    )
+    parser.add_argument("--input", default="input/dm/", help="the .dm directory")
+    parser.add_argument(
+        "--output", default="./output/clothing_items.json", help="the output JSON"
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of parser processes (default: CPU count)",
+    )
+    parser.add_argument(
+        "--cache",
+        default="./output/dm_parse_cache.json",
+        help="parse cache file (default: ./output/dm_parse_cache.json)",
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="parse every file again"
+    )
+    parser.add_argument(
+        "--index",
+        default="./output/type_index.sqlite",
+        help="type index with the inherited variables of every /obj type "
+        "(default: ./output/type_index.sqlite)",
+    )
+    parser.add_argument(
+        "--no-index", action="store_true", help="do not write the type index"
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="print every file that is parsed"
+    )
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    dm_directory = args.input
+    output_filepath = args.output
 
-    all_clothing_data = find_clothing_items(dm_directory)
+    with instrumentation.instrument("civ13exporter", args, argv):
+        with instrumentation.stage("types"):
+            tree = find_object_types(
+                dm_directory,
+                jobs=args.jobs,
+                cache_path=None if args.no_cache else args.cache,
+                verbose=args.verbose,
+            )
+        if not args.no_index:
+            with instrumentation.stage("index"):
+                count = tree.dump_index(args.index)
+            print(f"Type index of {count} types written to {args.index}")
+        with instrumentation.stage("resolve"):
+            all_clothing_data = find_clothing_items(dm_directory, tree=tree)
+        instrumentation.count("clothing types", len(all_clothing_data))
 
-    if all_clothing_data:
-        with open(output_filepath, "w", encoding="utf-8") as outfile:
-            json.dump(all_clothing_data, outfile, indent=2)
-        print(f"Clothing item data exported to {output_filepath}")
-    else:
-        print("No clothing item data found.")
+        if all_clothing_data:
+            with instrumentation.stage("write"):
+                with open(output_filepath, "w", encoding="utf-8") as outfile:
+                    json.dump(all_clothing_data, outfile, indent=2)
+            print(f"Clothing item data exported to {output_filepath}")
+        else:
+            print("No clothing item data found.")
 
 
 if __name__ == "__main__":
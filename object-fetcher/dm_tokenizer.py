@@ -0,0 +1,276 @@
+"""
+Line-oriented tokenizer for DM object definitions.
+
+Reads a .dm file once, line by line, and follows the indentation-based
+type nesting of DM, so relative subtype blocks, `var` blocks, multi-line
+lists and indented type paths resolve to their full type path. Proc bodies
+are skipped using only their indentation.
+"""
+
+import re
+
+# Records are (path, var, value); a type declaration is (path, None, None)
+TYPE_DECLARATION = None
+
+_PROC_KEYWORDS = ("proc", "verb")
+_OPENERS = {"(": ")", "[": "]", "{": "}"}
+_CLOSERS = {")", "]", "}"}
+_STRING = r""""(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*'"""
+# A {" "} text block, up to its "} or to the end of the line if it goes on
+_TEXT = r'\{"(?:[^"]|"(?!\}))*(?:"\}|$)'
+# Text blocks, strings, comments, brackets and (in)equality operators, so
+# that only these characters are looked at instead of the whole line
+_CODE_TOKENS = re.compile(_TEXT + "|" + _STRING + r"""|//|[][(){}]|[=!<>]=|=|["']""")
+_ARGUMENT_TOKENS = re.compile(_TEXT + "|" + _STRING + r"|[][(){},]")
+_LIST_PAIR = re.compile(r'("(?:\\.|[^"\\])*"|[\w/]+)\s*=(?!=)\s*(.*)', re.DOTALL)
+_INT = re.compile(r"-?\d+")
+_FLOAT = re.compile(r"-?\d*\.\d+(?:[eE][-+]?\d+)?|-?\d+[eE][-+]?\d+")
+
+
+def _is_open_text(token):
+    return token[:2] == '{"' and (len(token) < 4 or not token.endswith('"}'))
+
+
+def _scan(text, depth=0, in_text=False):
+    """
+    Strips a `//` comment outside strings and tracks bracket depth.
+
+    A {" "} text block is one token, whatever quotes it holds; in_text
+    means the text starts inside a block opened on an earlier line.
+
+    Returns:
+        (code, depth, assignment, in_text): the text without comment, the
+        bracket depth at its end, the index of the first top-level `=` (or
+        -1) and whether a text block is still open at its end.
+    """
+    assignment = -1
+    start = 0
+    if in_text:
+        end = text.find('"}')
+        if end < 0:
+            return text, depth, assignment, True
+        start = end + 2
+    for match in _CODE_TOKENS.finditer(text, start):
+        token = match.group()
+        first = token[0]
+        if token[:2] == '{"':
+            if _is_open_text(token):
+                return text, depth, assignment, True
+        elif first in _OPENERS:
+            depth += 1
+        elif first in _CLOSERS:
+            depth -= 1
+        elif token == "=":
+            if depth == 0 and assignment < 0:
+                assignment = match.start()
+        elif token == "//":
+            return text[: match.start()].rstrip(), depth, assignment, False
+        elif len(token) == 1:
+            # Unterminated string: the rest of the line is text
+            break
+    return text, depth, assignment, False
+
+
+def _indentation(line):
+    stripped = line.lstrip("\t")
+    if stripped[:1] == " ":
+        expanded = line.expandtabs(4)
+        return len(expanded) - len(expanded.lstrip(" ")), stripped.strip()
+    return len(line) - len(stripped), stripped.strip()
+
+
+def _is_proc(code):
+    """True for `Proc()`, `proc/name(args)` and the bare `proc`/`verb` blocks."""
+    return "(" in code or any(
+        segment in _PROC_KEYWORDS for segment in code.split("/")
+    )
+
+
+def _variable(parent_path, lhs, in_var_block):
+    """Resolves the left-hand side of a variable line to (type path, var name)."""
+    if lhs.startswith("/"):
+        full = lhs
+    elif in_var_block:
+        full = f"{parent_path}/var/{lhs}"
+    else:
+        full = f"{parent_path}/{lhs}"
+    if "/var/" in full:
+        path, _, name = full.partition("/var/")
+        return path, name.rsplit("/", 1)[-1]
+    path, _, name = full.rpartition("/")
+    return path, name
+
+
+def iter_dm_records(content, prefixes=("/obj/",)):
+    """
+    Tokenizes DM source into type and variable records.
+
+    Args:
+        content: The .dm source text.
+        prefixes: Only records for types starting with one of these paths
+            are yielded (None for all types).
+
+    Yields:
+        (path, None, None) for every type declaration and (path, var, value)
+        for every variable set in a type body, `value` being the raw DM
+        expression (multi-line expressions are joined with spaces).
+    """
+    # Stack of (indent, path, kind); kind is "type", "var" or "proc"
+    stack = []
+    lines = iter(content.split("\n"))
+    in_comment = False
+    in_text = False
+    # Lines starting with this are inside the current proc body
+    body_prefix = None
+    for line in lines:
+        if body_prefix is not None:
+            if line.startswith(body_prefix) or not line or line.isspace():
+                if "/*" not in line and '{"' not in line:
+                    continue
+            else:
+                body_prefix = None
+        # Block comments and {" "} text blocks can contain anything
+        if in_comment:
+            end = line.find("*/")
+            if end < 0:
+                continue
+            in_comment = False
+            line = " " * (end + 2) + line[end + 2 :]
+        if in_text:
+            if '"}' not in line:
+                continue
+            in_text = False
+            continue
+        if "/*" in line:
+            start = line.find("/*")
+            end = line.find("*/", start + 2)
+            if end < 0:
+                if "//" not in line[:start]:
+                    in_comment = True
+                line = line[:start]
+            else:
+                line = line[:start] + line[end + 2 :]
+        if '{"' in line and line.count('{"') > line.count('"}'):
+            in_text = True
+
+        indent, text = _indentation(line)
+        if not text or text[0] == "#":
+            continue
+        while stack and stack[-1][0] >= indent:
+            stack.pop()
+        parent = stack[-1] if stack else None
+        if parent is not None and parent[2] == "proc":
+            continue
+
+        code, depth, assignment, text_open = _scan(text)
+        while depth > 0 or text_open:
+            more = next(lines, None)
+            if more is None:
+                break
+            more_code, depth, _, text_open = _scan(more.strip(), depth, text_open)
+            code = f"{code} {more_code}"
+        # The lines of a text block opened here were read with the record
+        in_text = False
+        if not code:
+            continue
+
+        parent_path = parent[1] if parent is not None else ""
+        in_var_block = parent is not None and parent[2] == "var"
+        if assignment >= 0 or in_var_block or code.startswith("var/"):
+            if assignment >= 0:
+                lhs = code[:assignment].strip().rstrip("/")
+                value = code[assignment + 1 :].strip()
+            else:
+                # A declaration without a value
+                lhs, value = code, "null"
+            path, name = _variable(parent_path, lhs, in_var_block)
+            if path and (prefixes is None or path.startswith(prefixes)):
+                yield path, name, value
+            continue
+        if code == "var":
+            stack.append((indent, parent_path, "var"))
+            continue
+        if _is_proc(code):
+            stack.append((indent, parent_path, "proc"))
+            if line.startswith("\t" * indent) and not in_text and not in_comment:
+                body_prefix = "\t" * (indent + 1)
+            continue
+        path = code.rstrip("/") if code[0] == "/" else f"{parent_path}/{code.strip('/')}"
+        stack.append((indent, path, "type"))
+        if prefixes is None or path.startswith(prefixes):
+            yield path, TYPE_DECLARATION, None
+
+
+def split_arguments(text):
+    """Splits `a, b = list(c, d), "e,f"` on its top-level commas."""
+    parts = []
+    depth = 0
+    start = 0
+    for match in _ARGUMENT_TOKENS.finditer(text):
+        token = match.group()
+        first = token[0]
+        if token[:2] == '{"':
+            continue
+        if first in _OPENERS:
+            depth += 1
+        elif first in _CLOSERS:
+            depth -= 1
+        elif first == "," and depth == 0:
+            parts.append(text[start : match.start()].strip())
+            start = match.end()
+    tail = text[start:].strip()
+    if tail or parts:
+        parts.append(tail)
+    return parts
+
+
+def parse_value(value_str):
+    """
+    Parses a string value and returns the appropriate Python type.
+
+    Args:
+        value_str: The string value to parse.
+
+    Returns:
+        The parsed value as a Python type (int, float, str, bool, dict, list).
+        `list()` values become a dict when their items are `key = value`
+        pairs and a list otherwise.
+    """
+    first = value_str[:1]
+    if first == '"':
+        if value_str.endswith('"') and len(value_str) > 1:
+            return value_str[1:-1]
+        return value_str
+    if first == "l" and value_str.startswith("list(") and value_str.endswith(")"):
+        return _parse_list(value_str[5:-1])
+    if first.isdigit() or first in "-.":
+        if _INT.fullmatch(value_str):
+            return int(value_str)
+        if _FLOAT.fullmatch(value_str):
+            return float(value_str)
+        return value_str
+    upper = value_str.upper()
+    if upper == "FALSE":
+        return False
+    if upper == "TRUE":
+        return True
+    return value_str
+
+
+def _parse_list(content):
+    pairs = []
+    values = []
+    for item in split_arguments(content):
+        match = _LIST_PAIR.match(item)
+        if match:
+            key = match.group(1)
+            if key[:1] == '"':
+                key = key[1:-1]
+            pairs.append((key, parse_value(match.group(2))))
+        else:
+            values.append(parse_value(item))
+    if not values:
+        return dict(pairs)
+    if pairs:
+        return values + [dict(pairs)]
+    return values
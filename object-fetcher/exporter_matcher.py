@@ -1,53 +1,385 @@
+import argparse
 import json
+import os
+import sys
+from json.encoder import encode_basestring
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+import instrumentation  # noqa: E402
 
-def merge_clothing_data(clothing_file, item_file, output_file):
+DEFAULT_FIELDS = ("armor",)
+# The types object-fetcher.js puts in civ13_item.json
+ITEM_PREFIXES = ("/obj/item/",)
+# Type entries encoded together, which is much cheaper than one by one
+WRITE_BATCH_SIZE = 256
+
+
+def _ijson():
+    """The ijson module, or None if it is not installed (files are then loaded whole)."""
+    try:
+        import ijson
+    except ImportError:
+        return None
+    return ijson
+
+
+def _json_errors():
+    """The exceptions raised for unreadable JSON, with or without ijson."""
+    ijson = _ijson()
+    return (OSError, ValueError) + ((ijson.JSONError,) if ijson is not None else ())
+
+
+def _with_backend(read):
+    """
+    Calls read(backend) with ijson, or with None (plain json) if it is not installed.
+
+    ijson's C backend (yajl2_c) stops with "integer overflow" on integers
+    above 2**63, which json.load reads; the file is then read again with
+    ijson's pure-Python backend, which reads them too.
+    """
+    ijson = _ijson()
+    if ijson is None:
+        return read(None)
+    try:
+        return read(ijson)
+    except ijson.JSONError as e:
+        if "integer overflow" not in str(e):
+            raise
+    return read(ijson.get_backend("python"))
+
+
+def _iter_clothing(clothing_file, backend):
+    if backend is None:
+        with open(clothing_file, "r", encoding="utf-8") as f:
+            yield from json.load(f).items()
+        return
+    with open(clothing_file, "rb") as f:
+        yield from backend.kvitems(f, "", use_float=True)
+
+
+def load_clothing_index(clothing_file, fields=DEFAULT_FIELDS):
+    """
+    Builds the path -> variables lookup table used by the merge.
+
+    The clothing file is read incrementally (when ijson is installed) and
+    only the requested variables are kept, so the table holds nothing that
+    will not be merged.
+
+    Args:
+        clothing_file (str): Path to the JSON file containing clothing item data.
+        fields: The variable names to keep, or None to keep every variable.
+
+    Returns:
+        dict: {path: {variable: value}} for the paths that have any of the fields.
+    """
+
+    def read(backend):
+        index = {}
+        for path, variables in _iter_clothing(clothing_file, backend):
+            if not isinstance(variables, dict):
+                continue
+            if fields is not None:
+                variables = {name: variables[name] for name in fields if name in variables}
+            # Like before, falsy values (no armor at all, armor = 0) are not merged
+            variables = {name: value for name, value in variables.items() if value}
+            if variables:
+                index[path] = variables
+        return index
+
+    return _with_backend(read)
+
+
+class _JsonWriter:
+    """Writes JSON piece by piece, formatted exactly like json.dump(indent=2)."""
+
+    def __init__(self, out, indent=2):
+        self.out = out
+        self.indent = indent
+        # [is_map, number of children written] per open container
+        self.stack = []
+        self.after_key = False
+
+    def _before_value(self):
+        if self.after_key:
+            self.after_key = False
+            return
+        if self.stack:
+            frame = self.stack[-1]
+            self.out.write(",\n" if frame[1] else "\n")
+            self.out.write(" " * (self.indent * len(self.stack)))
+            frame[1] += 1
+
+    def begin(self, is_map):
+        self._before_value()
+        self.out.write("{" if is_map else "[")
+        self.stack.append([is_map, 0])
+
+    def end(self):
+        is_map, count = self.stack.pop()
+        if count:
+            self.out.write("\n" + " " * (self.indent * len(self.stack)))
+        self.out.write("}" if is_map else "]")
+
+    def key(self, key):
+        self._before_value()
+        self.out.write(encode_basestring(key) + ": ")
+        self.after_key = True
+
+    def value(self, value):
+        self._before_value()
+        text = _scalar_text(value)
+        if text is None:
+            text = json.dumps(value, indent=self.indent, ensure_ascii=False)
+            if self.stack and "\n" in text:
+                text = text.replace("\n", "\n" + " " * (self.indent * len(self.stack)))
+        self.out.write(text)
+
+    def values(self, values):
+        """Writes several items of the current list with a single encoder run."""
+        if not values:
+            return
+        frame = self.stack[-1]
+        text = json.dumps(values, indent=self.indent, ensure_ascii=False)
+        # Strip the "[\n" and "\n]" of the batch and indent it to this depth
+        pad = " " * (self.indent * (len(self.stack) - 1))
+        body = text[2:-2]
+        if pad:
+            body = pad + body.replace("\n", "\n" + pad)
+        self.out.write(",\n" if frame[1] else "\n")
+        self.out.write(body)
+        frame[1] += len(values)
+
+
+def _scalar_text(value):
+    """json.dumps() of the common scalars, without setting up an encoder."""
+    if isinstance(value, str):
+        return encode_basestring(value)
+    if value is None:
+        return "null"
+    if value is True:
+        return "true"
+    if value is False:
+        return "false"
+    if type(value) is int:
+        return int.__repr__(value)
+    return None
+
+
+def _merge_item(item, clothing_index):
+    """Copies the indexed variables of the item's path into it. Returns True if it did."""
+    path = item.get("Path")  # Handle case where "Path" might be missing
+    variables = clothing_index.get(path) if isinstance(path, str) else None
+    if not variables:
+        return False
+    if "Variables" not in item:  # Create "Variables" if it doesn't exist
+        item["Variables"] = {}
+    item["Variables"].update(variables)
+    return True
+
+
+def load_merge(item_file, out, clothing_index):
+    """
+    Like stream_merge, but loads the whole dump with json (used without ijson).
+    """
+    with open(item_file, "r", encoding="utf-8") as f:
+        item_data = json.load(f)
+    types = item_data.get("Types", []) if isinstance(item_data, dict) else []
+    merged = sum(_merge_item(item, clothing_index) for item in types if isinstance(item, dict))
+    json.dump(item_data, out, indent=2, ensure_ascii=False)
+    return len(types), merged
+
+
+def stream_merge(item_file, out, clothing_index, backend=None):
+    """
+    Copies an OpenDream JSON dump to `out`, merging the clothing variables
+    into the entries of its "Types" list.
+
+    Only one type entry is held in memory at a time. The file is read
+    through two handles: the entries of "Types" are built by ijson's items()
+    on one, while the rest of the document is copied event by event from
+    the other.
+
+    Args:
+        backend: The ijson backend to use (default: ijson's default one).
+
+    Returns:
+        A tuple (types, merged): the number of type entries and how many of
+        them received clothing variables.
+    """
+    if backend is None:
+        import ijson as backend
+    writer = _JsonWriter(out)
+    types = merged = 0
+    with open(item_file, "rb") as events_file, open(item_file, "rb") as items_file:
+        items = backend.items(items_file, "Types.item", use_float=True)
+        events = backend.parse(events_file, use_float=True)
+        for prefix, event, value in events:
+            if event == "start_map" or event == "start_array":
+                writer.begin(event == "start_map")
+                if prefix != "Types" or event != "start_array":
+                    continue
+                # Skip the list on this handle and write the merged entries instead
+                depth = 1
+                for prefix, event, value in events:
+                    if event == "start_map" or event == "start_array":
+                        depth += 1
+                    elif event == "end_map" or event == "end_array":
+                        depth -= 1
+                        if depth == 0:
+                            break
+                batch = []
+                for item in items:
+                    if isinstance(item, dict):
+                        merged += _merge_item(item, clothing_index)
+                    batch.append(item)
+                    if len(batch) >= WRITE_BATCH_SIZE:
+                        writer.values(batch)
+                        types += len(batch)
+                        batch = []
+                writer.values(batch)
+                types += len(batch)
+                writer.end()
+            elif event == "end_map" or event == "end_array":
+                writer.end()
+            elif event == "map_key":
+                writer.key(value)
+            else:
+                writer.value(value)
+    return types, merged
+
+
+def merge_clothing_data(clothing_file, item_file, output_file, fields=DEFAULT_FIELDS):
     """
     Merges clothing item data from clothing_file into item_file based on matching paths.
     Handles inconsistencies in item_file structure.
 
+    With ijson installed, the item file is streamed, so memory use is
+    bounded by the clothing index and not by the size of the item dump
+    (which can be the full compiled civ13.json). Without it, both files are
+    loaded whole with json, giving the same output.
+
     Args:
         clothing_file (str): Path to the JSON file containing clothing item data.
         item_file (str): Path to the JSON file containing item data.
         output_file (str): Path to the output JSON file.
+        fields: The clothing variables to merge, or None to merge all of them.
     """
 
     try:
-        with open(clothing_file, "r", encoding="utf-8") as f:
-            clothing_data = json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError) as e:
+        with instrumentation.stage("load clothing"):
+            clothing_index = load_clothing_index(clothing_file, fields)
+    except _json_errors() as e:
         print(f"Error loading clothing data: {e}")
         return
 
+    temp_file = output_file + ".tmp"
+
+    def merge(backend):
+        with open(temp_file, "w", encoding="utf-8") as out:
+            if backend is None:
+                return load_merge(item_file, out, clothing_index)
+            return stream_merge(item_file, out, clothing_index, backend)
+
     try:
-        with open(item_file, "r", encoding="utf-8") as f:
-            item_data = json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError) as e:
-        print(f"Error loading item data: {e}")
+        with instrumentation.stage("merge"):
+            types, merged = _with_backend(merge)
+    except _json_errors() as e:
+        print(f"Error merging item data: {e}")
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
         return
+    os.replace(temp_file, output_file)
+    instrumentation.count("types", types)
+    instrumentation.count("merged", merged)
+    print(f"Merged clothing data into {merged} of {types} types")
+    print(f"Successfully merged data and exported to: {output_file}")
 
-    for item in item_data.get(
-        "Types", []
-    ):  # Handle case where "Types" might be missing
-        path = item.get("Path")  # Handle case where "Path" might be missing
-        if path and path in clothing_data:
-            armor_data = clothing_data[path].get("armor")
-            if armor_data:
-                if "Variables" not in item:  # Create "Variables" if it doesn't exist
-                    item["Variables"] = {}
-                item["Variables"]["armor"] = armor_data
+
+def merge_from_store(
+    clothing_file, store_path, output_file, prefixes=ITEM_PREFIXES, fields=DEFAULT_FIELDS
+):
+    """
+    Like merge_clothing_data, but takes the types from a civ13_store.py store
+    instead of a JSON dump, so only the types under `prefixes` are read.
+    """
+    from civ13_store import Civ13Store, strip_procs
 
     try:
-        with open(output_file, "w", encoding="utf-8") as f:
-            json.dump(item_data, f, indent=2, ensure_ascii=False)
-        print(f"Successfully merged data and exported to: {output_file}")
-    except Exception as e:
-        print(f"Error writing output: {e}")
+        with instrumentation.stage("load clothing"):
+            clothing_index = load_clothing_index(clothing_file, fields)
+    except _json_errors() as e:
+        print(f"Error loading clothing data: {e}")
+        return
+
+    temp_file = output_file + ".tmp"
+    types = merged = 0
+    with instrumentation.stage("merge"), Civ13Store(store_path) as store, open(
+        temp_file, "w", encoding="utf-8"
+    ) as out:
+        writer = _JsonWriter(out)
+        writer.begin(True)
+        writer.key("Types")
+        writer.begin(False)
+        batch = []
+        for item in store.iter_types(prefixes):
+            merged += _merge_item(strip_procs(item), clothing_index)
+            batch.append(item)
+            if len(batch) >= WRITE_BATCH_SIZE:
+                writer.values(batch)
+                types += len(batch)
+                batch = []
+        writer.values(batch)
+        types += len(batch)
+        writer.end()
+        writer.end()
+    os.replace(temp_file, output_file)
+    instrumentation.count("types", types)
+    instrumentation.count("merged", merged)
+    print(f"Merged clothing data into {merged} of {types} types")
+    print(f"Successfully merged data and exported to: {output_file}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Merges the exported clothing variables into the OpenDream item dump."
+    )
+    parser.add_argument(
+        "--clothing",
+        default="./output/clothing_items.json",
+        help="clothing data from civ13exporter.py",
+    )
+    parser.add_argument(
+        "--items",
+        default="./output/civ13_item.json",
+        help="the OpenDream item dump (or the full civ13.json)",
+    )
+    parser.add_argument(
+        "--store",
+        help="read the items from this civ13_store.py store instead of --items",
+    )
+    parser.add_argument(
+        "--output", default="./output/civ13_item_merged.json", help="the merged JSON"
+    )
+    fields = parser.add_mutually_exclusive_group()
+    fields.add_argument(
+        "--fields",
+        nargs="+",
+        default=list(DEFAULT_FIELDS),
+        help="the variables to merge (default: armor)",
+    )
+    fields.add_argument(
+        "--all-fields", action="store_true", help="merge every exported variable"
+    )
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args(argv)
 
+    fields = None if args.all_fields else args.fields
+    with instrumentation.instrument("exporter_matcher", args, argv):
+        if args.store:
+            merge_from_store(args.clothing, args.store, args.output, fields=fields)
+        else:
+            merge_clothing_data(args.clothing, args.items, args.output, fields=fields)
 
-# Example usage (replace with your actual file paths):
-clothing_file = r"d:\GitHub\civ14-tools\object-fetcher\output\clothing_items.json"
-item_file = r"d:\GitHub\civ14-tools\object-fetcher\output\civ13_item.json"
-output_file = r"d:\GitHub\civ14-tools\object-fetcher\output\civ13_item_merged.json"
 
-merge_clothing_data(clothing_file, item_file, output_file)
+if __name__ == "__main__":
+    main()
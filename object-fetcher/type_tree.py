@@ -0,0 +1,276 @@
+"""
+DM type inheritance index.
+
+Types are stored in a trie over their path segments (`/obj/item/clothing`
+is obj -> item -> clothing), so the parent of a type is its parent node.
+A type's resolved variables are its parent's resolved variables updated
+with its own; they are computed on first use and memoized per node.
+`parent_type = /path` overrides the parent, like in DM.
+
+The resolved index can be written to a SQLite file and opened with
+TypeIndex, which answers lookups for any path (declared or not) by walking
+up to the nearest declared type, without reparsing the .dm files.
+"""
+
+import json
+import sqlite3
+
+# Bump when the index file layout changes
+INDEX_FORMAT_VERSION = 1
+
+
+def split_path(path):
+    """Returns the segments of a type path ("/obj/item" -> ["obj", "item"])."""
+    return [segment for segment in path.split("/") if segment]
+
+
+class TypeNode:
+    """One path segment of the type tree."""
+
+    __slots__ = ("name", "parent", "children", "variables", "_resolved")
+
+    def __init__(self, name, parent=None):
+        self.name = name
+        self.parent = parent
+        self.children = None
+        # None until the type is declared somewhere in the code
+        self.variables = None
+        # (tree generation, resolved variables)
+        self._resolved = None
+
+    @property
+    def path(self):
+        segments = []
+        node = self
+        while node.parent is not None:
+            segments.append(node.name)
+            node = node.parent
+        return "/" + "/".join(reversed(segments))
+
+    @property
+    def declared(self):
+        return self.variables is not None
+
+
+class TypeTree:
+    """In-memory trie of DM types with lazy, memoized variable inheritance."""
+
+    def __init__(self):
+        self.root = TypeNode("")
+        self._generation = 0
+
+    def add(self, path, variables=None):
+        """
+        Declares a type and sets its own variables.
+
+        A type declared more than once (in several files) accumulates the
+        variables of every declaration, later ones winning.
+        """
+        node = self._node(path, create=True)
+        if node.variables is None:
+            node.variables = {}
+        if variables:
+            node.variables.update(variables)
+        # Invalidates every memoized resolution
+        self._generation += 1
+        return node
+
+    def get(self, path):
+        """Returns the node of a path, or None if the path is not in the tree."""
+        return self._node(path, create=False)
+
+    def _node(self, path, create):
+        node = self.root
+        for segment in split_path(path):
+            children = node.children
+            child = children.get(segment) if children is not None else None
+            if child is None:
+                if not create:
+                    return None
+                child = TypeNode(segment, node)
+                if children is None:
+                    node.children = children = {}
+                children[segment] = child
+            node = child
+        return node
+
+    def resolve(self, path):
+        """
+        Returns the variables of a type including everything it inherits.
+
+        The returned dict is shared with the memo and must not be modified.
+        Paths that were never declared resolve to their nearest declared
+        ancestor's variables.
+        """
+        return self._resolve(self._nearest(path), set())
+
+    def _resolve(self, node, visiting):
+        memo = node._resolved
+        if memo is not None and memo[0] == self._generation:
+            return memo[1]
+        own = node.variables or {}
+        parent = node.parent
+        parent_type = own.get("parent_type")
+        if isinstance(parent_type, str) and parent_type.startswith("/"):
+            parent = self._nearest(parent_type)
+        if parent is None or node in visiting:
+            resolved = dict(own)
+        else:
+            visiting.add(node)
+            inherited = self._resolve(parent, visiting)
+            visiting.discard(node)
+            if own:
+                resolved = dict(inherited)
+                resolved.update(own)
+            else:
+                resolved = inherited
+        node._resolved = (self._generation, resolved)
+        return resolved
+
+    def _nearest(self, path):
+        """Returns the deepest existing node on a path."""
+        node = self.root
+        for segment in split_path(path):
+            child = node.children.get(segment) if node.children else None
+            if child is None:
+                break
+            node = child
+        return node
+
+    def iter_types(self, prefixes=None):
+        """
+        Yields the declared type paths, depth first.
+
+        Args:
+            prefixes: Only paths starting with one of these (None for all).
+        """
+        stack = [(self.root, "")]
+        while stack:
+            node, path = stack.pop()
+            if node.declared and (prefixes is None or path.startswith(prefixes)):
+                yield path
+            if node.children:
+                stack.extend(
+                    (child, f"{path}/{name}")
+                    for name, child in reversed(node.children.items())
+                )
+
+    def __len__(self):
+        return sum(1 for _ in self.iter_types())
+
+    def dump_index(self, db_path, prefixes=None):
+        """
+        Writes the resolved variables of every declared type to a SQLite file.
+
+        Args:
+            db_path: The index file (replaced if it exists).
+            prefixes: Only export types starting with one of these.
+
+        Returns:
+            The number of types written.
+        """
+        db = sqlite3.connect(db_path)
+        try:
+            db.executescript(
+                """
+                DROP TABLE IF EXISTS types;
+                DROP TABLE IF EXISTS meta;
+                CREATE TABLE types (
+                    path TEXT PRIMARY KEY,
+                    parent TEXT,
+                    variables TEXT NOT NULL
+                ) WITHOUT ROWID;
+                CREATE TABLE meta (name TEXT PRIMARY KEY, value INTEGER);
+                """
+            )
+            db.execute(
+                "INSERT INTO meta VALUES ('version', ?)", (INDEX_FORMAT_VERSION,)
+            )
+            count = 0
+            rows = []
+            for path in self.iter_types(prefixes):
+                node = self.get(path)
+                variables = self._resolve(node, set())
+                rows.append(
+                    (
+                        path,
+                        _declared_parent(node),
+                        json.dumps(variables, ensure_ascii=False, separators=(",", ":")),
+                    )
+                )
+                if len(rows) >= 1000:
+                    db.executemany("INSERT INTO types VALUES (?, ?, ?)", rows)
+                    count += len(rows)
+                    rows = []
+            db.executemany("INSERT INTO types VALUES (?, ?, ?)", rows)
+            count += len(rows)
+            db.commit()
+        finally:
+            db.close()
+        return count
+
+
+def _declared_parent(node):
+    """Returns the path of the nearest declared ancestor of a node, or None."""
+    parent = node.parent
+    while parent is not None and parent.parent is not None:
+        if parent.declared:
+            return parent.path
+        parent = parent.parent
+    return None
+
+
+class TypeIndex:
+    """
+    Read-only view of an index written by TypeTree.dump_index.
+
+    Use it as a context manager, or call close() when done.
+    """
+
+    def __init__(self, db_path):
+        self._db = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        row = self._db.execute("SELECT value FROM meta WHERE name = 'version'").fetchone()
+        if row is None or row[0] != INDEX_FORMAT_VERSION:
+            self._db.close()
+            raise ValueError(f"{db_path} is not a version {INDEX_FORMAT_VERSION} type index")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._db.close()
+
+    def get(self, path):
+        """
+        Returns the resolved variables of a type, or None if neither it nor
+        any of its ancestors is in the index.
+        """
+        segments = split_path(path)
+        while segments:
+            row = self._db.execute(
+                "SELECT variables FROM types WHERE path = ?",
+                ("/" + "/".join(segments),),
+            ).fetchone()
+            if row is not None:
+                return json.loads(row[0])
+            segments.pop()
+        return None
+
+    def children(self, path):
+        """Returns the paths of the indexed types whose nearest indexed parent is `path`."""
+        rows = self._db.execute(
+            "SELECT path FROM types WHERE parent = ? ORDER BY path", (path.rstrip("/"),)
+        )
+        return [row[0] for row in rows]
+
+    def __contains__(self, path):
+        row = self._db.execute(
+            "SELECT 1 FROM types WHERE path = ?", (path.rstrip("/"),)
+        ).fetchone()
+        return row is not None
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM types").fetchone()[0]
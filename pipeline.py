@@ -0,0 +1,443 @@
+"""
+Runs the object pipeline (recipes, type export, item merge, .yml creators
+and the duplicate check) in dependency order, make-style.
+
+Every step declares the files it reads and writes. A step is skipped when
+its outputs exist and the content of its inputs (and its command) is the
+same as on its last successful run, so after a small Civ13 change only the
+affected steps run again. Steps that do not depend on each other run at
+the same time.
+
+Usage: python pipeline.py [step ...] [--jobs N] [--force] [--dry-run] [--list]
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import subprocess
+import sys
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from fnmatch import fnmatch
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+STATE_VERSION = 1
+HASH_CHUNK_SIZE = 1 << 20
+
+ITEMS = "object-fetcher/output/civ13_item.json"
+MERGED_ITEMS = "object-fetcher/output/civ13_item_merged.json"
+RECIPES = "recipe-converter/recipes/recipes_full.json"
+CIV13_JSON = "object-fetcher/civ13.json"
+# Shared modules the Python steps import
+INSTRUMENTATION = "common/instrumentation.py"
+SS14_YAML = "common/ss14_yaml.py"
+
+# creator script -> (the JSON files it reads, the .yml files it writes)
+CREATORS = {
+    "bladed": ([ITEMS, RECIPES], ["entities_bladed.yml", "recipes_bladed.yml"]),
+    "bullets": ([ITEMS], ["entities_bullets.yml"]),
+    "calibers": ([ITEMS], ["entities_calibers.yml"]),
+    "clothing_accessories": (
+        [MERGED_ITEMS, RECIPES],
+        ["entities_clothing_accessories.yml", "recipes_clothing_accessories.yml"],
+    ),
+    "clothing_glasses": (
+        [MERGED_ITEMS, RECIPES],
+        ["entities_clothing_glasses.yml", "recipes_clothing_glasses.yml"],
+    ),
+    "clothing_gloves": (
+        [MERGED_ITEMS, RECIPES],
+        ["entities_clothing_gloves.yml", "recipes_clothing_gloves.yml"],
+    ),
+    "clothing_hats": (
+        [MERGED_ITEMS, RECIPES],
+        ["entities_clothing_hats.yml", "recipes_clothing_hats.yml"],
+    ),
+    "clothing_masks": (
+        [MERGED_ITEMS, RECIPES],
+        ["entities_clothing_masks.yml", "recipes_clothing_masks.yml"],
+    ),
+    "clothing_shoes": (
+        [MERGED_ITEMS, RECIPES],
+        ["entities_clothing_shoes.yml", "recipes_clothing_shoes.yml"],
+    ),
+    "clothing_suits": (
+        [MERGED_ITEMS, RECIPES],
+        ["entities_clothing_suit.yml", "recipes_clothing_suit.yml"],
+    ),
+    "clothing_uniforms": (
+        [MERGED_ITEMS, RECIPES],
+        ["entities_clothing_uniform.yml", "recipes_clothing_uniform.yml"],
+    ),
+    "flags": ([CIV13_JSON], ["flags.yml"]),
+    "guns": ([ITEMS], ["entities_pistol.yml"]),
+    "mags": ([ITEMS], ["entities_magazines.yml"]),
+    "shields": ([ITEMS, RECIPES], ["entities_shields.yml", "recipes_shields.yml"]),
+    "wallflags": ([CIV13_JSON], ["wallflags.yml"]),
+}
+
+
+def read_config(path):
+    """
+    Reads config.txt: the Civ13 folder on its second line and the Civ14
+    folder on its fourth.
+    """
+    with open(path, "r") as f:
+        lines = [line.strip().replace("\\", "/") for line in f.readlines()]
+    return {
+        "civ13": lines[1] if len(lines) > 1 else "",
+        "civ14": lines[3] if len(lines) > 3 else "",
+    }
+
+
+class Step:
+    """
+    One command of the pipeline.
+
+    `inputs` are paths or glob patterns (relative to the repository unless
+    absolute) and `outputs` are paths. A step depends on every step that
+    writes one of its inputs.
+    """
+
+    def __init__(self, name, command, cwd, inputs, outputs):
+        self.name = name
+        self.command = command
+        self.cwd = cwd
+        self.inputs = inputs
+        self.outputs = outputs
+
+    def depends_on(self, other):
+        return any(
+            fnmatch(_path(output), _path(pattern))
+            for pattern in self.inputs
+            for output in other.outputs
+        )
+
+    def input_files(self):
+        """The files matched by the inputs. Raises FileNotFoundError for a missing plain path."""
+        files = []
+        for pattern in self.inputs:
+            path = _path(pattern)
+            if glob.has_magic(path):
+                files.extend(sorted(glob.glob(path, recursive=True)))
+            elif os.path.exists(path):
+                files.append(path)
+            else:
+                raise FileNotFoundError(f"missing input {path}")
+        return files
+
+    def outputs_exist(self):
+        return all(os.path.exists(_path(output)) for output in self.outputs)
+
+
+def _path(path):
+    return os.path.normpath(os.path.join(ROOT, path))
+
+
+def build_steps(config, python=sys.executable, node="node"):
+    """Declares the steps of the pipeline, with the Civ13 paths from config.txt."""
+    recipe_file = f"{config['civ13']}/config/crafting/material_recipes_global.txt"
+    dm_directory = f"{config['civ13']}/code"
+    steps = [
+        Step(
+            "recipes",
+            [python, "recipe-converter.py", "--input", recipe_file, "--output", "recipes"],
+            "recipe-converter",
+            [recipe_file, "recipe-converter/recipe-converter.py", INSTRUMENTATION],
+            [RECIPES],
+        ),
+        Step(
+            "split",
+            [node, "object-fetcher.js"],
+            "object-fetcher",
+            [CIV13_JSON, "object-fetcher/object-fetcher.js"],
+            [
+                "object-fetcher/output/civ13_structure.json",
+                ITEMS,
+                "object-fetcher/output/civ13_mob.json",
+                "object-fetcher/output/civ13_turf.json",
+            ],
+        ),
+        Step(
+            "clothing",
+            [python, "civ13exporter.py", "--input", dm_directory],
+            "object-fetcher",
+            [
+                f"{dm_directory}/**/*.dm",
+                "object-fetcher/civ13exporter.py",
+                "object-fetcher/dm_tokenizer.py",
+                "object-fetcher/type_tree.py",
+                INSTRUMENTATION,
+            ],
+            [
+                "object-fetcher/output/clothing_items.json",
+                "object-fetcher/output/type_index.sqlite",
+            ],
+        ),
+        Step(
+            "merge",
+            [python, "exporter_matcher.py"],
+            "object-fetcher",
+            [
+                "object-fetcher/output/clothing_items.json",
+                ITEMS,
+                "object-fetcher/exporter_matcher.py",
+                INSTRUMENTATION,
+            ],
+            [MERGED_ITEMS],
+        ),
+    ]
+    yml_files = []
+    for name, (reads, writes) in CREATORS.items():
+        outputs = [f"object-fetcher/output/yml/{yml}" for yml in writes]
+        yml_files.extend(writes)
+        steps.append(
+            Step(
+                name,
+                [node, f"{name}.js"],
+                "object-fetcher/creators",
+                reads
+                + [f"object-fetcher/creators/{name}.js", "object-fetcher/recipe_yamlifier.js"],
+                outputs,
+            )
+        )
+    steps.append(
+        Step(
+            "duplicates",
+            [python, "checkduplicates.py"]
+            + [f"output/yml/{yml}" for yml in yml_files]
+            + ["--report", "output/duplicates.json"],
+            "object-fetcher",
+            [f"object-fetcher/output/yml/{yml}" for yml in yml_files]
+            + ["object-fetcher/checkduplicates.py", INSTRUMENTATION, SS14_YAML],
+            ["object-fetcher/output/duplicates.json"],
+        )
+    )
+    return steps
+
+
+class PipelineState:
+    """
+    The file digests and the input digest of every step's last successful
+    run, kept in a JSON file between runs.
+
+    File digests are cached by path, modification time and size, so files
+    that did not change are not read again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+        self.steps = {}
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    state = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                print(f"Warning: Ignoring unreadable state {path}: {e}")
+                return
+            if state.get("version") == STATE_VERSION:
+                self.files = state.get("files", {})
+                self.steps = state.get("steps", {})
+
+    def file_digest(self, path):
+        stat = os.stat(path)
+        entry = self.files.get(path)
+        if entry and entry["mtime_ns"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+            return entry["digest"]
+        digest = hashlib.blake2b(digest_size=16)
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        self.files[path] = {
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "digest": digest.hexdigest(),
+        }
+        return digest.hexdigest()
+
+    def step_digest(self, step):
+        """A digest of the step's command and of the paths and content of its input files."""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(json.dumps(step.command).encode("utf-8"))
+        for path in step.input_files():
+            digest.update(os.path.relpath(path, ROOT).encode("utf-8") + b"\0")
+            digest.update(self.file_digest(path).encode("ascii"))
+        return digest.hexdigest()
+
+    def is_current(self, step, digest):
+        return self.steps.get(step.name) == digest and step.outputs_exist()
+
+    def save(self):
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": STATE_VERSION, "files": self.files, "steps": self.steps}, f)
+        os.replace(temp_path, self.path)
+
+
+def run_step(step):
+    """Runs the step's command. Returns (return code, output)."""
+    for output in step.outputs:
+        os.makedirs(os.path.dirname(_path(output)), exist_ok=True)
+    try:
+        result = subprocess.run(
+            step.command,
+            cwd=_path(step.cwd),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            errors="replace",
+        )
+    except OSError as e:
+        return 1, str(e)
+    return result.returncode, result.stdout
+
+
+def select_steps(steps, names):
+    """The named steps and every step they depend on, in declaration order."""
+    by_name = {step.name: step for step in steps}
+    unknown = [name for name in names if name not in by_name]
+    if unknown:
+        raise KeyError(f"unknown step(s): {', '.join(unknown)}")
+    wanted = set()
+    todo = list(names)
+    while todo:
+        name = todo.pop()
+        if name in wanted:
+            continue
+        wanted.add(name)
+        todo.extend(other.name for other in steps if by_name[name].depends_on(other))
+    return [step for step in steps if step.name in wanted]
+
+
+def run_pipeline(steps, state, jobs=4, force=False, dry_run=False, verbose=False):
+    """
+    Runs the steps that are not current, `jobs` at a time, each one once
+    everything it depends on is done.
+
+    Returns:
+        {step name: status}, the status being "ran", "current", "failed",
+        "blocked" (something it depends on failed) or, with dry_run,
+        "would run".
+    """
+    dependencies = {
+        step.name: {other.name for other in steps if other is not step and step.depends_on(other)}
+        for step in steps
+    }
+    status = {}
+    pending = list(steps)
+    running = {}
+
+    def start(step):
+        try:
+            digest = state.step_digest(step)
+        except FileNotFoundError as e:
+            print(f"[{step.name}] failed: {e}")
+            status[step.name] = "failed"
+            return
+        # Without running them, what the steps before would write is unknown
+        upstream_pending = dry_run and any(
+            status[name] == "would run" for name in dependencies[step.name]
+        )
+        if not force and not upstream_pending and state.is_current(step, digest):
+            status[step.name] = "current"
+            if verbose:
+                print(f"[{step.name}] up to date")
+        elif dry_run:
+            status[step.name] = "would run"
+            print(f"[{step.name}] would run: {' '.join(step.command)}")
+        else:
+            print(f"[{step.name}] running: {' '.join(step.command)}")
+            running[executor.submit(run_step, step)] = (step, digest)
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        while pending or running:
+            for step in list(pending):
+                needed = dependencies[step.name]
+                if any(status.get(name) in ("failed", "blocked") for name in needed):
+                    pending.remove(step)
+                    status[step.name] = "blocked"
+                    print(f"[{step.name}] blocked")
+                elif all(name in status for name in needed) and len(running) < max(1, jobs):
+                    pending.remove(step)
+                    start(step)
+            if not running:
+                if pending and not any(
+                    all(name in status for name in dependencies[step.name]) for step in pending
+                ):
+                    raise RuntimeError("dependency cycle between " + ", ".join(s.name for s in pending))
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                step, digest = running.pop(future)
+                returncode, output = future.result()
+                if output.strip():
+                    prefix = f"[{step.name}] "
+                    print(prefix + output.rstrip().replace("\n", "\n" + prefix))
+                if returncode == 0 and step.outputs_exist():
+                    status[step.name] = "ran"
+                    state.steps[step.name] = digest
+                    print(f"[{step.name}] done")
+                else:
+                    status[step.name] = "failed"
+                    state.steps.pop(step.name, None)
+                    missing = [o for o in step.outputs if not os.path.exists(_path(o))]
+                    reason = f"exit code {returncode}" if returncode else f"missing {', '.join(missing)}"
+                    print(f"[{step.name}] failed ({reason})")
+                if not dry_run:
+                    state.save()
+    return status
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("steps", nargs="*", help="run these steps and what they need (default: all)")
+    parser.add_argument("--config", default=os.path.join(ROOT, "config.txt"))
+    parser.add_argument(
+        "--state",
+        default=os.path.join(ROOT, "pipeline_state.json"),
+        help="where the digests of the last runs are kept",
+    )
+    parser.add_argument("--jobs", type=int, default=4, help="steps run at the same time")
+    parser.add_argument("--force", action="store_true", help="run the steps even if they are up to date")
+    parser.add_argument("--dry-run", action="store_true", help="only print what would run")
+    parser.add_argument("--list", action="store_true", help="list the steps and their inputs and outputs")
+    parser.add_argument("--node", default="node", help="the Node.JS executable")
+    parser.add_argument("--verbose", action="store_true", help="also print the steps that are up to date")
+    args = parser.parse_args()
+
+    config = read_config(args.config)
+    if not config["civ13"]:
+        print("Error! No configs found.")
+        sys.exit(1)
+    steps = build_steps(config, node=args.node)
+
+    if args.list:
+        for step in steps:
+            print(f"{step.name}: {' '.join(step.command)}  (in {step.cwd})")
+            for path in step.inputs:
+                print(f"  < {path}")
+            for path in step.outputs:
+                print(f"  > {path}")
+        return
+
+    try:
+        if args.steps:
+            steps = select_steps(steps, args.steps)
+    except KeyError as e:
+        print(f"Error: {e.args[0]}")
+        sys.exit(1)
+
+    state = PipelineState(args.state)
+    status = run_pipeline(steps, state, args.jobs, args.force, args.dry_run, args.verbose)
+    counts = {}
+    for value in status.values():
+        counts[value] = counts.get(value, 0) + 1
+    print(", ".join(f"{count} {value}" for value, count in sorted(counts.items())))
+    if counts.get("failed") or counts.get("blocked"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
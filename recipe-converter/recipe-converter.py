@@ -1,119 +1,414 @@
 import os
 import sys
-import shutil
 import json
+import time
+import hashlib
+import argparse
+import csv
+import gc
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import islice, repeat
+from operator import mul
+from typing import NamedTuple
 
-path1 = ""
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+import instrumentation  # noqa: E402
 
+RECIPE_PREFIX = "RECIPE: "
+RECIPE_FIELDS = 13
+# Lines of the file read, split and converted together, so only one batch is held
+BATCH_SIZE = 2048
 
-def parse_line(line, line_parsed):
-    tline = line.replace("RECIPE: ", "")
-    if len(line_parsed) != 13:
-        print("Error! This line does not have a length of 13 - {}".format(tline))
-        return None  # Return None to indicate an error
-    else:
-        otype = line_parsed[0].replace("/material/", "").replace("/", "")
-        try:
-            cost = int(float(line_parsed[3]))  # Handle potential floats
-        except ValueError:
-            print(f"Error: Invalid cost value '{line_parsed[3]}' in line: {tline}")
-            return None
-        try:
-            time = int(
-                float(line_parsed[4]) * 100
-            )  # Handle potential floats and convert to milliseconds
-        except ValueError:
-            print(f"Error: Invalid time value '{line_parsed[4]}' in line: {tline}")
-            return None
 
+# Column converters: each converts a whole column of strings at once
+
+def _ints(values):
+    return list(map(int, values))
+
+
+def _float_ints(values):
+    return list(map(int, map(float, values)))  # Handle potential floats
+
+
+def _times(values):
+    # Handle potential floats and convert to milliseconds
+    return list(map(int, map(mul, map(float, values), repeat(100))))
+
+
+def _materials(values):
+    # Only a few distinct materials, each repeated many times
+    names = {
+        value: value.replace(RECIPE_PREFIX, "").replace("/material/", "").replace("/", "")
+        for value in set(values)
+    }
+    return list(map(names.__getitem__, values))
+
+
+class Recipe(NamedTuple):
+    """One recipe. The fields are in the order of the JSON output."""
+
+    name: str
+    template_name: str
+    res_amount: int
+    time: int
+    category: str
+    age1: int
+    age2: int
+    age3: int
+    last_age: int
+    material: str
+
+    def as_dict(self):
+        return dict(zip(self._fields, self))
+
+
+# (Recipe field, column, column converter), in Recipe field order. Columns
+# 5, 6 and 12 are not used.
+RECIPE_SCHEMA = (
+    ("name", 1, None),
+    ("template_name", 2, None),
+    ("res_amount", 3, _float_ints),  # res_amount is the same as cost
+    ("time", 4, _times),
+    ("category", 7, None),
+    ("age1", 8, _ints),
+    ("age2", 9, _ints),
+    ("age3", 10, _ints),
+    ("last_age", 11, _ints),
+    ("material", 0, _materials),
+)
+
+
+class RecipeLines:
+    """The RECIPE lines of a recipe list and their line numbers."""
+
+    def __init__(self, line_numbers, lines):
+        self.line_numbers = line_numbers
+        self.lines = lines
+
+    @classmethod
+    def read_batches(cls, stream, size):
+        """Yields the RECIPE lines of a stream, reading `size` lines at a time."""
+        numbered = enumerate(stream, 1)
+        while True:
+            batch = list(islice(numbered, size))
+            if not batch:
+                return
+            recipes = [
+                (number, line) for number, line in batch if line.find(RECIPE_PREFIX, 0, 10) != -1
+            ]
+            if recipes:
+                line_numbers, lines = zip(*recipes)
+                yield cls(list(line_numbers), list(lines))
+
+    def subset(self, indices):
+        return RecipeLines(
+            [self.line_numbers[i] for i in indices], [self.lines[i] for i in indices]
+        )
+
+    def error(self, i, field, value, message):
+        return {
+            "line": self.line_numbers[i],
+            "field": field,
+            "value": value,
+            "message": message,
+            "text": self.lines[i].rstrip("\r\n").replace(RECIPE_PREFIX, ""),
+        }
+
+
+def _split_lines(source, errors):
+    """csv-splits every line on its own, so a bad quote only costs its own line."""
+    rows = []
+    for i, line in enumerate(source.lines):
         try:
-            age1 = int(line_parsed[8])
-        except ValueError:
-            print(f"Error: Invalid age1 value '{line_parsed[8]}' in line: {tline}")
-            return None
-        try:
-            age2 = int(line_parsed[9])
-        except ValueError:
-            print(f"Error: Invalid age2 value '{line_parsed[9]}' in line: {tline}")
-            return None
-        try:
-            age3 = int(line_parsed[10])
-        except ValueError:
-            print(f"Error: Invalid age3 value '{line_parsed[10]}' in line: {tline}")
-            return None
+            rows.append(next(csv.reader((line,), strict=True), []))
+        except csv.Error as e:
+            errors.append(source.error(i, None, None, str(e)))
+            rows.append(None)
+    return rows
+
+
+def read_recipe_rows(source, errors):
+    """
+    Splits RecipeLines into fields with the csv module, so a quoted field
+    like "pot, iron" may contain commas.
+
+    Lines that cannot be split, or do not have exactly RECIPE_FIELDS fields,
+    are reported in `errors`.
+
+    Returns:
+        A tuple (rows, source): the field lists, and the RecipeLines they
+        were read from.
+    """
+    try:
+        rows = list(csv.reader(source.lines, strict=True))
+    except csv.Error:
+        rows = None
+    # A quote left open joins lines into one row; split them one by one then
+    if rows is None or len(rows) != len(source.lines):
+        rows = _split_lines(source, errors)
+
+    if None not in rows and all(map(RECIPE_FIELDS.__eq__, map(len, rows))):
+        return rows, source
+    valid = [i for i, row in enumerate(rows) if row is not None and len(row) == RECIPE_FIELDS]
+    for i, row in enumerate(rows):
+        if row is not None and len(row) != RECIPE_FIELDS:
+            message = f"expected {RECIPE_FIELDS} fields, found {len(row)}"
+            errors.append(source.error(i, None, len(row), message))
+    return [rows[i] for i in valid], source.subset(valid)
+
+
+def convert_columns(rows, source, errors):
+    """
+    Converts the rows into Recipes one column at a time.
+
+    Only a column that fails to convert is gone through value by value, to
+    find the bad values. Rows with a bad value are reported in `errors` and
+    left out.
+
+    Returns:
+        The Recipes of the rows that converted.
+    """
+    if not rows:
+        return []
+    columns = list(zip(*rows))
+    converted = []
+    bad = set()
+    for field, column, convert in RECIPE_SCHEMA:
+        values = columns[column]
+        if convert is None:
+            converted.append(values)
+            continue
         try:
-            last_age = int(line_parsed[11])
+            converted.append(convert(values))
         except ValueError:
-            print(f"Error: Invalid last_age value '{line_parsed[11]}' in line: {tline}")
-            return None
-
-        recipe_data = {
-            "name": line_parsed[1],
-            "template_name": line_parsed[2],
-            "res_amount": cost,  # res_amount is the same as cost
-            "time": time,
-            "category": line_parsed[7],
-            "age1": age1,
-            "age2": age2,
-            "age3": age3,
-            "last_age": last_age,
-            "material": otype,
-        }
-        return recipe_data
+            checked = []
+            for i, value in enumerate(values):
+                try:
+                    checked.extend(convert((value,)))
+                except ValueError:
+                    checked.append(None)
+                    bad.add(i)
+                    errors.append(source.error(i, field, value, f"invalid {field} value"))
+            converted.append(checked)
+    recipes = list(map(Recipe._make, zip(*converted)))
+    if bad:
+        return [recipe for i, recipe in enumerate(recipes) if i not in bad]
+    return recipes
 
 
-if __name__ == "__main__":
-    masterdir = os.path.normpath(os.getcwd() + os.sep + os.pardir).replace("\\", "/")
-    outputdir = masterdir + "/recipe-converter/"
-    currdir = os.getcwd()
+@contextmanager
+def _gc_paused():
+    """
+    Turns off the garbage collector. Every recipe parsed is kept, so the
+    collections set off by creating them would only scan them again and again.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
 
-    file = open("{}/config.txt".format(masterdir), "r")
-    lines = file.readlines()
-    path1 = lines[1].replace("\\", "/").replace("\n", "")  # civ folder
-    file.close()
 
-    if path1 == "":
-        print("Error! No configs found.")
-        sys.exit()
+def parse_recipes(stream):
+    """
+    Reads a recipe list, grouping the recipes by material.
 
+    The file is read, split and converted BATCH_SIZE lines at a time.
+
+    Returns:
+        A tuple (all_recipes, by_material, errors): the Recipes in file
+        order, {material: [Recipes]} in order of first appearance, and the
+        validation errors sorted by line.
+    """
+    errors = []
     all_recipes = []
-    material_list = []
-    rfile = open("{}/config/crafting/material_recipes_global.txt".format(path1), "r")
-    rlines = rfile.readlines()
-    print("Reading recipe list...")
-    for line in rlines:
-        line = line.replace("\n", "")
-        if line.find("RECIPE: ", 0, 10) != -1:
-            if line != "":
-                tline = line.replace("RECIPE: ", "")
-                line_parsed = tline.split(",")
-                recipe_data = parse_line(line, line_parsed)
-                if recipe_data:
-                    all_recipes.append(recipe_data)
-                    otype = recipe_data["material"]
-                    if otype not in material_list:
-                        material_list.append(otype)
-                        print("Added new material {}".format(otype))
-
-    print("	done")
-    # Create the 'recipes' directory if it doesn't exist
-    recipes_dir = os.path.join(outputdir, "recipes")
+    by_material = {}
+    with _gc_paused():
+        for batch in RecipeLines.read_batches(stream, BATCH_SIZE):
+            rows, batch = read_recipe_rows(batch, errors)
+            recipes = convert_columns(rows, batch, errors)
+            all_recipes.extend(recipes)
+            for recipe in recipes:
+                group = by_material.get(recipe.material)
+                if group is None:
+                    by_material[recipe.material] = group = []
+                group.append(recipe)
+    errors.sort(key=lambda error: error["line"])
+    return all_recipes, by_material, errors
+
+
+def _digest(recipes):
+    return hashlib.blake2b(repr(recipes).encode("utf-8"), digest_size=16).hexdigest()
+
+
+def material_digests(by_material):
+    """A digest of the recipes of every material (used by --watch to find the changed ones)."""
+    return {material: _digest(recipes) for material, recipes in by_material.items()}
+
+
+def _write_json(path, recipes):
+    text = json.dumps([recipe.as_dict() for recipe in recipes], indent=4)
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def write_recipes(recipes_dir, all_recipes, by_material, materials=None, jobs=8, full=True):
+    """
+    Writes recipes_full.json and one <material>.json per material.
+
+    Args:
+        materials: Only write these material files (None for all).
+        jobs: Number of files written at the same time.
+        full: Write recipes_full.json.
+
+    Returns:
+        The number of material files written.
+    """
     os.makedirs(recipes_dir, exist_ok=True)
+    tasks = []
+    if full:
+        tasks.append((os.path.join(recipes_dir, "recipes_full.json"), all_recipes))
+    for material, recipes in by_material.items():
+        if materials is None or material in materials:
+            tasks.append((os.path.join(recipes_dir, f"{material}.json"), recipes))
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        for future in [executor.submit(_write_json, path, data) for path, data in tasks]:
+            future.result()
+    return len(tasks) - full
+
+
+def write_error_report(recipes_dir, errors, source):
+    """Writes the validation errors to recipes/errors.json (removing an old report if there are none)."""
+    report_path = os.path.join(recipes_dir, "errors.json")
+    if not errors:
+        if os.path.exists(report_path):
+            os.remove(report_path)
+        return None
+    with open(report_path, "w") as f:
+        json.dump({"source": source, "count": len(errors), "errors": errors}, f, indent=4)
+    return report_path
+
+
+def convert(recipe_file, recipes_dir, jobs=8, previous=None):
+    """
+    Parses the recipe file and writes the JSON files.
+
+    Args:
+        previous: The digests returned by the last run; only the files
+            whose recipes changed since then are written again. The error
+            report is always written.
+
+    Returns:
+        The digests of the material files and of recipes_full.json, to pass
+        as `previous` on the next run.
+    """
+    with instrumentation.stage("parse"), open(recipe_file, "r") as rfile:
+        all_recipes, by_material, errors = parse_recipes(rfile)
+    with instrumentation.stage("digest"):
+        digests = material_digests(by_material)
+        # Recipes moved between materials change the full list only
+        full_digest = _digest(all_recipes)
+    instrumentation.count("recipes", len(all_recipes))
+    instrumentation.count("invalid lines", len(errors))
+
+    if previous is None:
+        for material in by_material:
+            print("Added new material {}".format(material))
+        changed = None
+        full = True
+    else:
+        previous_digests = previous["materials"]
+        changed = {m for m, digest in digests.items() if previous_digests.get(m) != digest}
+        full = previous["full"] != full_digest
+        for material in previous_digests.keys() - digests.keys():
+            stale = os.path.join(recipes_dir, f"{material}.json")
+            if os.path.exists(stale):
+                os.remove(stale)
+            print(f"Removed material {material}")
 
-    # Write ALL recipes to recipes_full.json
-    with open(os.path.join(recipes_dir, "recipes_full.json"), "w") as full_recipes_file:
-        json.dump(all_recipes, full_recipes_file, indent=4)
-        print("All recipes written to recipes_full.json")
+    if changed is None or changed or full:
+        with instrumentation.stage("write"):
+            written = write_recipes(recipes_dir, all_recipes, by_material, changed, jobs, full)
+        print(
+            f"{len(all_recipes)} recipes, {written} of {len(by_material)} material files "
+            f"written{'' if full else ' (recipes_full.json unchanged)'}"
+        )
+    with instrumentation.stage("error report"):
+        report = write_error_report(recipes_dir, errors, recipe_file)
+    if report:
+        print(f"{len(errors)} invalid lines, see {report}")
+    return {"materials": digests, "full": full_digest}
 
-    for material in material_list:
-        print("Writing {} recipes...".format(material))
-        material_recipes = []
-        for recipe in all_recipes:
-            if recipe["material"] == material:
-                material_recipes.append(recipe)
 
-        with open(os.path.join(recipes_dir, f"{material}.json"), "w") as crafting_file:
-            json.dump(material_recipes, crafting_file, indent=4)
+def watch(recipe_file, recipes_dir, jobs=8, interval=1.0):
+    """Converts the recipe file, then again every time it changes."""
+    digests = convert(recipe_file, recipes_dir, jobs)
+    stamp = os.stat(recipe_file).st_mtime_ns
+    print(f"Watching {recipe_file} (Ctrl+C to stop)...")
+    try:
+        while True:
+            time.sleep(interval)
+            try:
+                current = os.stat(recipe_file).st_mtime_ns
+            except FileNotFoundError:
+                continue
+            if current != stamp:
+                stamp = current
+                digests = convert(recipe_file, recipes_dir, jobs, previous=digests)
+    except KeyboardInterrupt:
+        pass
 
+
+def main(argv=None):
+    masterdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    outputdir = os.path.join(masterdir, "recipe-converter")
+
+    parser = argparse.ArgumentParser(
+        description="Converts Civ13's material_recipes_global.txt into JSON files."
+    )
+    parser.add_argument(
+        "--input", help="the recipe file (default: from the civ folder in config.txt)"
+    )
+    parser.add_argument(
+        "--output",
+        default=os.path.join(outputdir, "recipes"),
+        help="the output directory (default: recipes/)",
+    )
+    parser.add_argument(
+        "--jobs", type=int, default=8, help="number of files written at the same time"
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="keep running and rewrite the materials whose recipes change",
+    )
+    parser.add_argument(
+        "--interval", type=float, default=1.0, help="seconds between checks with --watch"
+    )
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    recipe_file = args.input
+    if recipe_file is None:
+        with open(os.path.join(masterdir, "config.txt"), "r") as file:
+            lines = file.readlines()
+        path1 = lines[1].replace("\\", "/").replace("\n", "")  # civ folder
+        if path1 == "":
+            print("Error! No configs found.")
+            sys.exit()
+        recipe_file = "{}/config/crafting/material_recipes_global.txt".format(path1)
+
+    print("Reading recipe list...")
+    with instrumentation.instrument("recipe-converter", args, argv):
+        if args.watch:
+            watch(recipe_file, args.output, args.jobs, args.interval)
+        else:
+            convert(recipe_file, args.output, args.jobs)
     print("All finished.")
-    sys.exit()
+
+
+if __name__ == "__main__":
+    main()